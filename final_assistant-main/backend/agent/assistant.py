@@ -1,4 +1,3 @@
-import openai
 import logging
 import re
 import json
@@ -6,49 +5,82 @@ import io
 import base64
 import os
 import unicodedata
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
 from functools import lru_cache
 from decimal import Decimal
 from datetime import datetime
-from typing import List, Dict, Optional, Any, Tuple
+from typing import List, Dict, Optional, Any, Tuple, Iterator
 from pathlib import Path
 
 # Imports database
 from config.database import get_db_connection, get_db, CustomSQLDatabase, get_schema
 
 # Imports agent modules
-from agent.llm_utils import ask_llm 
-from langchain.prompts import PromptTemplate
+from agent.llm_utils import ask_llm, chat_completion, stream_chat_completion, get_profile, discard_cached_completion
+from langchain_core.prompts import PromptTemplate
 from agent.template_matcher.matcher import SemanticTemplateMatcher
 from agent.cache_manager import CacheManager
 from agent.cache_manager1 import CacheManager1
+from agent.domain_classifier import DomainClassifier, llm_select_domains
+from agent.result_renderer import ResultRenderer, wants_analysis
+from agent.result_summarizer import ResultSummarizer, count_tokens
+from agent.prompt_fragments import PromptFragments, fragment_tokens
+from agent.join_graph import JoinGraph
+from agent.column_ranker import ColumnRanker
+from agent.startup_snapshot import StartupSnapshot, file_signature
+from agent.sql_repair import SqlRepairContext, parse_mysql_error
+from agent.sql_validator import SqlValidator
+from agent.usage_tracker import get_usage_tracker, usage_context, set_path, current_request_usage, current_user_id
+from agent.result_store import get_result_store, set_current_page
+from agent.result_cache import ResultCache
+from agent.sql_params import bind_template, inline_params
+from agent.resilience import LLMUnavailableError, deadline_context, get_breaker
+from utils.sql_utils import sql_fingerprint
+from utils.lazy_import import lazy_import
 
 
 # Imports security and templates
-from agent.prompts.templates import  ADMIN_PROMPT_TEMPLATE, PARENT_PROMPT_TEMPLATE
+from agent.prompts.templates import  ADMIN_PROMPT_TEMPLATE, PARENT_PROMPT_TEMPLATE, SINGLE_CALL_SYSTEM_PROMPT
 
-# Imports for graphs and data processing
-import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt
-from tabulate import tabulate
 import MySQLdb
 import traceback
 
 from agent.conversation_history import ConversationHistory
 
-# Configure matplotlib for server environment
-matplotlib.use('Agg')  
-plt.switch_backend('Agg')
+
+def _use_agg_backend():
+    """Backend sans affichage, fixé avant le premier import de pyplot (environnement serveur)"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# Graphiques et tableaux : importés au premier graphique / tableau, pas au démarrage du worker
+pd = lazy_import('pandas')
+plt = lazy_import('matplotlib.pyplot', before_import=_use_agg_backend)
+tabulate = lazy_import('tabulate')
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Stratégie de génération du dernier SQL de la requête en cours (single_call / two_step) :
+# propre à chaque requête, l'instance de l'assistant étant partagée entre les threads
+_sql_strategy: ContextVar[str] = ContextVar("sql_strategy", default="")
+
 class SQLAssistant:
     
-    def __init__(self, db=None, model="gpt-4o", temperature=0.3, max_tokens=500):
+    def __init__(self, db=None, model=None, temperature=0.3, max_tokens=500):
+        init_start = time.perf_counter()
+
+        # Instantané de démarrage : catalogue, templates et index des caches sans recalcul
+        self.snapshot = StartupSnapshot()
+        snapshot = self.snapshot.load()
 
         # Configuration base
         self.db = db if db is not None else get_db_connection()
+        # Modèle imposé au formatage et à la correction ; None = profils par étape (config/llm_profiles.json)
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
@@ -57,11 +89,17 @@ class SQLAssistant:
         self.last_generated_sql = ""
         self.query_history = []
         self.conversation_history = []
-        self.cache = CacheManager()
-        self.cache1 = CacheManager1()
+        self.cache = CacheManager(index_state=snapshot.get("cache_index"))
+        self.cache1 = CacheManager1(index_state=snapshot.get("cache1_index"))
+        for component, manager in (("cache_index", self.cache), ("cache1_index", self.cache1)):
+            if manager.index_restored:
+                self.snapshot.mark_restored(component)
         
         # Configuration des coûts et schéma
         self.cost_per_1k_tokens = 0.005
+        get_usage_tracker().default_price_per_1k = self.cost_per_1k_tokens
+        if self.db.schema_catalog.restore(snapshot.get("schema_catalog")):
+            self.snapshot.mark_restored("schema_catalog")
         self.schema = self._safe_get_schema()
         
         # Chargement des configurations
@@ -69,10 +107,70 @@ class SQLAssistant:
         self.domain_descriptions = self._safe_load_domain_descriptions()
         self.domain_to_tables_mapping = self._safe_load_domain_to_tables_mapping()
         self.ask_llm = ask_llm
+        self.domain_classifier = self._build_domain_classifier()
+        self.prompt_fragments = self._build_prompt_fragments()
+
+        # Graphe des jointures (clés étrangères + relations des prompts) : seules les tables
+        # sur les chemins entre les entités de la question sont envoyées au prompt SQL
+        self.join_graph_enabled = os.getenv('JOIN_GRAPH_PRUNING', 'true').lower() not in ('0', 'false', 'no')
+        self.join_graph = JoinGraph(
+            self.db.schema_catalog,
+            "\n".join([ADMIN_PROMPT_TEMPLATE.template, PARENT_PROMPT_TEMPLATE.template])
+        )
+
+        # Classement des colonnes : seules les colonnes pertinentes (+ clés) des tables larges
+        # sont décrites, l'usage dans les requêtes en cache comptant dans le score
+        self.column_ranking_enabled = os.getenv('COLUMN_RANKING', 'true').lower() not in ('0', 'false', 'no')
+        self.column_ranker = ColumnRanker(
+            self.db.schema_catalog,
+            [item.get('sql_template', '') for cache in (self.cache.cache, self.cache1.cache) for item in cache.values()]
+        )
+
+        # Correction des requêtes en erreur : contexte ciblé sur l'erreur MySQL (tables concernées, noms proches)
+        self.sql_repair = SqlRepairContext(self.db.schema_catalog)
+
+        # Validation locale du SQL contre le catalogue : fautes de frappe corrigées, erreurs
+        # de tables/colonnes détectées sans aller-retour MySQL
+        self.sql_prevalidation_enabled = os.getenv('SQL_PREVALIDATION', 'true').lower() not in ('0', 'false', 'no')
+        self.sql_validator = SqlValidator(self.db.schema_catalog)
+
+        # Exécution SQL par curseur serveur : au plus sql_max_rows lignes lues (par lots),
+        # première page renvoyée, la suite conservée dans le ResultStore derrière un jeton
+        self.sql_max_rows = int(os.getenv('SQL_MAX_ROWS', '2000'))
+        self.sql_page_size = int(os.getenv('SQL_PAGE_SIZE', '200'))
+        self.sql_fetch_batch = int(os.getenv('SQL_FETCH_BATCH', '500'))
+        # Total au-delà du plafond : count (COUNT(*) côté serveur), drain (lecture sans conservation), none
+        self.sql_count_strategy = os.getenv('SQL_COUNT_STRATEGY', 'count').lower()
+        self.result_store = get_result_store()
+        # Cache des résultats (empreinte SQL + paramètres), TTL par table selon le domaine
+        self.result_cache = ResultCache(self.domain_to_tables_mapping, self.db.schema_catalog)
+
+        # Mode appel unique (domaines + SQL en une réponse JSON), activable par rôle
+        self.single_call_roles = {
+            role.strip() for role in os.getenv('LLM_SINGLE_CALL_ROLES', '').split(',') if role.strip()
+        }
+        self.single_call_min_confidence = float(os.getenv('LLM_SINGLE_CALL_MIN_CONFIDENCE', '0.6'))
+        # Seules les tables des domaines les mieux classés sont décrites dans le prompt
+        self.single_call_max_domains = int(os.getenv('LLM_SINGLE_CALL_MAX_DOMAINS', '4'))
+
+        # Exécution spéculative des quasi-correspondances du cache (zone grise sous le seuil)
+        # pendant la génération IA : résultats réutilisés si le SQL de l'IA a la même empreinte
+        self.speculative_enabled = os.getenv('SPECULATIVE_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+        self.speculative_min_score_admin = float(os.getenv('SPECULATIVE_MIN_SCORE_ADMIN', '0.75'))
+        self.speculative_min_score_parent = float(os.getenv('SPECULATIVE_MIN_SCORE_PARENT', '0.7'))
+        self.speculative_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('SPECULATIVE_MAX_WORKERS', '4')), thread_name_prefix='speculative-sql'
+        )
+        self.speculation_stats = {"started": 0, "reused": 0, "discarded": 0}
+        self._speculation_lock = threading.Lock()
         
+        # Rendu déterministe des résultats (le LLM ne sert qu'aux questions d'analyse)
+        self.result_renderer = ResultRenderer()
+        self.result_summarizer = ResultSummarizer(model=model or get_profile("format")["model"])
+
         # Template matcher et templates questions
         self.template_matcher = SemanticTemplateMatcher()
-        self.templates_questions = self._safe_load_templates()
+        self.templates_questions = self._safe_load_templates(snapshot.get("templates"))
         self.last_generated_sql = ""
         self.query_history = []
         self.conversation_history_old = []  # Renommer pour éviter confusion
@@ -81,15 +179,49 @@ class SQLAssistant:
         # 🆕 NOUVEAU : Gestionnaire d'historique persistant
         self.conversation_manager = ConversationHistory()
         
-        logger.info("✅ SQLAssistant initialisé avec succès")
+        self.init_ms = round((time.perf_counter() - init_start) * 1000, 1)
+        logger.info(f"✅ SQLAssistant initialisé avec succès ({self.init_ms} ms, "
+                    f"depuis l'instantané: {', '.join(self.snapshot.stats['restored']) or 'rien'})")
+        self._start_snapshot_refresh()
     
     def _safe_get_schema(self):
+        """Noms des tables, depuis le catalogue du schéma (restauré ou chargé en une requête)"""
         try:
-            return self.db.get_schema() if self.db else []
+            if not self.db:
+                return []
+            self.db.schema_catalog.ensure_fresh()
+            return self.db.schema_catalog.table_names()
         except Exception as e:
             logger.warning(f"⚠️ Impossible de récupérer le schéma: {e}")
             return []
 
+    def _start_snapshot_refresh(self):
+        """Lance le rafraîchissement de l'instantané en arrière-plan (le démarrage n'attend pas la base)"""
+        if not self.snapshot.enabled:
+            return
+        threading.Thread(target=self.refresh_snapshot, name="snapshot-refresh", daemon=True).start()
+
+    def refresh_snapshot(self) -> bool:
+        """Revérifie le schéma auprès de la base, re-rend les fragments si besoin et réenregistre l'instantané"""
+        try:
+            self.db.schema_catalog.ensure_fresh(force=True)
+            self.prompt_fragments.warm()
+            return self.snapshot.save(self.export_snapshot())
+        except Exception as e:
+            logger.warning(f"⚠️ Rafraîchissement de l'instantané de démarrage impossible: {e}")
+            return False
+
+    def export_snapshot(self) -> Dict[str, Any]:
+        """État dérivé à sérialiser dans l'instantané de démarrage"""
+        components = {
+            "cache_index": self.cache.export_index(),
+            "cache1_index": self.cache1.export_index(),
+            "templates": {"signature": self._templates_signature, "templates": self.templates_questions},
+        }
+        if self.db.schema_catalog.tables:
+            components["schema_catalog"] = self.db.schema_catalog.export_state()
+        return components
+
 
     def _safe_load_domain_descriptions(self) -> dict:
         """Charge les descriptions de domaine avec gestion d'erreurs"""
@@ -117,10 +249,98 @@ class SQLAssistant:
             logger.error(f"❌ Erreur chargement domain mapping: {e}")
             return {}
 
-    def _safe_load_templates(self) -> list:
-        """Charge les templates de questions avec gestion d'erreurs"""
+    def _build_domain_classifier(self) -> DomainClassifier:
+        """Construit le classifieur local de domaines à partir des descriptions et des caches SQL"""
+        cached_queries = [
+            (item.get('question_template', ''), item.get('sql_template', ''))
+            for cache in (self.cache.cache, self.cache1.cache)
+            for item in cache.values()
+        ]
+        return DomainClassifier(
+            self.domain_descriptions,
+            self.domain_to_tables_mapping,
+            cached_queries=cached_queries
+        )
+
+    def _build_prompt_fragments(self) -> PromptFragments:
+        """Fragments de prompt par domaine, pré-rendus depuis le catalogue du schéma"""
+        fragments = PromptFragments(
+            self.db.schema_catalog,
+            self.domain_descriptions,
+            self.domain_to_tables_mapping
+        )
+        try:
+            fragments.warm()
+        except Exception as e:
+            logger.error(f"❌ Pré-rendu des fragments de prompt impossible: {e}")
+        return fragments
+
+    def _build_sql_prompt(self, stage: str, prompt_template: PromptTemplate, question: str,
+                          domains: Optional[List[str]], **prompt_vars) -> str:
+        """Assemble un prompt SQL depuis les fragments mémorisés (temps et taille suivis par étape)"""
+        start = time.perf_counter()
+        domain_table_info = None
+        if domains is None:
+            # Appel unique : signatures des domaines classés par le classifieur local (tous si aucun)
+            ranked = self.domain_classifier.rank(question, self.single_call_max_domains)
+            table_info = self.prompt_fragments.signatures(ranked)
+            domain_descriptions = "\n".join(f"{dom}: {desc}" for dom, desc in self.domain_descriptions.items()
+                                            if not ranked or dom in ranked)
+        else:
+            domain_table_info, domain_descriptions = self.prompt_fragments.for_domains(domains)
+            table_info = self._prune_table_info(question, domains, domain_table_info)
+
+        prompt = prompt_template.format(
+            input=question,
+            table_info=table_info,
+            relevant_domain_descriptions=domain_descriptions,
+            **prompt_vars
+        )
+        build_ms = (time.perf_counter() - start) * 1000
+
+        table_info_tokens = None
+        if domain_table_info is not None:
+            after = fragment_tokens(table_info) if table_info is domain_table_info else count_tokens(table_info)
+            table_info_tokens = (fragment_tokens(domain_table_info), after)
+        get_usage_tracker().record_prompt(stage, build_ms, len(prompt), table_info_tokens)
+        return prompt
+
+    def _prune_table_info(self, question: str, domains: List[str], table_info: str) -> str:
+        """
+        Réduit table_info aux tables du plan de jointure et aux colonnes pertinentes
+        (table_info des domaines si les deux sont désactivés ou en cas d'erreur)
+        """
+        if not (self.join_graph_enabled or self.column_ranking_enabled):
+            return table_info
+        try:
+            tables = self.get_tables_from_domains(domains, self.domain_to_tables_mapping)
+            tables = tables or self.db.schema_catalog.table_names()
+            joins, join_columns = "", {}
+            if self.join_graph_enabled:
+                plan = self.join_graph.plan(question, tables)
+                tables, joins, join_columns = plan.tables, plan.render_joins(), plan.columns()
+
+            if self.column_ranking_enabled:
+                pruned = self.column_ranker.render(question, tables, join_columns)
+            else:
+                pruned = self.prompt_fragments.for_tables(tables)
+            return f"{pruned}\n\n{joins}" if joins else pruned
+        except Exception as e:
+            logger.warning(f"⚠️ Sélection des tables/colonnes impossible, tables des domaines conservées: {e}")
+            return table_info
+
+    def _safe_load_templates(self, snapshot_state: Optional[Dict[str, Any]] = None) -> list:
+        """Charge les templates de questions avec gestion d'erreurs (depuis l'instantané si le fichier est inchangé)"""
         try:
             templates_path = Path(__file__).parent/ 'templates_questions.json'
+            self._templates_signature = file_signature(templates_path)
+
+            if snapshot_state and snapshot_state.get("signature") == self._templates_signature:
+                templates = snapshot_state.get("templates", [])
+                if templates:
+                    self.template_matcher.load_templates(templates)
+                self.snapshot.mark_restored("templates")
+                return templates
             
             if not templates_path.exists():
                 logger.info(f"⚠️ Fichier non trouvé, création: {templates_path}")
@@ -224,6 +444,143 @@ class SQLAssistant:
             
     #         return "", error_message, None, conversation_id or 0
 
+    PARENT_ATTESTATION_REFUSAL = """❌ Accès refusé : Génération de documents officiels réservée aux administrateurs.
+
+    📋 Vous pouvez consulter :
+    • Les notes et résultats de vos enfants
+    • L'emploi du temps et les absences  
+    • Les informations de classe
+    • Les actualités de l'école
+
+    Pour obtenir une attestation officielle, veuillez contacter l'administration."""
+
+    DEGRADED_MODE_MESSAGE = """⚠️ Mode dégradé : le service IA est momentanément indisponible.
+Seules les questions déjà connues (requêtes en cache et modèles de questions) peuvent être traitées pour le moment.
+Veuillez reformuler une question fréquente ou réessayer dans quelques instants."""
+
+    DEGRADED_NOTICE = "⚠️ Mode dégradé : service IA indisponible, réponse servie depuis les requêtes connues.\n\n"
+
+    def is_degraded(self) -> bool:
+        """True tant que le disjoncteur LLM est ouvert : seuls caches et templates sont servis"""
+        return get_breaker().is_open()
+
+    def _check_roles(self, roles: List[str]) -> Optional[str]:
+        """Retourne le message de refus si aucun rôle autorisé n'est fourni"""
+        if not roles:
+            return "❌ Accès refusé : Aucun rôle fourni"
+
+        valid_roles = ['ROLE_SUPER_ADMIN', 'ROLE_PARENT']
+        if not any(role in valid_roles for role in roles):
+            return f"❌ Accès refusé : Rôles fournis {roles}, requis {valid_roles}"
+        return None
+
+    @staticmethod
+    def _primary_role(roles: Optional[List[str]]) -> Optional[str]:
+        """Rôle retenu pour le pipeline (admin prioritaire), utilisé pour le suivi de consommation"""
+        roles = roles or []
+        for role in ('ROLE_SUPER_ADMIN', 'ROLE_PARENT'):
+            if role in roles:
+                return role
+        return roles[0] if roles else None
+
+    def ask_question_stream(self, question: str, user_id: Optional[int] = None,
+                            roles: Optional[List[str]] = None,
+                            conversation_id: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Variante streaming de ask_question_with_history.
+        Produit des événements (nom, données) dans l'ordre des étapes :
+        sql (requête retenue et sa source), rows (nombre de lignes), token (fragments de la réponse),
+        graph (graphique éventuel), puis done (réponse complète, conversation_id et consommation LLM).
+        """
+        with usage_context(role=self._primary_role(roles), user_id=user_id), deadline_context():
+            for event, payload in self._ask_question_stream(question, user_id, roles, conversation_id):
+                if event == "done":
+                    payload["usage"] = current_request_usage()
+                    payload["degraded"] = self.is_degraded()
+                yield event, payload
+
+    def _ask_question_stream(self, question: str, user_id: Optional[int] = None,
+                             roles: Optional[List[str]] = None,
+                             conversation_id: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if user_id is None:
+            user_id = 0
+        if roles is None:
+            roles = []
+
+        role_error = self._check_roles(roles)
+        if role_error:
+            yield "token", {"text": role_error}
+            yield "done", {"sql_query": "", "response": role_error, "graph": None, "conversation_id": 0}
+            return
+
+        is_parent = 'ROLE_SUPER_ADMIN' not in roles
+        sql_query, graph_data, response_parts = "", None, []
+        # Refus d'attestation enregistré comme message système, comme dans ask_question_with_history
+        refused = self.is_refused_attestation(question, roles)
+
+        try:
+            if conversation_id is None:
+                conversation_id = self.conversation_manager.create_conversation(user_id, question)
+            self.conversation_manager.add_message(conversation_id, 'user', question)
+
+            if refused:
+                logger.warning(f"🚫 Tentative attestation bloquée - Utilisateur {user_id}")
+                plan = self._plan("", "pdf", message=self.PARENT_ATTESTATION_REFUSAL)
+            elif is_parent:
+                plan = self._plan_parent_question(question, user_id)
+            else:
+                plan = self._plan_super_admin_question(question)
+
+            sql_query = plan['sql']
+            yield "sql", {"sql_query": sql_query, "source": plan['source']}
+
+            if plan['message'] is not None:
+                response_parts.append(plan['message'])
+                yield "token", {"text": plan['message']}
+            else:
+                data = plan['result']['data']
+                page = plan['result'].get('page')
+                yield "rows", {"count": len(data), "total": plan['result'].get('total_rows', len(data)), "page": page}
+
+                if self.is_degraded():
+                    response_parts.append(self.DEGRADED_NOTICE)
+                    yield "token", {"text": self.DEGRADED_NOTICE}
+
+                for token in self.stream_response_with_ai(data, question, sql_query, result=plan['result']):
+                    response_parts.append(token)
+                    yield "token", {"text": token}
+                if page:
+                    response_parts.append(self._page_notice(page))
+                    yield "token", {"text": self._page_notice(page)}
+
+                if plan['cache'] is not None:
+                    plan['cache'].cache_query(question, sql_query)
+                    self.column_ranker.learn(sql_query)
+
+                graph_data = self.generate_graph_if_relevant(data, question)
+                if graph_data:
+                    yield "graph", {"graph": graph_data}
+
+            formatted_response = "".join(response_parts).strip()
+            self.conversation_manager.add_message(
+                conversation_id, 'system' if refused else 'assistant', formatted_response, sql_query, graph_data
+            )
+            logger.info(f"✅ Question traitée en streaming et sauvegardée - Conversation {conversation_id}")
+
+        except Exception as e:
+            logger.error(f"Erreur dans ask_question_stream: {e}")
+            formatted_response = f"❌ Erreur : {str(e)}"
+            yield "error", {"message": formatted_response}
+            if conversation_id:
+                self.conversation_manager.add_message(conversation_id, 'system', formatted_response)
+
+        yield "done", {
+            "sql_query": sql_query,
+            "response": formatted_response,
+            "graph": graph_data,
+            "conversation_id": conversation_id or 0
+        }
+
     def ask_question_with_history(self, question: str, user_id: Optional[int] = None, 
                              roles: Optional[List[str]] = None, 
                              conversation_id: Optional[int] = None) -> tuple[str, str, Optional[str], int]:
@@ -232,50 +589,40 @@ class SQLAssistant:
         AVEC RESTRICTION D'ATTESTATION pour les parents
         Retourne (sql_query, formatted_response, graph_data, conversation_id)
         """
+        with usage_context(role=self._primary_role(roles), user_id=user_id), deadline_context():
+            return self._ask_question_with_history(question, user_id, roles, conversation_id)
+
+    def _ask_question_with_history(self, question: str, user_id: Optional[int] = None,
+                                   roles: Optional[List[str]] = None,
+                                   conversation_id: Optional[int] = None) -> tuple[str, str, Optional[str], int]:
         if user_id is None:
             user_id = 0
         if roles is None:
             roles = []
 
         # Validation des rôles (identique à la version existante)
-        if not roles:
-            return "", "❌ Accès refusé : Aucun rôle fourni", None, 0
-        
-        valid_roles = ['ROLE_SUPER_ADMIN', 'ROLE_PARENT']
-        has_valid_role = any(role in valid_roles for role in roles)
-        
-        if not has_valid_role:
-            return "", f"❌ Accès refusé : Rôles fournis {roles}, requis {valid_roles}", None, 0
+        role_error = self._check_roles(roles)
+        if role_error:
+            return "", role_error, None, 0
 
         # 🚫 AJOUT: Vérification spéciale pour les parents qui demandent des attestations
-        if 'ROLE_PARENT' in roles and 'ROLE_SUPER_ADMIN' not in roles:
-            # Vérifier si c'est une demande d'attestation
-            pdf_request = self._check_for_pdf_request(question)
-            if pdf_request:
-                error_message = """❌ Accès refusé : Génération de documents officiels réservée aux administrateurs.
-
-    📋 Vous pouvez consulter :
-    • Les notes et résultats de vos enfants
-    • L'emploi du temps et les absences  
-    • Les informations de classe
-    • Les actualités de l'école
-
-    Pour obtenir une attestation officielle, veuillez contacter l'administration."""
+        if self.is_refused_attestation(question, roles):
+            error_message = self.PARENT_ATTESTATION_REFUSAL
+            
+            # Gérer la conversation
+            try:
+                if conversation_id is None:
+                    conversation_id = self.conversation_manager.create_conversation(user_id, question)
                 
-                # Gérer la conversation
-                try:
-                    if conversation_id is None:
-                        conversation_id = self.conversation_manager.create_conversation(user_id, question)
-                    
-                    self.conversation_manager.add_message(conversation_id, 'user', question)
-                    self.conversation_manager.add_message(conversation_id, 'system', error_message)
-                    
-                    logger.warning(f"🚫 Tentative attestation bloquée - Utilisateur {user_id}")
-                    return "", error_message, None, conversation_id
-                    
-                except Exception as e:
-                    logger.error(f"Erreur gestion conversation refus: {e}")
-                    return "", error_message, None, 0
+                self.conversation_manager.add_message(conversation_id, 'user', question)
+                self.conversation_manager.add_message(conversation_id, 'system', error_message)
+                
+                logger.warning(f"🚫 Tentative attestation bloquée - Utilisateur {user_id}")
+                return "", error_message, None, conversation_id
+                
+            except Exception as e:
+                logger.error(f"Erreur gestion conversation refus: {e}")
+                return "", error_message, None, 0
 
         try:
             # 🆕 GESTION DE LA CONVERSATION
@@ -312,8 +659,165 @@ class SQLAssistant:
                 self.conversation_manager.add_message(conversation_id, 'system', error_message)
             
             return "", error_message, None, conversation_id or 0
+    @staticmethod
+    def _plan(sql_query: str, source: str, result: Optional[Dict] = None,
+              message: Optional[str] = None, cache=None, error: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Résultat d'une étape de planification.
+        `message` est renseigné quand la réponse est déjà connue (refus, erreur, clarification) ;
+        sinon `result` contient les données et `cache` le cache où mémoriser la requête.
+        `error` garde l'erreur SQL brute pour la correction automatique.
+        """
+        return {"sql": sql_query, "source": source, "result": result,
+                "message": message, "cache": cache, "error": error}
+
+    def _execute_plan(self, sql_query: str, source: str, cache=None, params: tuple = ()) -> Dict[str, Any]:
+        """
+        Exécute le SQL retenu (paramétré si `params`) et retourne le plan correspondant ;
+        le SQL du plan porte les valeurs en littéraux (réponse, historique)
+        """
+        if self.sql_prevalidation_enabled:
+            checked = self.sql_validator.validate(sql_query)
+            if not checked.ok:
+                return self._plan(inline_params(sql_query, params), source,
+                                  message=f"❌ Erreur d'exécution SQL : {checked.error}", error=checked.error)
+            sql_query = checked.sql
+        display_sql = inline_params(sql_query, params)
+        try:
+            result = self.execute_sql_query(sql_query, params)
+        except Exception as db_error:
+            return self._plan(display_sql, source, message=f"❌ Erreur d'exécution SQL : {str(db_error)}",
+                              error=str(db_error))
+        if not result['success']:
+            return self._plan(display_sql, source, message=f"❌ Erreur d'exécution SQL : {result['error']}",
+                              error=result['error'])
+        return self._plan(display_sql, source, result=result, cache=cache)
+
+    @staticmethod
+    def _render_cached_sql(sql_template: str, variables: Dict[str, str]) -> Optional[Tuple[str, tuple]]:
+        """
+        Template du cache compilé en requête paramétrée : (sql avec %s, valeurs typées).
+        Les valeurs sont liées par le driver, jamais concaténées dans le SQL.
+        None si une valeur ne peut pas être liée (liste d'IDs hors IN) : le cache est ignoré.
+        """
+        try:
+            return bind_template(sql_template, variables)
+        except ValueError as e:
+            logger.warning(f"⚠️ Template du cache inutilisable: {e}")
+            return None
+
+    def _start_speculation(self, find_candidate, allowed=None) -> Optional[Dict[str, Any]]:
+        """
+        Lance en arrière-plan, en parallèle de l'appel LLM, la recherche puis l'exécution du SQL
+        candidat de la zone grise. `find_candidate` renvoie (sql_template, variables, score) ou None ;
+        `allowed` filtre les candidats (ex: contrôle d'accès parent). None si la spéculation est désactivée.
+        """
+        if not self.speculative_enabled:
+            return None
+
+        speculation = {"fingerprint": None, "prepared": threading.Event(),
+                       "resolved": False, "discarded": False}
+        # Le contexte de la requête (utilisateur, suivi de consommation) suit la tâche de fond :
+        # les jetons de page du résultat spéculatif appartiennent bien à l'utilisateur
+        speculation["future"] = self.speculative_executor.submit(
+            copy_context().run, self._run_speculation, speculation, find_candidate, allowed
+        )
+        return speculation
+
+    def _speculative_candidate(self, find_candidate, allowed=None) -> Optional[Tuple[str, tuple, str, float]]:
+        """Candidat exécutable : (sql paramétré, valeurs, sql affiché, score) ou None"""
+        try:
+            candidate = find_candidate()
+            if candidate is None:
+                return None
+            sql_template, variables, score = candidate
+            rendered = self._render_cached_sql(sql_template, variables)
+            if rendered is None:
+                return None
+            sql_query, params = rendered
+            display_sql = inline_params(sql_query, params)
+            if re.search(r'\{\w+\}', display_sql) or not self._validate_sql(display_sql):
+                return None
+            if allowed is not None and not allowed(display_sql):
+                return None
+            return sql_query, params, display_sql, score
+        except Exception as e:
+            logger.debug(f"🔮 Candidat spéculatif rejeté: {e}")
+            return None
+
+    def _run_speculation(self, speculation: Dict[str, Any], find_candidate, allowed) -> Optional[Dict]:
+        """Tâche de fond : publie l'empreinte du candidat dès qu'elle est connue, puis l'exécute"""
+        candidate = None
+        try:
+            candidate = self._speculative_candidate(find_candidate, allowed)
+            if candidate is not None:
+                speculation["fingerprint"] = sql_fingerprint(candidate[2])
+        finally:
+            speculation["prepared"].set()
+        if candidate is None or speculation["discarded"]:
+            return None
+
+        sql_query, params, _, score = candidate
+        logger.info(f"🔮 Exécution spéculative d'un candidat du cache (score {score:.2f})")
+        with self._speculation_lock:
+            self.speculation_stats["started"] += 1
+        return self.execute_sql_query(sql_query, params)
+
+    def _resolve_speculation(self, speculation: Optional[Dict[str, Any]], sql_query: str) -> Optional[Dict]:
+        """
+        Résultat spéculatif si le SQL de l'IA a la même empreinte que le candidat ; sinon abandonné
+        (y compris quand la recherche du candidat n'est pas terminée : l'IA n'attend jamais le cache)
+        """
+        if speculation is None:
+            return None
+        if (sql_query and speculation["prepared"].is_set()
+                and speculation["fingerprint"] == sql_fingerprint(sql_query)):
+            speculation["resolved"] = True
+            result = speculation["future"].result()
+            if result and result.get("success"):
+                logger.info("♻️ SQL de l'IA identique au candidat spéculatif : résultats réutilisés")
+                with self._speculation_lock:
+                    self.speculation_stats["reused"] += 1
+                return result
+        self._discard_speculation(speculation)
+        return None
+
+    def _discard_speculation(self, speculation: Optional[Dict[str, Any]]):
+        """Abandonne un candidat non retenu (annulé s'il n'a pas encore démarré)"""
+        if speculation is None or speculation["resolved"]:
+            return
+        speculation["resolved"] = True
+        speculation["discarded"] = True
+        speculation["future"].cancel()
+        if speculation["fingerprint"] is not None:
+            with self._speculation_lock:
+                self.speculation_stats["discarded"] += 1
+            logger.debug("🔮 Candidat spéculatif écarté")
+
+    def _finish_plan(self, plan: Dict[str, Any], question: str) -> tuple[str, str, Optional[str]]:
+        """Graphique + formatage d'un plan exécuté (mode bloquant)"""
+        if plan['message'] is not None:
+            return plan['sql'], plan['message'], None
+
+        data = plan['result']['data']
+        page = plan['result'].get('page')
+        set_current_page(page)
+        graph_data = self.generate_graph_if_relevant(data, question)
+        formatted_result = (self.format_response_with_ai(data, question, plan['sql'], result=plan['result'])
+                            + self._page_notice(page))
+        if self.is_degraded():
+            formatted_result = self.DEGRADED_NOTICE + formatted_result
+        if plan['cache'] is not None:
+            plan['cache'].cache_query(question, plan['sql'])
+            self.column_ranker.learn(plan['sql'])
+        return plan['sql'], formatted_result, graph_data
+
     def _process_super_admin_question(self, question: str) -> tuple[str, str, Optional[str]]:
         """Traite une question admin - VERSION CORRIGÉE"""
+        return self._finish_plan(self._plan_super_admin_question(question), question)
+
+    def _plan_super_admin_question(self, question: str) -> Dict[str, Any]:
+        """Choisit et exécute le SQL d'une question admin : cache → template → IA"""
         
         # Vérifier d'abord si c'est une demande d'attestation
         pdf_request = self._check_for_pdf_request(question)
@@ -327,7 +831,7 @@ class SQLAssistant:
                 # Récupérer les infos de l'étudiant
                 student_data = self.get_student_info_by_name(student_name)
                 if not student_data:
-                    return "", f"❌ Aucun élève trouvé avec le nom '{student_name}'", None
+                    return self._plan("", "pdf", message=f"❌ Aucun élève trouvé avec le nom '{student_name}'")
                 
                 # Préparer les données pour le PDF
                 student_data['nom_complet'] = f"{student_data['NomFr']} {student_data['PrenomFr']}"
@@ -336,92 +840,87 @@ class SQLAssistant:
                 # Générer le PDF
                 pdf_result = generator.generate(student_data)
                 if pdf_result['status'] != 'success':
-                    return "", "❌ Erreur lors de la génération du document", None
+                    return self._plan("", "pdf", message="❌ Erreur lors de la génération du document")
                 
                 pdf_url = f"/download-attestation/{pdf_result['filename']}"
-                return "", f"✅ Attestation générée pour {student_name}\n📄 Télécharger: {pdf_url}", None
+                return self._plan("", "pdf", message=f"✅ Attestation générée pour {student_name}\n📄 Télécharger: {pdf_url}")
                 
             except Exception as e:
                 logger.error(f"Erreur génération attestation: {e}")
-                return "", f"❌ Erreur lors de la génération: {str(e)}", None
+                return self._plan("", "pdf", message=f"❌ Erreur lors de la génération: {str(e)}")
         
         # Le reste du traitement normal pour les questions SQL...
         cached = self.cache.get_cached_query(question)
-        if cached:
-            sql_template, variables = cached
-            sql_query = sql_template
-            for column, value in variables.items():
-                sql_query = sql_query.replace(f"{{{column}}}", value)
+        rendered = self._render_cached_sql(*cached) if cached else None
+        if rendered:
+            sql_query, params = rendered
             
             logger.info("⚡ Requête admin récupérée depuis le cache")
-            try:
-                result = self.execute_sql_query(sql_query)
-                if result['success']:
-                    # 🎯 GÉNÉRATION DE GRAPHIQUE POUR CACHE
-                    graph_data = self.generate_graph_if_relevant(result['data'], question)
-                    formatted_result = self.format_response_with_ai(result['data'], question, sql_query)
-                    return sql_query, formatted_result, graph_data  # 🎯 3 VALEURS
-                else:
-                    return sql_query, f"❌ Erreur d'exécution SQL : {result['error']}", None
-            except Exception as db_error:
-                return sql_query, f"❌ Erreur d'exécution SQL : {str(db_error)}", None
+            set_path("cache")
+            return self._execute_plan(sql_query, "cache", params=params)
         
         # 2. Vérifier les templates existants
         template_match = self.find_matching_template(question)
         if template_match:
             logger.info("🔍 Template admin trouvé")
-            sql_query = self.generate_query_from_template(
-                template_match["template"],
-                template_match["variables"]
-            )
             try:
-                result = self.execute_sql_query(sql_query)
-                if result['success']:
-                    # 🎯 GÉNÉRATION DE GRAPHIQUE POUR TEMPLATE
-                    graph_data = self.generate_graph_if_relevant(result['data'], question)
-                    formatted_result = self.format_response_with_ai(result['data'], question, sql_query)
-                    return sql_query, formatted_result, graph_data  # 🎯 3 VALEURS
-                else:
-                    return sql_query, f"❌ Erreur d'exécution SQL : {result['error']}", None
-            except Exception as db_error:
-                return sql_query, f"❌ Erreur d'exécution SQL : {str(db_error)}", None
+                sql_query, params = self.generate_query_from_template(
+                    template_match["template"],
+                    template_match["variables"]
+                )
+            except ValueError as e:
+                logger.warning(f"⚠️ Template inutilisable, repli sur l'IA: {e}")
+            else:
+                set_path("template")
+                return self._execute_plan(sql_query, "template", params=params)
         
-        # 3. Génération AI + exécution + formatage
+        # 3. Génération AI + exécution (impossible en mode dégradé)
+        if self.is_degraded():
+            return self._plan("", "degraded", message=self.DEGRADED_MODE_MESSAGE)
+
+        set_path("llm")
+        speculation = self._start_speculation(
+            lambda: self.cache.get_candidate_query(question, self.speculative_min_score_admin)
+        )
         try:
-            # 🎯 GÉNÉRATION SQL MANQUANTE - AJOUT ICI
             sql_query = self.generate_sql_with_ai(question)
             
             if not sql_query:
-                return "", "❌ La requête générée est vide.", None
-                
-            result = self.execute_sql_query(sql_query)
-            if result['success']:
-                # 🎯 GÉNÉRATION DE GRAPHIQUE
-                graph_data = self.generate_graph_if_relevant(result['data'], question)
-                
-                formatted_result = self.format_response_with_ai(result['data'], question, sql_query)
-                self.cache.cache_query(question, sql_query)
-                
-                return sql_query, formatted_result, graph_data  
-            else:
-                # Tentative de correction automatique
-                corrected_sql = self._auto_correct_sql(sql_query, result['error'])
-                if corrected_sql:
-                    retry_result = self.execute_sql_query(corrected_sql)
-                    if retry_result['success']:
-                        graph_data = self.generate_graph_if_relevant(retry_result['data'], question)
-                        formatted_result = self.format_response_with_ai(retry_result['data'], question, corrected_sql)
-                        self.cache.cache_query(question, sql_query)
-                        return corrected_sql, formatted_result, graph_data  
+                return self._plan("", "llm", message="❌ La requête générée est vide.")
+
+            speculative_result = self._resolve_speculation(speculation, sql_query)
+            if speculative_result is not None:
+                return self._plan(sql_query, "llm", result=speculative_result, cache=self.cache)
                 
-                return sql_query, f"❌ Erreur d'exécution SQL : {result['error']}", None
-            
+            plan = self._execute_plan(sql_query, "llm", cache=self.cache)
+            if plan['result'] is not None:
+                return plan
+            self._discard_generated_sql()
+
+            # Tentative de correction automatique
+            set_path("auto_correct")
+            corrected_sql = self._auto_correct_sql(sql_query, plan['error'])
+            retry_plan = self._execute_plan(corrected_sql, "llm", cache=self.cache) if corrected_sql else None
+            repaired = retry_plan is not None and retry_plan['result'] is not None
+            if corrected_sql and not repaired:
+                # Correction en échec : la même erreur ne doit pas rejouer la même correction en cache
+                discard_cached_completion("repair")
+            self.sql_repair.record(parse_mysql_error(plan['error']).kind, repaired)
+            return retry_plan if repaired else plan
+
+        except LLMUnavailableError as e:
+            logger.warning(f"🔌 LLM indisponible pour la question admin: {e}")
+            return self._plan("", "degraded", message=self.DEGRADED_MODE_MESSAGE)
         except Exception as e:
-            logger.error(f"Erreur dans _process_super_admin_question: {e}")
-            return "", f"❌ Erreur de traitement : {str(e)}", None    
+            logger.error(f"Erreur dans _plan_super_admin_question: {e}")
+            return self._plan("", "llm", message=f"❌ Erreur de traitement : {str(e)}")
+        finally:
+            self._discard_speculation(speculation)
 
+    def is_refused_attestation(self, question: str, roles: List[str]) -> bool:
+        """Demande d'attestation d'un parent : refusée avant tout traitement (/ask et /ask/stream)"""
+        return 'ROLE_SUPER_ADMIN' not in roles and bool(self._check_for_pdf_request(question))
 
-            return "", f"Erreur: {str(e)}", None, None, None
     def _check_for_pdf_request(self, question: str) -> Optional[tuple[str, str]]:
         """Vérifie si c'est une demande de document PDF"""
         patterns = {
@@ -443,47 +942,41 @@ class SQLAssistant:
         
     def _process_parent_question(self, question: str, user_id: int) -> tuple[str, str, Optional[str]]:
         """Traite une question avec restrictions parent - VERSION CORRIGÉE MULTI-ENFANTS + BLOCAGE ATTESTATION"""
+        return self._finish_plan(self._plan_parent_question(question, user_id), question)
+
+    def _plan_parent_question(self, question: str, user_id: int) -> Dict[str, Any]:
+        """Choisit et exécute le SQL d'une question parent : cache → IA, avec contrôle d'accès"""
         
         # 🚫 AJOUT: Bloquer les demandes d'attestation pour les parents
         pdf_request = self._check_for_pdf_request(question)
         if pdf_request:
-            return "", "❌ Accès refusé : Seuls les administrateurs peuvent générer des attestations et documents officiels. Veuillez contacter l'administration de l'école.", None
+            return self._plan("", "pdf", message="❌ Accès refusé : Seuls les administrateurs peuvent générer des attestations et documents officiels. Veuillez contacter l'administration de l'école.")
         
         # Nettoyage du cache
         self.cache1.clean_double_braces_in_cache()
         
         # Vérification cache parent
         cached = self.cache1.get_cached_query(question, user_id)
-        if cached:
-            sql_template, variables = cached
-            sql_query = sql_template
-            for column, value in variables.items():
-                sql_query = sql_query.replace(f"{{{column}}}", value)
+        rendered = self._render_cached_sql(*cached) if cached else None
+        if rendered:
+            sql_query, params = rendered
             
             logger.info("⚡ Requête parent récupérée depuis le cache")
-            try:
-                result = self.execute_sql_query(sql_query)
-                if result['success']:
-                    graph_data = self.generate_graph_if_relevant(result['data'], question)
-                    formatted_result = self.format_response_with_ai(result['data'], question, sql_query)
-                    return sql_query, formatted_result, graph_data
-                else:
-                    return sql_query, f"❌ Erreur d'exécution SQL : {result['error']}", None
-            except Exception as db_error:
-                return sql_query, f"❌ Erreur d'exécution SQL : {str(db_error)}", None
+            set_path("cache")
+            return self._execute_plan(sql_query, "cache", params=params)
 
         # Récupération des données enfants avec informations détaillées
         children_data = self.get_user_children_detailed_data(user_id)
         
         if not children_data:
-            return "", "❌ Aucun enfant trouvé pour ce parent ou erreur d'accès.", None
+            return self._plan("", "llm", message="❌ Aucun enfant trouvé pour ce parent ou erreur d'accès.")
         
         # 🎯 NOUVELLE LOGIQUE : Gestion intelligente des questions multi-enfants
         child_context = self.analyze_child_context_in_question(question, children_data)
         
         if child_context["action"] == "request_clarification":
             # Retourner une demande de clarification
-            return "", child_context["message"], None
+            return self._plan("", "clarification", message=child_context["message"])
         elif child_context["action"] == "process_specific":
             # Traiter pour un enfant spécifique
             target_child = child_context["target_child"]
@@ -503,42 +996,55 @@ class SQLAssistant:
             
             logger.info(f"📊 Traitement pour tous les enfants: {children_names_str}")
         else:
-            return "", "❌ Impossible de déterminer l'enfant concerné par votre question.", None
+            return self._plan("", "llm", message="❌ Impossible de déterminer l'enfant concerné par votre question.")
 
         # Validation des noms dans la question
         detected_names = self.detect_names_in_question(question, children_prenoms)
         if detected_names["unauthorized_names"]:
             unauthorized_list = ", ".join(detected_names["unauthorized_names"])
-            return "", f"❌ Accès interdit: Vous n'avez pas le droit de consulter les données de {unauthorized_list}", None
+            return self._plan("", "llm", message=f"❌ Accès interdit: Vous n'avez pas le droit de consulter les données de {unauthorized_list}")
         
-        # Génération SQL avec template parent
+        # Génération SQL avec template parent (impossible en mode dégradé)
+        if self.is_degraded():
+            return self._plan("", "degraded", message=self.DEGRADED_MODE_MESSAGE)
+
+        set_path("llm")
+        speculation = self._start_speculation(
+            lambda: self.cache1.get_candidate_query(question, user_id, self.speculative_min_score_parent,
+                                                    children_ids=children_ids),
+            allowed=lambda candidate_sql: self.validate_parent_access(candidate_sql, children_ids)
+        )
         try:
             sql_query = self.generate_sql_parent(question, user_id, children_ids_str, children_names_str)
             
             if not sql_query:
-                return "", "❌ La requête générée est vide.", None
+                return self._plan("", "llm", message="❌ La requête générée est vide.")
 
             # Validation de sécurité (sauf pour infos publiques)
             if not self._is_public_info_query(question, sql_query):
                 if not self.validate_parent_access(sql_query, children_ids):
-                    return "", "❌ Accès refusé: La requête ne respecte pas les restrictions parent.", None
+                    return self._plan("", "llm", message="❌ Accès refusé: La requête ne respecte pas les restrictions parent.")
             else:
                 logger.info("ℹ️ Question sur information publique - validation bypassée")
 
-            # Exécution
-            result = self.execute_sql_query(sql_query)
-            
-            if result['success']:
-                graph_data = self.generate_graph_if_relevant(result['data'], question)
-                formatted_result = self.format_response_with_ai(result['data'], question, sql_query)
-                self.cache1.cache_query(question, sql_query)
-                return sql_query, formatted_result, graph_data
-            else:
-                return sql_query, f"❌ Erreur d'exécution SQL : {result['error']}", None
-                
+            # Exécution (résultats du candidat spéculatif réutilisés si c'est la même requête)
+            speculative_result = self._resolve_speculation(speculation, sql_query)
+            if speculative_result is not None:
+                return self._plan(sql_query, "llm", result=speculative_result, cache=self.cache1)
+            plan = self._execute_plan(sql_query, "llm", cache=self.cache1)
+            if plan['result'] is None:
+                self._discard_generated_sql()
+            return plan
+
+        except LLMUnavailableError as e:
+            logger.warning(f"🔌 LLM indisponible pour la question parent: {e}")
+            return self._plan("", "degraded", message=self.DEGRADED_MODE_MESSAGE)
         except Exception as e:
-            logger.error(f"Erreur dans _process_parent_question: {e}")
-            return "", f"❌ Erreur de traitement : {str(e)}", None
+            logger.error(f"Erreur dans _plan_parent_question: {e}")
+            return self._plan("", "llm", message=f"❌ Erreur de traitement : {str(e)}")
+        finally:
+            self._discard_speculation(speculation)
+
     def get_user_children_detailed_data(self, user_id: int) -> List[Dict]:
         """Récupère les données détaillées des enfants pour un parent"""
         connection = None
@@ -955,29 +1461,74 @@ class SQLAssistant:
         }
     
 
-    def generate_sql_with_ai(self, question: str) -> str:
-        """Génère une requête SQL via IA pour admin"""
-        relevant_domains = self.get_relevant_domains(question, self.domain_descriptions)
-        
-        if relevant_domains:
-            relevant_tables = self.get_tables_from_domains(relevant_domains, self.domain_to_tables_mapping)
-            table_info = self.db.get_table_info(relevant_tables)
-            relevant_domain_descriptions = "\n".join(
-                f"{dom}: {self.domain_descriptions[dom]}" for dom in relevant_domains if dom in self.domain_descriptions
-            )
-        else:
-            table_info = self.db.get_table_info()
-            relevant_domain_descriptions = "\n".join(self.domain_descriptions.values())
+    def _generate_sql_single_call(self, role: str, prompt_template: PromptTemplate,
+                                  question: str, **prompt_vars) -> Optional[str]:
+        """
+        Mode appel unique : domaines, SQL et confiance en une seule réponse JSON.
+        Retourne None (repli sur le pipeline en deux étapes) si le mode est désactivé
+        pour ce rôle, si la réponse est inexploitable ou si la confiance est trop faible.
+        """
+        if role not in self.single_call_roles:
+            return None
 
-        prompt = ADMIN_PROMPT_TEMPLATE.format(
-            input=question,
-            table_info=table_info,
-            relevant_domain_descriptions=relevant_domain_descriptions,
-            #relations=self.relations_description
-        )
+        try:
+            if not self.prompt_fragments.signatures():
+                return None
+        except Exception as e:
+            logger.warning(f"⚠️ Signatures des tables indisponibles: {e}")
+            return None
+
+        user_prompt = self._build_sql_prompt("single_call", prompt_template, question, None, **prompt_vars)
+        system_prompt = SINGLE_CALL_SYSTEM_PROMPT.format(domain_names=", ".join(self.domain_descriptions))
+
+        try:
+            response = chat_completion([
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ], stage="single_call")
+            payload = json.loads(response.choices[0].message.content or "")
+            confidence = float(payload.get("confidence", 0))
+            domains = [d for d in payload.get("domains") or [] if d in self.domain_descriptions]
+            sql_query = self._clean_sql(str(payload.get("sql") or ""))
+            self._validate_sql(sql_query)
+        except Exception as e:
+            logger.warning(f"⚠️ Appel unique inexploitable, repli sur deux étapes: {e}")
+            discard_cached_completion("single_call")
+            return None
+
+        if confidence < self.single_call_min_confidence:
+            logger.info(f"↩️ Appel unique peu confiant ({confidence:.2f}), repli sur deux étapes")
+            return None
 
-        llm_response = self.ask_llm(prompt)
-        sql_query = self._clean_sql(llm_response)
+        # Les domaines choisis enrichissent le classifieur local comme en mode deux étapes
+        if domains:
+            _, local_confidence = self.domain_classifier.classify(question)
+            if not self.domain_classifier.is_confident(local_confidence):
+                self.domain_classifier.learn(question, domains)
+
+        logger.info(f"⚡ SQL généré en appel unique (confiance {confidence:.2f}, domaines {domains})")
+        _sql_strategy.set("single_call")
+        return sql_query
+
+    @property
+    def last_sql_strategy(self) -> str:
+        """Stratégie du dernier SQL généré dans la requête (ou le thread) en cours"""
+        return _sql_strategy.get()
+
+    def _discard_generated_sql(self):
+        """SQL généré rejeté ou en échec : la complétion qui l'a produit n'est plus resservie"""
+        discard_cached_completion("single_call" if _sql_strategy.get() == "single_call" else "sql")
+
+    def generate_sql_with_ai(self, question: str) -> str:
+        """Génère une requête SQL via IA pour admin"""
+        sql_query = self._generate_sql_single_call('ROLE_SUPER_ADMIN', ADMIN_PROMPT_TEMPLATE, question)
+        if not sql_query:
+            _sql_strategy.set("two_step")
+            relevant_domains = self.get_relevant_domains(question, self.domain_descriptions)
+            prompt = self._build_sql_prompt("sql", ADMIN_PROMPT_TEMPLATE, question, relevant_domains)
+
+            llm_response = self.ask_llm(prompt, stage="sql")
+            sql_query = self._clean_sql(llm_response)
         sql_query = self._auto_fix_quotes_in_sql(sql_query)
         
         # Validation
@@ -987,34 +1538,25 @@ class SQLAssistant:
             return sql_query
         except Exception as e:
             logger.error(f"Erreur validation SQL: {e}")
+            self._discard_generated_sql()
             raise ValueError(f"Requête SQL invalide: {str(e)}")
 
     def generate_sql_parent(self, question: str, user_id: int, children_ids_str: str, children_names_str: str) -> str:
         """Génère une requête SQL avec restrictions parent"""
-        relevant_domains = self.get_relevant_domains(question, self.domain_descriptions)
-        
-        if relevant_domains:
-            relevant_tables = self.get_tables_from_domains(relevant_domains, self.domain_to_tables_mapping)
-            table_info = self.db.get_table_info(relevant_tables)
-            relevant_domain_descriptions = "\n".join(
-                f"{dom}: {self.domain_descriptions[dom]}" for dom in relevant_domains if dom in self.domain_descriptions
+        sql_query = self._generate_sql_single_call(
+            'ROLE_PARENT', PARENT_PROMPT_TEMPLATE, question,
+            user_id=user_id, children_ids=children_ids_str, children_names=children_names_str
+        )
+        if not sql_query:
+            _sql_strategy.set("two_step")
+            relevant_domains = self.get_relevant_domains(question, self.domain_descriptions)
+            prompt = self._build_sql_prompt(
+                "sql", PARENT_PROMPT_TEMPLATE, question, relevant_domains,
+                user_id=user_id, children_ids=children_ids_str, children_names=children_names_str
             )
-        else:
-            table_info = self.db.get_table_info()
-            relevant_domain_descriptions = "\n".join(self.domain_descriptions.values())
 
-        prompt = PARENT_PROMPT_TEMPLATE.format(
-            input=question,
-            table_info=table_info,
-            relevant_domain_descriptions=relevant_domain_descriptions,
-            #relations=self.relations_description,
-            user_id=user_id,
-            children_ids=children_ids_str,
-            children_names=children_names_str
-        )
-        
-        llm_response = self.ask_llm(prompt)
-        sql_query = self._clean_sql(llm_response)
+            llm_response = self.ask_llm(prompt, stage="sql")
+            sql_query = self._clean_sql(llm_response)
         
         # Validation
         try:
@@ -1023,6 +1565,7 @@ class SQLAssistant:
             return sql_query
         except Exception as e:
             logger.error(f"Erreur validation SQL parent: {e}")
+            self._discard_generated_sql()
             raise ValueError(f"Requête SQL invalide: {str(e)}")
 
     def _clean_sql(self, text: str) -> str:
@@ -1085,40 +1628,130 @@ class SQLAssistant:
     # EXÉCUTION SQL
     # ================================
 
-    def execute_sql_query(self, sql_query: str) -> dict:
-        """Exécute une requête SQL et retourne les résultats"""
+    # LIMIT final littéral ou lié par le driver (LIMIT %s des templates paramétrés)
+    TRAILING_LIMIT = re.compile(r'\blimit\s+(?:\d+|%s)\s*(?:(?:,|offset)\s*(?:\d+|%s)\s*)?$', re.IGNORECASE)
+
+    def _cap_sql(self, sql_query: str) -> str:
+        """Ajoute LIMIT plafond + 1 (le serveur s'arrête tôt) sauf LIMIT final existant ou stratégie drain"""
+        sql_query = sql_query.strip().rstrip(';')
+        if self.sql_count_strategy == 'drain' or self.TRAILING_LIMIT.search(sql_query):
+            return sql_query
+        # Nouvelle ligne : un commentaire -- en fin de requête ne masque pas le LIMIT
+        return f"{sql_query}\nLIMIT {self.sql_max_rows + 1}"
+
+    def _count_rows(self, connection, sql_query: str, params: tuple = ()) -> Optional[int]:
+        """Total réel d'un résultat tronqué, compté côté serveur ; None si la requête ne s'y prête pas"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"SELECT COUNT(*) AS total FROM ({sql_query.strip().rstrip(';')}\n) AS _total_rows",
+                           params or None)
+            row = cursor.fetchone()
+            return int(row['total'] if isinstance(row, dict) else row[0])
+        except Exception as e:
+            logger.info(f"ℹ️ Total non calculable pour ce résultat: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def execute_sql_query(self, sql_query: str, params: tuple = ()) -> dict:
+        """
+        Exécute une requête SQL avec un curseur serveur (non bufferisé) : au plus sql_max_rows
+        lignes sont lues par lots, quel que soit le SQL généré. La première page est renvoyée
+        dans `data` ; au-delà, `page` porte le jeton des pages suivantes (ResultStore).
+        Les résultats sont mémorisés dans le ResultCache (TTL par table) : requêtes en cache,
+        templates et SQL générés en profitent de la même façon.
+        `params` : valeurs des %s de la requête, liées par le driver (SQL du cache et des templates).
+        """
+        connection = None
+        cursor = None
         try:
             if not sql_query:
                 return {"success": False, "error": "Requête SQL vide", "data": []}
             
-            connection = get_db()
-            cursor = connection.cursor()
-            
-           
-            logger.info(f"📜 SQL exécutée:\n{sql_query}")
-            
-            cursor.execute(sql_query)
-            
-            
-            columns = [desc[0] for desc in cursor.description]
-            results = cursor.fetchall()
-            logger.info(f"📊 {len(results)} ligne(s) retournée(s)")
-            
-            data = [
-                dict(zip(columns, row)) if not isinstance(row, dict) else row
-                for row in results
-            ]
+            cached = self.result_cache.get(sql_query, params)
+            if cached is not None:
+                logger.info(f"⚡ Résultat SQL servi depuis le cache ({len(cached['rows'])} ligne(s))")
+                return self._paginate(cached["rows"], cached["total_rows"], cached["truncated"])
             
+            connection = get_db()
+            if connection is None:
+                return {"success": False, "error": "Connexion à la base de données indisponible", "data": []}
+            cursor = connection.cursor(MySQLdb.cursors.SSDictCursor)
+            
+            logger.info(f"📜 SQL exécutée:\n{sql_query}" + (f"\n🔗 Paramètres: {params}" if params else ""))
+            
+            cursor.execute(self._cap_sql(sql_query), params or None)
+            
+            # Lecture par lots jusqu'au plafond (+ 1 ligne pour détecter la troncature)
+            rows = []
+            while len(rows) <= self.sql_max_rows:
+                batch = cursor.fetchmany(min(self.sql_fetch_batch, self.sql_max_rows + 1 - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+            truncated = len(rows) > self.sql_max_rows
+            total_rows = None if truncated else len(rows)
+            if truncated and self.sql_count_strategy == 'drain':
+                total_rows = len(rows)
+                while True:
+                    batch = cursor.fetchmany(self.sql_fetch_batch)
+                    if not batch:
+                        break
+                    total_rows += len(batch)
+            del rows[self.sql_max_rows:]
+            # Le curseur serveur doit être fermé avant toute autre requête sur la connexion
             cursor.close()
-            if hasattr(connection, '_direct_connection'):
-                connection.close()
+            cursor = None
+            if truncated and self.sql_count_strategy == 'count':
+                total_rows = self._count_rows(connection, sql_query, params)
+            
+            logger.info(f"📊 {len(rows)} ligne(s) retournée(s)"
+                        + (f" (tronqué, total: {total_rows if total_rows is not None else 'inconnu'})" if truncated else ""))
             
-            return {"success": True, "data": self._serialize_data(data)}
+            data = self._serialize_data(rows)
+            self.result_cache.put(sql_query, params, data, total_rows=total_rows, truncated=truncated)
+            return self._paginate(data, total_rows, truncated)
             
         except Exception as e:
             logger.error(f"❌ Erreur exécution SQL: {e}")
-            logger.error(f"❌ SQL qui a échoué: {sql_query}")
+            logger.error(f"❌ SQL qui a échoué: {inline_params(sql_query, params)}")
             return {"success": False, "error": str(e), "data": []}
+        finally:
+            if cursor is not None:
+                cursor.close()
+            # Rend la connexion au pool, y compris en cas d'erreur
+            if connection is not None:
+                connection.close()
+
+    def _paginate(self, data: List[Dict], total_rows: Optional[int], truncated: bool) -> dict:
+        """Première page dans `data` ; lignes suivantes conservées derrière un jeton de page"""
+        # `rows` : toutes les lignes lues (jusqu'à sql_max_rows), pour les agrégats du formatage IA
+        result = {"success": True, "data": data[:self.sql_page_size], "rows": data, "row_count": len(data),
+                  "total_rows": total_rows, "truncated": truncated, "page": None}
+        if len(data) > self.sql_page_size or truncated:
+            token = self.result_store.put(data, self.sql_page_size, total_rows, truncated, owner=current_user_id())
+            result["page"] = {
+                "token": token,
+                "page": 1,
+                "pages": (len(data) + self.sql_page_size - 1) // self.sql_page_size,
+                "page_size": self.sql_page_size,
+                "rows_available": len(data),
+                "total_rows": total_rows,
+                "truncated": truncated,
+                "has_more": token is not None and len(data) > self.sql_page_size,
+            }
+        return result
+
+    @staticmethod
+    def _page_notice(page: Optional[Dict[str, Any]]) -> str:
+        """Mention ajoutée à la réponse quand seule la première page des lignes est affichée"""
+        if not page:
+            return ""
+        total = page["total_rows"] if page["total_rows"] is not None else f"plus de {page['rows_available']}"
+        notice = f"\n\n📄 {min(page['page_size'], page['rows_available'])} premières lignes affichées sur {total}."
+        if page["has_more"]:
+            notice += " Les pages suivantes sont disponibles."
+        return notice
 
     def _serialize_data(self, data):
         """Sérialise les données pour éviter les problèmes de types"""
@@ -1136,11 +1769,58 @@ class SQLAssistant:
     # FORMATAGE DES RÉPONSES
     # ================================
 
-    def format_response_with_ai(self, data: List[Dict], question: str, sql_query: str) -> str:
-        """Version améliorée du formatage avec debug"""
+    def format_response_with_ai(self, data: List[Dict], question: str, sql_query: str,
+                                result: Optional[Dict] = None) -> str:
+        """
+        Version améliorée du formatage avec debug.
+        `data` est la page affichée ; `result` (résultat d'execute_sql_query) fournit toutes les
+        lignes lues et le total réel pour les agrégats d'une question d'analyse.
+        """
         
         logger.debug(f"🔍 Formatage - Données reçues: {data}")
+
+        direct_response = self._format_without_ai(data, question)
+        if direct_response is not None:
+            return direct_response
+
+        # Listes et tableaux : rendu déterministe, sauf si la question demande une analyse
+        if not wants_analysis(question) or self.is_degraded():
+            return self.result_renderer.render(data, question)
         
+        # Pour les analyses
+        try:
+            response = chat_completion(self._build_format_messages(data, question, result),
+                                       stage="format", model=self.model)
+            
+            return response.choices[0].message.content.strip()
+            
+        except Exception as e:
+            logger.error(f"Erreur formatage: {e}")
+            return self.result_renderer.render(data, question)
+
+    def stream_response_with_ai(self, data: List[Dict], question: str, sql_query: str,
+                                result: Optional[Dict] = None) -> Iterator[str]:
+        """Variante streaming de format_response_with_ai : produit la réponse par fragments"""
+        direct_response = self._format_without_ai(data, question)
+        if direct_response is None and (not wants_analysis(question) or self.is_degraded()):
+            direct_response = self.result_renderer.render(data, question)
+        if direct_response is not None:
+            yield direct_response
+            return
+
+        streamed = False
+        try:
+            for token in stream_chat_completion(self._build_format_messages(data, question, result),
+                                                stage="format", model=self.model):
+                streamed = True
+                yield token
+        except Exception as e:
+            logger.error(f"Erreur formatage streaming: {e}")
+            if not streamed:
+                yield self.result_renderer.render(data, question)
+
+    def _format_without_ai(self, data: List[Dict], question: str) -> Optional[str]:
+        """Réponses directes (aucun résultat, valeur unique) ; None si le formatage IA est nécessaire"""
         if not data:
             return "✅ Requête exécutée mais aucun résultat trouvé."
         
@@ -1166,36 +1846,34 @@ class SQLAssistant:
                     return f"Nombre trouvé : {value}"
             else:
                 return f"Résultat : {value}"
-        
-        # Pour les listes multiples
-        try:
-            df = pd.DataFrame(data)
-            
-            # Formatage normal avec IA
-            messages = [
-                {
-                    "role": "system",
-                    "content": """Analysez les données SQL et donnez une réponse claire en français. 
-                    Présentez les résultats de manière structurée et utile."""
-                },
-                {
-                    "role": "user",
-                    "content": f"Question: {question}\n\nDonnées: {json.dumps(data[:100], ensure_ascii=False)}"
-                }
-            ]
-            
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.2,
-                max_tokens=400
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            logger.error(f"Erreur formatage: {e}")
-            return self._format_simple_response(data, question)
+
+        return None
+
+    def _build_format_messages(self, data: List[Dict], question: str,
+                               result: Optional[Dict] = None) -> List[Dict[str, str]]:
+        """Messages du formatage IA, partagés par les modes bloquant et streaming"""
+        start = time.perf_counter()
+        result = result or {}
+        payload = self.result_summarizer.to_prompt(result.get("rows") or data, question,
+                                                   total_rows=result.get("total_rows"),
+                                                   truncated=result.get("truncated", False))
+        get_usage_tracker().record_prompt("format", (time.perf_counter() - start) * 1000, len(payload))
+        return [
+            {
+                "role": "system",
+                "content": """Analysez les données SQL et donnez une réponse claire en français. 
+                Présentez les résultats de manière structurée et utile.
+                Si les données sont résumées, "colonnes" donne des agrégats calculés sur toutes les lignes,
+                "valeurs_communes" les valeurs identiques partout et "echantillon" un extrait des lignes.
+                Si "lignes_analysees" est présent, le résultat a été tronqué : les agrégats ne portent que sur
+                ces premières lignes sur "total_lignes" (total inconnu si null), précisez-le dans la réponse."""
+            },
+            {
+                "role": "user",
+                "content": f"Question: {question}\n\nDonnées: {payload}"
+            }
+        ]
+
     def _format_simple_response(self, data: List[Dict], question: str) -> str:
         """Formatage simple sans IA en cas d'erreur"""
         if not data:
@@ -1218,7 +1896,7 @@ class SQLAssistant:
         # Cas général: tableau
         try:
             df = pd.DataFrame(data)
-            table = tabulate(df.head(20), headers='keys', tablefmt='grid', showindex=False)
+            table = tabulate.tabulate(df.head(20), headers='keys', tablefmt='grid', showindex=False)
             
             result = f"Résultats pour: {question}\n\n{table}"
             if len(data) > 20:
@@ -1257,13 +1935,11 @@ class SQLAssistant:
             return None
             
         try:
-            df = pd.DataFrame(data)
+            # Type de graphique détecté sur les noms de colonnes : pandas n'est chargé que s'il y a un graphique
+            graph_type = self.detect_graph_type(question, list(data[0].keys()))
             
-            # Détection automatique du type de graphique
-            graph_type = self.detect_graph_type(question, df.columns.tolist())
-            
-            if graph_type and len(df) >= 2:
-                return self.generate_auto_graph(df, graph_type)
+            if graph_type:
+                return self.generate_auto_graph(pd.DataFrame(data), graph_type)
                 
         except Exception as e:
             logger.error(f"Erreur génération graphique: {e}")
@@ -1308,7 +1984,7 @@ class SQLAssistant:
                 return "bar"
         
         return None
-    def generate_auto_graph(self, df: pd.DataFrame, graph_type: str = None) -> Optional[str]:
+    def generate_auto_graph(self, df: "pd.DataFrame", graph_type: str = None) -> Optional[str]:
         """Génère automatiquement un graphique - VERSION AMÉLIORÉE"""
         if df.empty or len(df) < 2:
             logger.debug("❌ DataFrame vide ou insuffisant")
@@ -1478,10 +2154,9 @@ class SQLAssistant:
     # CORRECTION AUTOMATIQUE SQL
     # ================================
 
-    def _auto_correct_sql(self, bad_sql: str, error_msg: str) -> Optional[str]:
-        """Tente de corriger automatiquement une requête SQL défaillante"""
-        try:
-            correction_prompt = f"""
+    @staticmethod
+    def _build_repair_prompt(bad_sql: str, error_msg: str, schema_context: str) -> str:
+        return f"""
             Vous êtes un expert SQL. Corrigez cette requête MySQL en vous basant sur l'erreur.
             
             Erreur: {error_msg}
@@ -1491,26 +2166,34 @@ class SQLAssistant:
             {bad_sql}
             ```
             
-            Schéma disponible:
-            ```json
-            {json.dumps(self.schema[:10], indent=2)}
-            ```
+            Diagnostic et schéma concerné:
+            {schema_context}
             
             Règles:
             - Générez UNIQUEMENT du SQL valide
             - Pas d'explications, juste la requête corrigée
             - Utilisez SELECT uniquement
+            - N'utilisez que les tables et colonnes du schéma ci-dessus
             
             Requête corrigée:
             ```sql
             """
-            
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": correction_prompt}],
-                temperature=0,
-                max_tokens=300
+
+    def _auto_correct_sql(self, bad_sql: str, error_msg: str) -> Optional[str]:
+        """Tente de corriger automatiquement une requête SQL défaillante (contexte ciblé sur l'erreur)"""
+        answered = False
+        try:
+            start = time.perf_counter()
+            hint = self.sql_repair.build(bad_sql, error_msg)
+            correction_prompt = self._build_repair_prompt(bad_sql, error_msg, hint.text)
+            get_usage_tracker().record_prompt("repair", (time.perf_counter() - start) * 1000, len(correction_prompt))
+            
+            response = chat_completion(
+                [{"role": "user", "content": correction_prompt}],
+                stage="repair",
+                model=self.model
             )
+            answered = True
             
             corrected_sql = self._clean_sql(response.choices[0].message.content)
             
@@ -1520,7 +2203,10 @@ class SQLAssistant:
                 
         except Exception as e:
             logger.error(f"Correction SQL échouée: {str(e)}")
-            
+        
+        # Correction inexploitable : retirée du cache des complétions
+        if answered:
+            discard_cached_completion("repair")
         return None
 
     # ================================
@@ -1528,61 +2214,25 @@ class SQLAssistant:
     # ================================
 
     def get_relevant_domains(self, query: str, domain_descriptions: Dict[str, str]) -> List[str]:
-        """Identifie les domaines pertinents basés sur la question"""
-        domain_desc_str = "\n".join([f"- {name}: {desc}" for name, desc in domain_descriptions.items()])
-        domain_prompt_content = f"""
-        Based on the following user question, identify ALL relevant domains from the list below.
-        Return only the names of the relevant domains, separated by commas. If no domain is relevant, return 'None'.
-
-        User Question: {query}
-
-        Available Domains and Descriptions:
-        {domain_desc_str}
+        """Identifie les domaines pertinents : classifieur local, LLM seulement si la confiance est faible"""
+        local_domains, confidence = self.domain_classifier.classify(query)
+        if local_domains and self.domain_classifier.is_confident(confidence):
+            logger.info(f"🎯 Domaines (classifieur local, confiance {confidence:.2f}): {local_domains}")
+            return local_domains
 
-        Relevant Domains (comma-separated):
-        """
-        
         try:
-            response = self.ask_llm(domain_prompt_content)
-            domain_names = response.strip()
-            
-            if domain_names.lower() == 'none' or not domain_names:
-                return []
-                
-            return [d.strip() for d in domain_names.split(',')]
+            domains = llm_select_domains(query, domain_descriptions, self.ask_llm)
+            self.domain_classifier.learn(query, domains)
+            logger.info(f"🧠 Domaines (LLM, confiance locale {confidence:.2f}): {domains}")
+            return domains
         except Exception as e:
             logger.error(f"❌ Erreur lors de l'identification des domaines: {e}")
-            return []
+            return local_domains
+
     def get_relevant_domains_improved(self, query: str) -> List[str]:
-        """Version améliorée de la détection des domaines"""
-        
-        # Mappings directs question → domaine
-        direct_mappings = {
-            'section': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'civilité': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'nationalité': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'niveau': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'élève': ['ELEVES_INSCRIPTIONS'],
-            'inscription': ['ELEVES_INSCRIPTIONS'],
-            'classe': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'localité': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'gouvernorat': ['GENERAL_ADMINISTRATION_CONFIG'],
-            'établissement': ['GENERAL_ADMINISTRATION_CONFIG']
-        }
-        
-        query_lower = query.lower()
-        relevant_domains = set()
-        
-        # Recherche directe
-        for keyword, domains in direct_mappings.items():
-            if keyword in query_lower:
-                relevant_domains.update(domains)
-        
-        # Si aucun domaine trouvé, utiliser l'IA
-        if not relevant_domains:
-            return self.get_relevant_domains(query, self.domain_descriptions)
-    
-        return list(relevant_domains)
+        """Conservée pour compatibilité : la détection par mots-clés est intégrée au classifieur local"""
+        return self.get_relevant_domains(query, self.domain_descriptions)
+
     def get_tables_from_domains(self, domains: List[str], domain_to_tables_map: Dict[str, List[str]]) -> List[str]:
         """Récupère toutes les tables associées aux domaines donnés"""
         tables = []
@@ -1626,16 +2276,9 @@ class SQLAssistant:
             "variables": {}
         }
 
-    def generate_query_from_template(self, template: Dict, variables: Dict) -> str:
-        """Génère une requête à partir d'un template et de variables"""
-        sql_template = template["requete_template"]
-        
-        # Remplace les variables dans le template
-        for var_name, var_value in variables.items():
-            placeholder = f"{{{var_name}}}"
-            sql_template = sql_template.replace(placeholder, str(var_value))
-        
-        return sql_template
+    def generate_query_from_template(self, template: Dict, variables: Dict) -> Tuple[str, tuple]:
+        """Génère une requête paramétrée (sql avec %s, valeurs) à partir d'un template et de variables"""
+        return bind_template(template["requete_template"], variables)
 
     # ================================
     # MÉTHODES SPÉCIFIQUES AUX PARENTS
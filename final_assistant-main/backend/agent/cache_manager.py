@@ -220,14 +220,17 @@ from typing import Dict, Any, Optional, Tuple, List
 import hashlib
 import re
 from collections import defaultdict
+import pickle
+import threading
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+
+from agent.startup_snapshot import file_signature
 
 class CacheManager:
-    def __init__(self, cache_file: str = "sql_query_cache.json"):
+    def __init__(self, cache_file: str = "sql_query_cache.json", index_state: Optional[Dict[str, Any]] = None):
         self.cache_file = Path(cache_file)
-        self.cache = self._load_cache()
+        index = self._valid_index(index_state)
+        self.cache = index["cache"] if index else self._load_cache()
         
         # Patterns de base pour les valeurs structurées
         self.auto_patterns = {
@@ -252,17 +255,80 @@ class CacheManager:
         self.discovered_patterns = defaultdict(list)
         
         # Initialisation du vectorizer TF-IDF
-        self.vectorizer = TfidfVectorizer()
-        self.template_vectors = None
-        self._init_similarity_search()
+        # Index TF-IDF construit (ou dépicklé depuis l'instantané si le fichier de cache n'a pas
+        # changé) à la première recherche : scikit-learn n'est importé qu'à ce moment
+        # (vectorizer, vecteurs, entrées indexées) publiés ensemble : un lecteur ne voit jamais
+        # un vectorizer d'une version avec les vecteurs ou les entrées d'une autre
+        self._index: Optional[Tuple[Any, Any, Dict[str, Any]]] = None
+        self._index_lock = threading.Lock()
+        self._pending_index = index["index"] if index else None
+        self.index_restored = index is not None
+
+    @property
+    def vectorizer(self):
+        return self._ensure_index()[0]
+
+    @property
+    def template_vectors(self):
+        return self._ensure_index()[1]
+
+    def _ensure_index(self) -> Tuple[Any, Any, Dict[str, Any]]:
+        """Index courant, construit une seule fois (requêtes et exécution spéculative concurrentes)"""
+        index = self._index
+        if index is not None:
+            return index
+        with self._index_lock:
+            if self._index is None:
+                entries = dict(self.cache)
+                if self._pending_index is not None:
+                    vectorizer, template_vectors = pickle.loads(self._pending_index)
+                    self._index = (vectorizer, template_vectors, entries)
+                else:
+                    self._index = self._build_index(entries)
+                self._pending_index = None
+            return self._index
+
+    def _valid_index(self, state: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Index d'instantané utilisable seulement si le fichier de cache est inchangé"""
+        if state and state.get("signature") == file_signature(self.cache_file):
+            return state
+        return None
+
+    def export_index(self) -> Dict[str, Any]:
+        """
+        Cache et index TF-IDF ajusté (picklé à part : dépicklé seulement à la première recherche).
+        Appelé depuis le thread de l'instantané : le cache exporté est la copie indexée, cohérente avec les vecteurs.
+        """
+        with self._index_lock:
+            pending, index = self._pending_index, self._index
+            if pending is not None:
+                return {"signature": file_signature(self.cache_file), "cache": dict(self.cache), "index": pending}
+        vectorizer, template_vectors, entries = index or self._ensure_index()
+        return {
+            "signature": file_signature(self.cache_file),
+            "cache": entries,
+            "index": pickle.dumps((vectorizer, template_vectors), protocol=pickle.HIGHEST_PROTOCOL),
+        }
+
+    def _build_index(self, entries: Dict[str, Any]) -> Tuple[Any, Any, Dict[str, Any]]:
+        """Ajuste le TF-IDF sur une copie du cache (variables locales, rien n'est publié ici)"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        vectorizer, template_vectors = TfidfVectorizer(), None
+        if entries:
+            templates = [self._normalize_template(item['question_template']) 
+                        for item in entries.values()]
+            vectorizer.fit(templates)
+            template_vectors = vectorizer.transform(templates)
+        return vectorizer, template_vectors, entries
 
     def _init_similarity_search(self):
         """Initialise le système de recherche de similarité"""
-        if self.cache:
-            templates = [self._normalize_template(item['question_template']) 
-                        for item in self.cache.values()]
-            self.vectorizer.fit(templates)
-            self.template_vectors = self.vectorizer.transform(templates)
+        with self._index_lock:
+            entries = dict(self.cache)
+        index = self._build_index(entries)
+        with self._index_lock:
+            self._index, self._pending_index = index, None
 
     def _load_cache(self) -> Dict[str, Any]:
         if not self.cache_file.exists():
@@ -274,8 +340,10 @@ class CacheManager:
             return {}
 
     def _save_cache(self):
+        with self._index_lock:
+            cache = dict(self.cache)
         with open(self.cache_file, 'w', encoding='utf-8') as f:
-            json.dump(self.cache, f, indent=2, ensure_ascii=False)
+            json.dump(cache, f, indent=2, ensure_ascii=False)
         self._init_similarity_search()  # Recharge les vecteurs après sauvegarde
 
     def _extract_parameters(self, text: str) -> Tuple[str, Dict[str, str]]:
@@ -324,25 +392,60 @@ class CacheManager:
 
     def find_similar_template(self, question: str, threshold: float = 0.9) -> Tuple[Optional[Dict], float]:
         """Trouve un template similaire en utilisant TF-IDF et cosine similarity"""
+        template, score = self._best_template_match(question)
+        if template is not None and score >= threshold:
+            return template, score
+        return None, 0.0
+
+    def _best_template_match(self, question: str) -> Tuple[Optional[Dict], float]:
+        """Template le plus proche et son score cosinus, sans seuil"""
         if not self.cache:
             return None, 0.0
             
         norm_question = self._normalize_template(question)
         
         try:
-            question_vec = self.vectorizer.transform([norm_question])
-            similarities = cosine_similarity(question_vec, self.template_vectors)[0]
+            from sklearn.metrics.pairwise import cosine_similarity
+
+            vectorizer, template_vectors, entries = self._ensure_index()
+            question_vec = vectorizer.transform([norm_question])
+            similarities = cosine_similarity(question_vec, template_vectors)[0]
             best_idx = np.argmax(similarities)
-            best_score = similarities[best_idx]
-            
-            if best_score >= threshold:
-                cache_key = list(self.cache.keys())[best_idx]
-                return self.cache[cache_key], best_score
+            return list(entries.values())[best_idx], float(similarities[best_idx])
         except Exception as e:
             print(f"⚠️ Erreur lors de la recherche de template similaire: {str(e)}")
         
         return None, 0.0
 
+    def get_candidate_query(self, question: str, min_score: float,
+                            threshold: float = 0.9) -> Optional[Tuple[str, Dict[str, str], float]]:
+        """
+        Template de la zone grise (min_score <= score < threshold) : trop incertain pour
+        être servi directement, mais exécutable par anticipation pendant la génération IA.
+        Retourne (sql_template, variables, score) ou None.
+        """
+        template, score = self._best_template_match(question)
+        if template is None or not (min_score <= score < threshold):
+            return None
+        _, variables = self._extract_parameters(question)
+        return template['sql_template'], self._template_variables(template, question, variables), score
+
+    def _template_variables(self, template: Dict, question: str, variables: Dict[str, str]) -> Dict[str, str]:
+        """Valeurs des paramètres d'un template similaire, prises dans la question"""
+        current_vars = {}
+        for param in re.findall(r"'\{(\w+)\}'", template['sql_template']):
+            if param in variables:
+                current_vars[param] = variables[param]
+            else:
+                # Essaye de trouver une valeur correspondante dans la question
+                for pattern in self.auto_patterns:
+                    match = re.search(pattern, question)
+                    if match:
+                        value = match.group(1) if len(match.groups()) > 0 else match.group(0)
+                        current_vars[param] = value
+                        break
+        return current_vars
+
     def _generate_cache_key(self, question: str) -> str:
         """Génère une clé basée sur la question normalisée"""
         normalized_question, _ = self._extract_parameters(question)
@@ -464,19 +567,7 @@ class CacheManager:
         similar_template, score = self.find_similar_template(question)
         if similar_template:
             print(f"🔍 Template similaire trouvé (score: {score:.2f})")
-            current_vars = {}
-            for param in re.findall(r"'\{(\w+)\}'", similar_template['sql_template']):
-                if param in variables:
-                    current_vars[param] = variables[param]
-                else:
-                    # Essaye de trouver une valeur correspondante dans la question
-                    for pattern in self.auto_patterns:
-                        match = re.search(pattern, question)
-                        if match:
-                            value = match.group(1) if len(match.groups()) > 0 else match.group(0)
-                            current_vars[param] = value
-                            break
-            return similar_template['sql_template'], current_vars
+            return similar_template['sql_template'], self._template_variables(similar_template, question, variables)
         
         return None
 
@@ -486,8 +577,11 @@ class CacheManager:
         norm_sql = self._normalize_sql(sql_query, vars_question)
         
         key = hashlib.md5(norm_question.encode()).hexdigest()
-        self.cache[key] = {
-            'question_template': norm_question,
-            'sql_template': norm_sql
-        }
+        with self._index_lock:
+            self.cache[key] = {
+                'question_template': norm_question,
+                'sql_template': norm_sql
+            }
+            # L'index de l'instantané ne correspond plus au cache
+            self._pending_index = None
         self._save_cache()
\ No newline at end of file
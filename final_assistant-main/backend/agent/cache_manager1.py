@@ -4,18 +4,20 @@ from typing import Dict, Any, Optional, Tuple, List
 import hashlib
 import re
 from collections import defaultdict
+import pickle
+import threading
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import logging
 from config.database import get_db
+from agent.startup_snapshot import file_signature
 import traceback
 
 logger = logging.getLogger(__name__)
 class CacheManager1:
-    def __init__(self, cache_file: str = "sql_query_cache1.json"):
+    def __init__(self, cache_file: str = "sql_query_cache1.json", index_state: Optional[Dict[str, Any]] = None):
         self.cache_file = Path(cache_file)
-        self.cache = self._load_cache()
+        index = self._valid_index(index_state)
+        self.cache = index["cache"] if index else self._load_cache()
         
         # Patterns de base pour les valeurs structurées
         self.auto_patterns = {
@@ -107,17 +109,80 @@ class CacheManager1:
         self.discovered_patterns = defaultdict(list)
             
             # Initialisation du vectorizer TF-IDF
-        self.vectorizer = TfidfVectorizer()
-        self.template_vectors = None
-        self._init_similarity_search()
+        # Index TF-IDF construit (ou dépicklé depuis l'instantané si le fichier de cache n'a pas
+        # changé) à la première recherche : scikit-learn n'est importé qu'à ce moment
+        # (vectorizer, vecteurs, entrées indexées) publiés ensemble : un lecteur ne voit jamais
+        # un vectorizer d'une version avec les vecteurs ou les entrées d'une autre
+        self._index: Optional[Tuple[Any, Any, Dict[str, Any]]] = None
+        self._index_lock = threading.Lock()
+        self._pending_index = index["index"] if index else None
+        self.index_restored = index is not None
+
+    @property
+    def vectorizer(self):
+        return self._ensure_index()[0]
+
+    @property
+    def template_vectors(self):
+        return self._ensure_index()[1]
+
+    def _ensure_index(self) -> Tuple[Any, Any, Dict[str, Any]]:
+        """Index courant, construit une seule fois (requêtes et exécution spéculative concurrentes)"""
+        index = self._index
+        if index is not None:
+            return index
+        with self._index_lock:
+            if self._index is None:
+                entries = dict(self.cache)
+                if self._pending_index is not None:
+                    vectorizer, template_vectors = pickle.loads(self._pending_index)
+                    self._index = (vectorizer, template_vectors, entries)
+                else:
+                    self._index = self._build_index(entries)
+                self._pending_index = None
+            return self._index
+
+    def _valid_index(self, state: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Index d'instantané utilisable seulement si le fichier de cache est inchangé"""
+        if state and state.get("signature") == file_signature(self.cache_file):
+            return state
+        return None
+
+    def export_index(self) -> Dict[str, Any]:
+        """
+        Cache et index TF-IDF ajusté (picklé à part : dépicklé seulement à la première recherche).
+        Appelé depuis le thread de l'instantané : le cache exporté est la copie indexée, cohérente avec les vecteurs.
+        """
+        with self._index_lock:
+            pending, index = self._pending_index, self._index
+            if pending is not None:
+                return {"signature": file_signature(self.cache_file), "cache": dict(self.cache), "index": pending}
+        vectorizer, template_vectors, entries = index or self._ensure_index()
+        return {
+            "signature": file_signature(self.cache_file),
+            "cache": entries,
+            "index": pickle.dumps((vectorizer, template_vectors), protocol=pickle.HIGHEST_PROTOCOL),
+        }
+
+    def _build_index(self, entries: Dict[str, Any]) -> Tuple[Any, Any, Dict[str, Any]]:
+        """Ajuste le TF-IDF sur une copie du cache (variables locales, rien n'est publié ici)"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        vectorizer, template_vectors = TfidfVectorizer(), None
+        if entries:
+            templates = [self._normalize_template(item['question_template']) 
+                        for item in entries.values()]
+            vectorizer.fit(templates)
+            template_vectors = vectorizer.transform(templates)
+        return vectorizer, template_vectors, entries
 
     def _init_similarity_search(self):
         """Initialise le système de recherche de similarité"""
-        if self.cache:
-            templates = [self._normalize_template(item['question_template']) 
-                        for item in self.cache.values()]
-            self.vectorizer.fit(templates)
-            self.template_vectors = self.vectorizer.transform(templates)
+        with self._index_lock:
+            entries = dict(self.cache)
+        index = self._build_index(entries)
+        with self._index_lock:
+            self._index, self._pending_index = index, None
 
     def _load_cache(self) -> Dict[str, Any]:
         if not self.cache_file.exists():
@@ -129,8 +194,10 @@ class CacheManager1:
             return {}
 
     def _save_cache(self):
+        with self._index_lock:
+            cache = dict(self.cache)
         with open(self.cache_file, 'w', encoding='utf-8') as f:
-            json.dump(self.cache, f, indent=2, ensure_ascii=False)
+            json.dump(cache, f, indent=2, ensure_ascii=False)
         self._init_similarity_search()  # Recharge les vecteurs après sauvegarde
 
     def _extract_family_references(self, question: str) -> Dict[str, str]:
@@ -261,6 +328,7 @@ class CacheManager1:
         children_ids_str = [str(id) for id in children_ids]
         
         # Patterns pour remplacer les IDs spécifiques par des variables
+        ids_list_pattern = r',\s*'.join(children_ids_str)
         patterns_to_replace = [
             # WHERE clauses avec IdPersonne (un seul ID)
             (rf"\b(IdPersonne|e\.IdPersonne|eleve\.IdPersonne)\s*=\s*({'|'.join(children_ids_str)})\b", 
@@ -271,7 +339,7 @@ class CacheManager1:
             r'\1 IN ({id_personne})'),
             
             # WHERE clauses avec IN (plusieurs IDs)
-            (rf"\b(IdPersonne|e\.IdPersonne|eleve\.IdPersonne)\s+IN\s*\(\s*({',\s*'.join(children_ids_str)})\s*\)", 
+            (rf"\b(IdPersonne|e\.IdPersonne|eleve\.IdPersonne)\s+IN\s*\(\s*({ids_list_pattern})\s*\)", 
             r'\1 IN ({id_personne})'),
         ]
         
@@ -385,25 +453,47 @@ class CacheManager1:
 
     def find_similar_template(self, question: str, threshold: float = 0.85) -> Tuple[Optional[Dict], float]:
         """Trouve un template similaire en utilisant TF-IDF et cosine similarity"""
+        template, score = self._best_template_match(question)
+        if template is not None and score >= threshold:
+            return template, score
+        return None, 0.0
+
+    def _best_template_match(self, question: str) -> Tuple[Optional[Dict], float]:
+        """Template le plus proche et son score cosinus, sans seuil"""
         if not self.cache:
             return None, 0.0
             
         norm_question = self._normalize_template(question)
         
         try:
-            question_vec = self.vectorizer.transform([norm_question])
-            similarities = cosine_similarity(question_vec, self.template_vectors)[0]
+            from sklearn.metrics.pairwise import cosine_similarity
+
+            vectorizer, template_vectors, entries = self._ensure_index()
+            question_vec = vectorizer.transform([norm_question])
+            similarities = cosine_similarity(question_vec, template_vectors)[0]
             best_idx = np.argmax(similarities)
-            best_score = similarities[best_idx]
-            
-            if best_score >= threshold:
-                cache_key = list(self.cache.keys())[best_idx]
-                return self.cache[cache_key], best_score
+            return list(entries.values())[best_idx], float(similarities[best_idx])
         except Exception as e:
             print(f"⚠️ Erreur lors de la recherche de template similaire: {str(e)}")
         
         return None, 0.0
 
+    def get_candidate_query(self, question: str, current_user_id: int, min_score: float,
+                            threshold: float = 0.85, children_ids: Optional[List[int]] = None
+                            ) -> Optional[Tuple[str, Dict[str, str], float]]:
+        """
+        Template de la zone grise (min_score <= score < threshold), avec les IDs des enfants
+        du parent déjà substitués (`children_ids` déjà résolus pour la requête, sinon relus en base).
+        Retourne (sql_template, variables, score) ou None.
+        """
+        template, score = self._best_template_match(question)
+        if template is None or not (min_score <= score < threshold):
+            return None
+        _, variables = self._extract_parameters(question)
+        sql_template, current_vars = self._instantiate_similar_template(template, question, variables,
+                                                                        current_user_id, children_ids)
+        return sql_template, current_vars, score
+
     def _generate_cache_key(self, question: str) -> str:
         """Génère une clé basée sur la question normalisée"""
         normalized_question, _ = self._extract_parameters(question)
@@ -606,18 +696,14 @@ class CacheManager1:
             logger.error(traceback.format_exc())
             return []
         finally:
-            # Only close if we created a direct connection
+            # Return the connection to the pool
             try:
                 if cursor:
                     cursor.close()
                 
-                # Check if this is a Flask-managed connection
-                from flask import current_app
-                is_flask_connection = current_app and hasattr(current_app, 'extensions') and 'mysql' in current_app.extensions and connection == current_app.extensions['mysql'].connection
-                
-                if connection and not is_flask_connection:
+                if connection:
                     connection.close()
-                    logger.debug("🔌 Closed direct MySQL connection")
+                    logger.debug("🔌 MySQL connection returned to the pool")
             except Exception as close_error:
                 logger.warning(f"⚠️ Error during cleanup: {str(close_error)}")
 
@@ -632,10 +718,13 @@ class CacheManager1:
         norm_sql = self._normalize_sql(sql_query, vars_question)
         
         key = hashlib.md5(norm_question.encode()).hexdigest()
-        self.cache[key] = {
-            'question_template': norm_question,
-            'sql_template': norm_sql
-        }
+        with self._index_lock:
+            self.cache[key] = {
+                'question_template': norm_question,
+                'sql_template': norm_sql
+            }
+            # L'index de l'instantané ne correspond plus au cache
+            self._pending_index = None
         self._save_cache()
 
     def get_cached_query(self, question: str, current_user_id: int) -> Optional[Tuple[str, Dict[str, str]]]:
@@ -648,74 +737,64 @@ class CacheManager1:
             cached = self.cache[key]
             sql_template = cached['sql_template']
             
-            # Remplacer directement {id_personne} ou {{id_personne}} dans le SQL par les vrais IDs
-            if '{id_personne}' in sql_template or '{{id_personne}}' in sql_template:
-                children_ids = self.get_user_children_ids(current_user_id)
-                if children_ids:
-                    # Construire la valeur de remplacement selon le contexte
-                    if len(children_ids) == 1:
-                        id_replacement = str(children_ids[0])
-                    else:
-                        id_replacement = ','.join(str(id) for id in children_ids)
-                    
-                    # Remplacer les deux formats possibles
-                    sql_template = sql_template.replace('{{id_personne}}', id_replacement)
-                    sql_template = sql_template.replace('{id_personne}', id_replacement)
+            sql_template = sql_template.replace('{{id_personne}}', '{id_personne}')
             # Dans get_cached_query, après avoir géré id_personne
             if '{type_evaluation_column}' in sql_template:
                 sql_template = sql_template.replace('{type_evaluation_column}', variables['type_evaluation_column'])
-            # Gérer les autres variables normalement
+            # Gérer les autres variables normalement (valeurs liées par le driver à l'exécution)
             current_vars = {}
             for param in re.findall(r'\{(\w+)\}', sql_template):
                 if param in variables:
                     current_vars[param] = variables[param]
-            if 'jour' in current_vars:
-                if current_vars['jour'].lower() in ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']:
-                    current_vars['jour'] = f"'{current_vars['jour']}'"
+            self._bind_children_ids(sql_template, current_user_id, current_vars)
             return sql_template, current_vars
         
         # Si pas de correspondance exacte, chercher un template similaire
         similar_template, score = self.find_similar_template(question)
         if similar_template:
             print(f"🔍 Template similaire trouvé (score: {score:.2f})")
-            sql_template = similar_template['sql_template']
-            
-            # Remplacer directement {id_personne} ou {{id_personne}} dans le SQL par les vrais IDs
-            if '{id_personne}' in sql_template or '{{id_personne}}' in sql_template:
-                children_ids = self.get_user_children_ids(current_user_id)
-                if children_ids:
-                    # Construire la valeur de remplacement selon le contexte
-                    if len(children_ids) == 1:
-                        id_replacement = str(children_ids[0])
-                    else:
-                        id_replacement = ','.join(str(id) for id in children_ids)
-                    
-                    # Remplacer les deux formats possibles
-                    sql_template = sql_template.replace('{{id_personne}}', id_replacement)
-                    sql_template = sql_template.replace('{id_personne}', id_replacement)
-            
-            if '{type_evaluation_column}' in sql_template:
-                sql_template = sql_template.replace('{type_evaluation_column}', variables['type_evaluation_column'])
-            # Gérer les autres variables
-            current_vars = {}
-            for param in re.findall(r'\{(\w+)\}', sql_template):
-                if param in variables:
-                    current_vars[param] = variables[param]
-                else:
-                    # Essaye de trouver une valeur correspondante dans la question
-                    for pattern in self.auto_patterns:
-                        match = re.search(pattern, question)
-                        if match:
-                            value = match.group(1) if len(match.groups()) > 0 else match.group(0)
-                            current_vars[param] = value
-                            break
-            if 'jour' in current_vars:
-                if current_vars['jour'].lower() in ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']:
-                    current_vars['jour'] = f"'{current_vars['jour']}'"
-            return sql_template, current_vars
+            return self._instantiate_similar_template(similar_template, question, variables, current_user_id)
         
         return None
         
+    def _instantiate_similar_template(self, similar_template: Dict, question: str, variables: Dict[str, str],
+                                      current_user_id: int, children_ids: Optional[List[int]] = None
+                                      ) -> Tuple[str, Dict[str, str]]:
+        """SQL d'un template similaire avec les IDs enfants substitués, et variables tirées de la question"""
+        sql_template = similar_template['sql_template'].replace('{{id_personne}}', '{id_personne}')
+        
+        if '{type_evaluation_column}' in sql_template:
+            sql_template = sql_template.replace('{type_evaluation_column}', variables['type_evaluation_column'])
+        # Gérer les autres variables
+        current_vars = {}
+        for param in re.findall(r'\{(\w+)\}', sql_template):
+            if param in variables:
+                current_vars[param] = variables[param]
+            else:
+                # Essaye de trouver une valeur correspondante dans la question
+                for pattern in self.auto_patterns:
+                    match = re.search(pattern, question)
+                    if match:
+                        value = match.group(1) if len(match.groups()) > 0 else match.group(0)
+                        current_vars[param] = value
+                        break
+        self._bind_children_ids(sql_template, current_user_id, current_vars, children_ids)
+        return sql_template, current_vars
+
+    def _bind_children_ids(self, sql_template: str, current_user_id: int, current_vars: Dict[str, str],
+                           children_ids: Optional[List[int]] = None):
+        """
+        Valeur de {id_personne} : les IDs des enfants du parent connecté (liste séparée par des
+        virgules, liée élément par élément dans IN (...)), jamais une valeur tirée de la question.
+        Les IDs déjà résolus par l'appelant évitent un aller-retour en base.
+        """
+        current_vars.pop('id_personne', None)
+        if '{id_personne}' in sql_template:
+            if children_ids is None:
+                children_ids = self.get_user_children_ids(current_user_id)
+            if children_ids:
+                current_vars['id_personne'] = ','.join(str(id) for id in children_ids)
+
     def clean_double_braces_in_cache(self):
 
         """Nettoie le cache en remplaçant {{id_personne}} par {id_personne}"""
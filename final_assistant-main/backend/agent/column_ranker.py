@@ -0,0 +1,198 @@
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Iterable, Optional, Set, Any
+
+from agent.domain_classifier import tokenize
+
+logger = logging.getLogger(__name__)
+
+TOP_N = int(os.getenv("COLUMN_RANKER_TOP_N", "8"))
+USAGE_WEIGHT = float(os.getenv("COLUMN_RANKER_USAGE_WEIGHT", "0.5"))
+
+# Découpage des noms de colonnes : NomFr → nom, fr ; IdPersonne → id, personne
+NAME_PARTS = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+IDENTIFIER = re.compile(r'[a-z_]\w*')
+LANGUAGE_SUFFIX = re.compile(r'(fr|ar)$')
+# Les questions sont en français : les variantes arabes (NomAr) passent après NomFr
+ARABIC_PENALTY = 1.0
+# Plancher toujours rendu, quel que soit le score : clés et colonnes de date
+# (ex: DateNaissance pour « élèves nés en 2015 », que la question ne nomme pas)
+KEY_TYPES = ('PRI', 'UNI', 'MUL')
+DATE_TYPES = {'date', 'datetime', 'timestamp', 'year'}
+
+# Termes de la question (tokenisés) → fragments de noms de colonnes
+COLUMN_SYNONYMS = {
+    'nom': ['nom'],
+    'prenom': ['prenom'],
+    'niveau': ['niv'],
+    'classe': ['classe'],
+    'naissance': ['naiss'],
+    'age': ['naiss'],
+    'date': ['date'],
+    'telephone': ['tel', 'mobile'],
+    'tel': ['tel', 'mobile'],
+    'adresse': ['adresse', 'adr'],
+    'ville': ['localite', 'ville'],
+    'localite': ['localite'],
+    'sexe': ['sexe', 'civilite'],
+    'genre': ['sexe', 'civilite'],
+    'fille': ['sexe', 'civilite'],
+    'garcon': ['sexe', 'civilite'],
+    'moyenne': ['moy'],
+    'note': ['note', 'moy'],
+    'matiere': ['mati'],
+    'annee': ['annee'],
+    'montant': ['montant', 'prix'],
+    'prix': ['prix', 'montant'],
+    'paiement': ['montant', 'paiement'],
+    'email': ['mail'],
+    'mail': ['mail'],
+    'jour': ['jour'],
+    'heure': ['heure', 'seance'],
+    'nationalite': ['nationalite'],
+    'absence': ['absen'],
+    'inscription': ['inscri'],
+    'enseignant': ['enseign'],
+    'parent': ['parent'],
+    'libelle': ['libelle'],
+    'code': ['code'],
+}
+
+
+def column_tokens(name: str) -> Set[str]:
+    """Jetons d'un nom de colonne : parties camelCase et nom sans suffixe de langue"""
+    lowered = name.lower()
+    parts = {part.lower() for part in NAME_PARTS.findall(name)}
+    return parts | {lowered, LANGUAGE_SUFFIX.sub('', lowered)}
+
+
+class ColumnRanker:
+    """
+    Classe les colonnes d'une table selon leur pertinence pour la question : jetons du nom
+    et du commentaire, synonymes (nom → NomFr, niveau → NOMNIVFR) et fréquence d'usage dans
+    les requêtes SQL en cache. Seules les N meilleures colonnes, plus les clés, dates et
+    colonnes de jointure, sont rendues dans table_info.
+    """
+
+    def __init__(self, catalog, cached_sql: Iterable[str] = (), top_n: int = TOP_N,
+                 synonyms: Optional[Dict[str, List[str]]] = None):
+        self.catalog = catalog
+        self.top_n = top_n
+        self.synonyms = synonyms if synonyms is not None else COLUMN_SYNONYMS
+        self._lock = threading.Lock()
+        self._sql: List[str] = [sql for sql in cached_sql if sql]
+        self._usage: Counter = Counter()
+        self._version = None
+        self.stats = {"tables": 0, "pruned_tables": 0, "columns_before": 0, "columns_after": 0}
+
+    def _sync(self):
+        """Recompte l'usage des colonnes quand le catalogue du schéma a été rechargé"""
+        self.catalog.ensure_fresh()
+        if self.catalog.version == self._version:
+            return
+        with self._lock:
+            if self.catalog.version == self._version:
+                return
+            self._usage = Counter()
+            for sql in self._sql:
+                self._count(sql)
+            self._version = self.catalog.version
+            logger.info(f"📊 Usage des colonnes compté sur {len(self._sql)} requêtes en cache "
+                        f"({len(self._usage)} colonnes utilisées)")
+
+    def _count(self, sql: str):
+        identifiers = set(IDENTIFIER.findall(sql.lower()))
+        for key, table in self.catalog.tables.items():
+            if key not in identifiers:
+                continue
+            for column in table.columns:
+                if column.name.lower() in identifiers:
+                    self._usage[(key, column.name.lower())] += 1
+
+    def learn(self, sql: str):
+        """Ajoute une requête réussie (mise en cache) au comptage d'usage"""
+        if not sql:
+            return
+        with self._lock:
+            self._sql.append(sql)
+            if self._version is not None:
+                self._count(sql)
+
+    def usage(self, table: str, column: str) -> int:
+        return self._usage.get((table.lower(), column.lower()), 0)
+
+    def score(self, question_tokens: Set[str], table: str, column) -> float:
+        tokens = column_tokens(column.name)
+        lowered = column.name.lower()
+        score = 0.0
+        for token in question_tokens:
+            if token in tokens:
+                score += 3
+            elif len(token) >= 3 and any(fragment in lowered for fragment in self.synonyms.get(token, [])):
+                score += 2
+        if column.comment:
+            score += len(question_tokens & set(tokenize(column.comment)))
+        if score and lowered.endswith('ar'):
+            score -= ARABIC_PENALTY
+        return score + USAGE_WEIGHT * math.log1p(self.usage(table, column.name))
+
+    def select(self, question: str, table_name: str, keep: Iterable[str] = ()) -> List[Any]:
+        """Colonnes retenues pour une table, dans leur ordre d'origine"""
+        self._sync()
+        table = self.catalog.get(table_name)
+        if table is None:
+            return []
+        if len(table.columns) <= self.top_n:
+            return list(table.columns)
+
+        keep = {name.lower() for name in keep}
+        question_tokens = set(tokenize(question))
+        key = table.name.lower()
+        kept = {
+            column.name for column in table.columns
+            if column.key in KEY_TYPES or column.data_type in DATE_TYPES or column.name.lower() in keep
+        }
+        scored = sorted(
+            ((self.score(question_tokens, key, column), -index, column.name)
+             for index, column in enumerate(table.columns) if column.name not in kept),
+            reverse=True
+        )
+        kept.update(name for score, _, name in scored[:self.top_n] if score > 0)
+        return [column for column in table.columns if column.name in kept]
+
+    def render(self, question: str, tables: Iterable[str],
+               keep: Optional[Dict[str, Set[str]]] = None) -> str:
+        """table_info réduit aux colonnes pertinentes (les colonnes omises sont signalées)"""
+        self._sync()
+        keep = keep or {}
+        rendered = []
+        for table_name in dict.fromkeys(t.lower() for t in tables):
+            table = self.catalog.get(table_name)
+            if table is None:
+                continue
+            columns = self.select(question, table_name, keep.get(table_name, ()))
+            text = table.render(columns)
+            omitted = len(table.columns) - len(columns)
+            if omitted:
+                text += f"\n  (+{omitted} colonnes non pertinentes omises)"
+            rendered.append(text)
+
+            with self._lock:
+                self.stats["tables"] += 1
+                self.stats["pruned_tables"] += bool(omitted)
+                self.stats["columns_before"] += len(table.columns)
+                self.stats["columns_after"] += len(columns)
+        return "\n\n".join(rendered) if rendered else "Aucune table trouvée"
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "top_n": self.top_n,
+                "cached_queries": len(self._sql),
+                "used_columns": len(self._usage),
+                **self.stats,
+            }
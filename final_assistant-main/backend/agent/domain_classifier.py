@@ -0,0 +1,437 @@
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Mots-clés explicites (repris de get_relevant_domains_improved) : ajoutés
+# au document du domaine avec un poids renforcé
+KEYWORD_HINTS = {
+    'section': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'civilité': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'nationalité': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'niveau': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'élève': ['ELEVES_INSCRIPTIONS'],
+    'inscription': ['ELEVES_INSCRIPTIONS'],
+    'réinscription': ['ELEVES_INSCRIPTIONS'],
+    'classe': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'localité': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'gouvernorat': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'établissement': ['GENERAL_ADMINISTRATION_CONFIG'],
+    'note': ['SUIVI_SCOLARITE'],
+    'moyenne': ['SUIVI_SCOLARITE'],
+    'absence': ['SUIVI_SCOLARITE'],
+    'retard': ['SUIVI_SCOLARITE'],
+    'sanction': ['SUIVI_SCOLARITE'],
+    'parent': ['PARENTS'],
+    'père': ['PARENTS'],
+    'mère': ['PARENTS'],
+    'cantine': ['CANTINE'],
+    'repas': ['CANTINE'],
+    'menu': ['CANTINE'],
+    'enseignant': ['PERSONNEL_ENSEIGNEMENT'],
+    'professeur': ['PERSONNEL_ENSEIGNEMENT'],
+    'surveillant': ['PERSONNEL_ENSEIGNEMENT'],
+    'matière': ['PERSONNEL_ENSEIGNEMENT'],
+    'paiement': ['FINANCES_PAIEMENTS'],
+    'payé': ['FINANCES_PAIEMENTS'],
+    'frais': ['FINANCES_PAIEMENTS'],
+    'tranche': ['FINANCES_PAIEMENTS'],
+    'emploi du temps': ['EMPLOIS_DU_TEMPS'],
+    'séance': ['EMPLOIS_DU_TEMPS'],
+    'salle': ['EMPLOIS_DU_TEMPS'],
+    'examen': ['EMPLOIS_DU_TEMPS'],
+    'trimestre': ['EMPLOIS_DU_TEMPS'],
+}
+
+STOPWORDS = {
+    'le', 'la', 'les', 'l', 'un', 'une', 'des', 'de', 'du', 'd', 'et', 'ou', 'a', 'au', 'aux',
+    'en', 'dans', 'par', 'pour', 'sur', 'avec', 'sans', 'ce', 'ces', 'cet', 'cette', 'qui',
+    'que', 'quoi', 'quel', 'quelle', 'quels', 'quelles', 'est', 'sont', 'il', 'elle', 'ils',
+    'y', 'moi', 'mon', 'ma', 'mes', 'son', 'sa', 'ses', 'leur', 'leurs', 'nous', 'vous',
+    'donne', 'donner', 'liste', 'lister', 'affiche', 'afficher', 'combien', 'nombre', 'total',
+    'tous', 'toutes', 'tout', 'ne', 'pas', 'plus', 'cela', 'inclut', 'domaine', 'ceci',
+    'egalement', 'ainsi', 'se', 'qu', 'chaque', 'entre', 'via', 'the',
+}
+
+KEYWORD_WEIGHT = 3
+EXAMPLE_WEIGHT = 1
+TABLE_WEIGHT = 1
+
+DEFAULT_CONFIDENCE_THRESHOLD = float(os.getenv("DOMAIN_CLASSIFIER_THRESHOLD", "0.55"))
+# Nombre maximum de questions apprises conservées (les plus anciennes sont oubliées)
+MAX_LEARNED_EXAMPLES = int(os.getenv("DOMAIN_CLASSIFIER_MAX_EXAMPLES", "2000"))
+# Fichier de données (hors arbre source, ignoré par git), à côté de l'instantané de démarrage
+DEFAULT_EXAMPLES_FILE = Path(os.getenv(
+    "DOMAIN_EXAMPLES_PATH", str(Path(__file__).resolve().parent.parent / "data" / "domain_examples.json")
+))
+# Délai de regroupement des sauvegardes : learn() n'écrit jamais sur le thread de la requête
+SAVE_DELAY = float(os.getenv("DOMAIN_CLASSIFIER_SAVE_DELAY", "5"))
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(char for char in text if unicodedata.category(char) != 'Mn')
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenise un texte français : minuscules, sans accents, sans mots vides, pluriels simplifiés"""
+    text = _strip_accents(text.lower())
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', text):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        if len(token) > 4 and token[-1] in ('s', 'x'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def question_key(question: str) -> str:
+    """Forme normalisée d'une question (dédoublonnage des exemples appris)"""
+    return " ".join(tokenize(question))
+
+
+class _Index:
+    """
+    Index BM25 figé : construit à partir des fréquences par domaine et jamais modifié
+    ensuite. Une mise à jour produit un nouvel index, remplacé d'un seul coup.
+    """
+
+    __slots__ = ("term_freqs", "doc_lengths", "avg_length", "idf")
+
+    def __init__(self, term_freqs: Dict[str, Counter]):
+        doc_freq = Counter()
+        for freqs in term_freqs.values():
+            doc_freq.update(freqs.keys())
+        n_docs = max(len(term_freqs), 1)
+        self.term_freqs = term_freqs
+        self.doc_lengths = {domain: sum(freqs.values()) for domain, freqs in term_freqs.items()}
+        self.avg_length = (sum(self.doc_lengths.values()) / n_docs) if term_freqs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def updated(self, domains: Iterable[str], tokens: List[str], sign: int = 1) -> "_Index":
+        """Nouvel index avec les mots d'une question ajoutés (sign=1) ou retirés (sign=-1)"""
+        term_freqs = dict(self.term_freqs)
+        for domain in domains:
+            if domain not in term_freqs:
+                continue
+            freqs = Counter(term_freqs[domain])
+            for token in tokens:
+                freqs[token] += sign * EXAMPLE_WEIGHT
+                if freqs[token] <= 0:
+                    del freqs[token]
+            term_freqs[domain] = freqs
+        return _Index(term_freqs)
+
+
+def llm_select_domains(query: str, domain_descriptions: Dict[str, str],
+                       ask: Callable[..., str]) -> List[str]:
+    """Sélection des domaines par le LLM (chemin historique, utilisé en repli)"""
+    domain_desc_str = "\n".join([f"- {name}: {desc}" for name, desc in domain_descriptions.items()])
+    domain_prompt_content = f"""
+        Based on the following user question, identify ALL relevant domains from the list below.
+        Return only the names of the relevant domains, separated by commas. If no domain is relevant, return 'None'.
+
+        User Question: {query}
+
+        Available Domains and Descriptions:
+        {domain_desc_str}
+
+        Relevant Domains (comma-separated):
+        """
+
+    response = ask(domain_prompt_content, stage="domain")
+    domain_names = response.strip()
+
+    if domain_names.lower() == 'none' or not domain_names:
+        return []
+
+    return [d.strip() for d in domain_names.split(',')]
+
+
+class DomainClassifier:
+    """
+    Classifieur local BM25 des domaines métier.
+    Chaque domaine est un document construit à partir de sa description, de ses
+    tables, des mots-clés explicites et des questions déjà résolues.
+    """
+
+    def __init__(self, domain_descriptions: Dict[str, str], domain_to_tables: Dict[str, List[str]],
+                 examples_file: str = str(DEFAULT_EXAMPLES_FILE),
+                 cached_queries: Optional[Iterable[Tuple[str, str]]] = None,
+                 threshold: float = DEFAULT_CONFIDENCE_THRESHOLD,
+                 k1: float = 1.2, b: float = 0.75, relative_cutoff: float = 0.6, max_domains: int = 3,
+                 max_learned: int = MAX_LEARNED_EXAMPLES, save_delay: float = SAVE_DELAY):
+        self.domain_descriptions = domain_descriptions or {}
+        self.domain_to_tables = domain_to_tables or {}
+        self.examples_file = Path(examples_file)
+        self.threshold = threshold
+        self.k1 = k1
+        self.b = b
+        self.relative_cutoff = relative_cutoff
+        self.max_domains = max_domains
+        self.max_learned = max_learned
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+
+        # Questions apprises par forme normalisée (ordre d'insertion = ordre d'oubli)
+        self._learned: Dict[str, Dict] = {}
+        for example in self._load_examples():
+            key = question_key(example.get("question", ""))
+            if key:
+                self._learned.pop(key, None)
+                self._learned[key] = example
+        for key in list(self._learned)[:max(len(self._learned) - max_learned, 0)]:
+            del self._learned[key]
+        self.examples = list(self._learned.values())
+        if cached_queries:
+            self._seed_from_cached_sql(cached_queries)
+        self._build_index()
+        # Les exemples appris dans les dernières secondes ne sont pas perdus à l'arrêt
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # Construction de l'index
+    # ------------------------------------------------------------------
+
+    def _load_examples(self) -> List[Dict]:
+        if not self.examples_file.exists():
+            return []
+        try:
+            with open(self.examples_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                return data if isinstance(data, list) else []
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"⚠️ Exemples de domaines illisibles: {e}")
+            return []
+
+    def _schedule_save(self):
+        """Programme une sauvegarde différée (appelé sous _lock) ; les apprentissages rapprochés sont regroupés"""
+        if self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        """Écrit les exemples appris en attente (timer de sauvegarde, arrêt du processus)"""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            learned = list(self._learned.values())
+        self._save_examples(learned)
+
+    def _save_examples(self, learned: List[Dict]):
+        """
+        Fusionne avec le fichier (exemples appris par les autres workers, plus anciens en tête),
+        borne à max_learned puis remplace le fichier atomiquement
+        """
+        merged: Dict[str, Dict] = {}
+        for example in self._load_examples() + learned:
+            key = question_key(example.get("question", ""))
+            if key:
+                merged.pop(key, None)
+                merged[key] = example
+        examples = list(merged.values())[-self.max_learned:] if self.max_learned else []
+        try:
+            self.examples_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.examples_file.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(examples, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.examples_file)
+        except OSError as e:
+            logger.warning(f"⚠️ Impossible de sauvegarder les exemples de domaines: {e}")
+
+    def _seed_from_cached_sql(self, cached_queries: Iterable[Tuple[str, str]]):
+        """Étiquette les questions du cache SQL par les domaines de leurs tables non partagées"""
+        table_domains = defaultdict(set)
+        for domain, tables in self.domain_to_tables.items():
+            for table in tables:
+                table_domains[table.lower()].add(domain)
+
+        for question, sql in cached_queries:
+            tables = re.findall(r'\b(?:from|join)\s+`?(\w+)`?', sql or "", re.IGNORECASE)
+            domains = set()
+            for table in tables:
+                owners = table_domains.get(table.lower(), set())
+                if len(owners) == 1:
+                    domains.update(owners)
+            if domains:
+                self.examples.append({"question": question, "domains": sorted(domains), "seed": True})
+
+    def _build_index(self):
+        documents = {}
+        for domain, description in self.domain_descriptions.items():
+            tokens = tokenize(description)
+            for table in self.domain_to_tables.get(domain, []):
+                tokens.extend(tokenize(table.replace('_', ' ')) * TABLE_WEIGHT)
+            documents[domain] = tokens
+
+        for keyword, domains in KEYWORD_HINTS.items():
+            for domain in domains:
+                if domain in documents:
+                    documents[domain].extend(tokenize(keyword) * KEYWORD_WEIGHT)
+
+        for example in self.examples:
+            for domain in example.get("domains", []):
+                if domain in documents:
+                    documents[domain].extend(tokenize(example.get("question", "")) * EXAMPLE_WEIGHT)
+
+        self._index = _Index({domain: Counter(tokens) for domain, tokens in documents.items()})
+
+    # ------------------------------------------------------------------
+    # Classification
+    # ------------------------------------------------------------------
+
+    def score(self, question: str, index: Optional[_Index] = None) -> Dict[str, float]:
+        """Scores BM25 de chaque domaine pour la question"""
+        # Une seule lecture de l'index : learn() peut le remplacer pendant le calcul
+        index = index or self._index
+        query_terms = tokenize(question)
+        scores = {}
+        for domain, freqs in index.term_freqs.items():
+            length_norm = self.k1 * (1 - self.b + self.b * index.doc_lengths[domain] / (index.avg_length or 1))
+            total = 0.0
+            for term in query_terms:
+                tf = freqs.get(term)
+                if tf:
+                    total += index.idf[term] * tf * (self.k1 + 1) / (tf + length_norm)
+            scores[domain] = total
+        return scores
+
+    def rank(self, question: str, limit: Optional[int] = None) -> List[str]:
+        """Domaines de score positif, du plus au moins probable (même sans confiance suffisante)"""
+        ranked = sorted(((domain, value) for domain, value in self.score(question).items() if value > 0),
+                        key=lambda item: item[1], reverse=True)
+        return [domain for domain, _ in ranked][:limit or None]
+
+    def classify(self, question: str) -> Tuple[List[str], float]:
+        """
+        Retourne (domaines, confiance). La confiance combine la marge entre les
+        domaines retenus et les autres, et la part des mots de la question connus de l'index.
+        """
+        query_terms = tokenize(question)
+        if not query_terms:
+            return [], 0.0
+
+        index = self._index
+        scores = self.score(question, index)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] <= 0:
+            return [], 0.0
+
+        top_score = ranked[0][1]
+        selected = [domain for domain, value in ranked
+                    if value >= top_score * self.relative_cutoff][:self.max_domains]
+        rejected = [value for domain, value in ranked if domain not in selected]
+        best_rejected = rejected[0] if rejected else 0.0
+
+        margin = (top_score - best_rejected) / top_score
+        coverage = sum(1 for term in query_terms if term in index.idf) / len(query_terms)
+        confidence = round(0.6 * margin + 0.4 * coverage, 3)
+        return selected, confidence
+
+    def is_confident(self, confidence: float) -> bool:
+        return confidence >= self.threshold
+
+    def learn(self, question: str, domains: List[str]):
+        """
+        Ajoute une question étiquetée (par le LLM) : une question déjà connue n'est ajoutée
+        qu'une fois (ses domaines sont remplacés s'ils changent), les plus anciennes sont
+        oubliées au-delà de max_learned, et seuls les domaines concernés de l'index changent.
+        """
+        valid = sorted({domain for domain in domains if domain in self.domain_descriptions})
+        key = question_key(question)
+        if not valid or not key or not self.max_learned:
+            return
+        tokens = key.split()
+        with self._lock:
+            previous = self._learned.get(key)
+            if previous is not None and previous["domains"] == valid:
+                return
+            index = self._index
+            if previous is not None:
+                self._forget(key, previous)
+                index = index.updated(previous["domains"], tokens, sign=-1)
+            while len(self._learned) >= self.max_learned:
+                oldest_key, oldest = next(iter(self._learned.items()))
+                self._forget(oldest_key, oldest)
+                index = index.updated(oldest["domains"], oldest_key.split(), sign=-1)
+
+            example = {"question": question, "domains": valid}
+            self.examples.append(example)
+            self._learned[key] = example
+            self._index = index.updated(valid, tokens)
+            self._schedule_save()
+
+    def _forget(self, key: str, example: Dict):
+        del self._learned[key]
+        self.examples.remove(example)
+
+    # ------------------------------------------------------------------
+    # Évaluation sur un corpus rejoué
+    # ------------------------------------------------------------------
+
+    def evaluate(self, questions: Iterable[str],
+                 reference: Callable[[str], List[str]]) -> Dict[str, float]:
+        """
+        Compare le classifieur à une référence (étiquettes ou LLM) sur un corpus de questions.
+        Rapporte l'accord exact, le Jaccard moyen, l'accord sur le domaine principal,
+        le taux de repli et la latence moyenne du classifieur.
+        """
+        total = exact = top1 = confident = 0
+        jaccard_sum = 0.0
+        confident_exact = 0
+        latency_us = 0.0
+
+        for question in questions:
+            start = time.perf_counter()
+            predicted, confidence = self.classify(question)
+            latency_us += (time.perf_counter() - start) * 1e6
+
+            try:
+                expected = [d for d in reference(question) if d in self.domain_descriptions]
+            except Exception as e:
+                logger.warning(f"⚠️ Référence indisponible pour '{question}': {e}")
+                continue
+
+            total += 1
+            predicted_set, expected_set = set(predicted), set(expected)
+            is_exact = predicted_set == expected_set
+            exact += is_exact
+            union = predicted_set | expected_set
+            jaccard_sum += (len(predicted_set & expected_set) / len(union)) if union else 1.0
+            if predicted and predicted[0] in expected_set:
+                top1 += 1
+            if self.is_confident(confidence):
+                confident += 1
+                confident_exact += is_exact
+
+        if not total:
+            return {"questions": 0}
+
+        return {
+            "questions": total,
+            "exact_match": round(exact / total, 3),
+            "mean_jaccard": round(jaccard_sum / total, 3),
+            "top1_agreement": round(top1 / total, 3),
+            "fallback_rate": round(1 - confident / total, 3),
+            "confident_exact_match": round(confident_exact / confident, 3) if confident else None,
+            "avg_latency_us": round(latency_us / total, 1),
+        }
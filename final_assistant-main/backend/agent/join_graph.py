@@ -0,0 +1,231 @@
+import os
+import re
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Iterable, Set, Tuple, Any
+
+from agent.domain_classifier import tokenize
+
+logger = logging.getLogger(__name__)
+
+MAX_PATH_LENGTH = int(os.getenv("JOIN_GRAPH_MAX_PATH", "4"))
+
+# Relations écrites `table.colonne = table.colonne` (ou via alias) dans les prompts
+RELATION_PATTERN = re.compile(r'\b([A-Za-z_]\w*)\.(\w+)\s*=\s*([A-Za-z_]\w*)\.(\w+)\b')
+ALIAS_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)', re.IGNORECASE)
+SQL_KEYWORDS = {'on', 'where', 'join', 'left', 'right', 'inner', 'group', 'order', 'limit', 'and', 'as'}
+
+# Termes de la question qui désignent une table sans la nommer
+ENTITY_SYNONYMS = {
+    'eleve': ['eleve', 'etudiant', 'enfant'],
+    # Pas de mots génériques (nom, prénom, heure...) : ils apparaissent dans des questions
+    # de tous les domaines et feraient élaguer les tables dont la question a besoin
+    'personne': ['telephone', 'adresse', 'cin', 'civilite'],
+    'enseingant': ['enseignant', 'professeur', 'prof'],
+    'inscriptioneleve': ['inscription', 'inscrit', 'reinscription', 'reinscrit'],
+    'anneescolaire': ['anneescolaire', 'scolaire'],
+    'emploidutemps': ['emploi'],
+    'parent': ['parent', 'pere', 'mere'],
+    'jour': ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi'],
+    'matiere': ['matiere'],
+    'seance': ['seance'],
+}
+
+
+@dataclass(frozen=True)
+class JoinEdge:
+    left_table: str
+    left_column: str
+    right_table: str
+    right_column: str
+    source: str = "fk"
+
+    def condition(self) -> str:
+        return f"{self.left_table}.{self.left_column} = {self.right_table}.{self.right_column}"
+
+
+@dataclass
+class JoinPlan:
+    tables: List[str]
+    edges: List[JoinEdge] = field(default_factory=list)
+    entities: List[str] = field(default_factory=list)
+    pruned: bool = True
+
+    def columns(self) -> Dict[str, Set[str]]:
+        """Colonnes de jointure par table (à conserver dans table_info)"""
+        columns: Dict[str, Set[str]] = {}
+        for edge in self.edges:
+            columns.setdefault(edge.left_table.lower(), set()).add(edge.left_column)
+            columns.setdefault(edge.right_table.lower(), set()).add(edge.right_column)
+        return columns
+
+    def render_joins(self) -> str:
+        if not self.edges:
+            return ""
+        return "Jointures à utiliser :\n" + "\n".join(f"  - {edge.condition()}" for edge in self.edges)
+
+
+class JoinGraph:
+    """
+    Graphe des jointures entre tables : clés étrangères d'INFORMATION_SCHEMA et relations
+    écrites en dur dans les prompts. Pour une question, ne garde que les tables situées sur
+    les plus courts chemins entre les entités mentionnées, avec leurs conditions de jointure.
+    """
+
+    def __init__(self, catalog, relations_text: str = "", max_path_length: int = MAX_PATH_LENGTH):
+        self.catalog = catalog
+        self.relations_text = relations_text
+        self.max_path_length = max_path_length
+        self._lock = threading.Lock()
+        self._version = None
+        self._adjacency: Dict[str, Dict[str, List[JoinEdge]]] = {}
+        self.stats = {"plans": 0, "pruned": 0, "fallback": 0, "tables_before": 0, "tables_after": 0}
+
+    def _sync(self):
+        """Reconstruit le graphe quand le catalogue du schéma a été rechargé"""
+        self.catalog.ensure_fresh()
+        if self.catalog.version == self._version:
+            return
+        with self._lock:
+            if self.catalog.version == self._version:
+                return
+            adjacency: Dict[str, Dict[str, List[JoinEdge]]] = {}
+            edges = [
+                JoinEdge(fk.table, fk.column, fk.referenced_table, fk.referenced_column, "fk")
+                for fk in self.catalog.foreign_keys
+            ] + self._prompt_relations()
+
+            for edge in edges:
+                left, right = edge.left_table.lower(), edge.right_table.lower()
+                if left == right:
+                    continue
+                for a, b in ((left, right), (right, left)):
+                    pair = adjacency.setdefault(a, {}).setdefault(b, [])
+                    if edge not in pair:
+                        pair.append(edge)
+
+            self._adjacency = adjacency
+            self._version = self.catalog.version
+            logger.info(
+                f"🕸️ Graphe de jointures: {len(adjacency)} tables, "
+                f"{sum(len(n) for n in adjacency.values()) // 2} relations (schéma v{self._version})"
+            )
+
+    def _prompt_aliases(self) -> Dict[str, str]:
+        """Alias des exemples SQL des prompts (`JOIN classe c`) ; les alias ambigus sont écartés"""
+        aliases: Dict[str, Set[str]] = {}
+        for table, alias in ALIAS_PATTERN.findall(self.relations_text):
+            if alias.lower() not in SQL_KEYWORDS and self.catalog.get(table):
+                aliases.setdefault(alias.lower(), set()).add(table.lower())
+        return {alias: tables.pop() for alias, tables in aliases.items() if len(tables) == 1}
+
+    def _prompt_relations(self) -> List[JoinEdge]:
+        """Relations des prompts dont les deux tables et colonnes existent dans le catalogue"""
+        edges = []
+        aliases = self._prompt_aliases()
+        for left_table, left_column, right_table, right_column in RELATION_PATTERN.findall(self.relations_text):
+            left = self.catalog.get(left_table) or self.catalog.get(aliases.get(left_table.lower(), ''))
+            right = self.catalog.get(right_table) or self.catalog.get(aliases.get(right_table.lower(), ''))
+            if not left or not right:
+                continue
+            left_col, right_col = left.column(left_column), right.column(right_column)
+            if left_col and right_col:
+                edges.append(JoinEdge(left.name, left_col.name, right.name, right_col.name, "prompt"))
+        return edges
+
+    def mentioned_tables(self, question: str, candidates: Iterable[str]) -> List[str]:
+        """Tables désignées par la question : nom exact de la table ou synonyme"""
+        tokens = set(tokenize(question))
+        mentioned = []
+        for table in candidates:
+            key = table.lower()
+            if key in tokens or tokens & set(ENTITY_SYNONYMS.get(key, [])):
+                mentioned.append(key)
+        return mentioned
+
+    def _shortest_path(self, sources: Set[str], target: str, allowed: Optional[Set[str]]) -> Optional[List[str]]:
+        """Plus court chemin (BFS) d'un nœud de l'arbre vers la cible, limité en longueur"""
+        parents: Dict[str, Optional[str]] = {source: None for source in sources}
+        queue = deque((source, 0) for source in sources)
+        while queue:
+            node, depth = queue.popleft()
+            if node == target:
+                path = [node]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                return list(reversed(path))
+            if depth >= self.max_path_length:
+                continue
+            for neighbor in self._adjacency.get(node, {}):
+                if neighbor in parents or (allowed is not None and neighbor not in allowed and neighbor != target):
+                    continue
+                parents[neighbor] = node
+                queue.append((neighbor, depth + 1))
+        return None
+
+    def _connect(self, entities: List[str], candidates: Set[str]) -> Optional[Tuple[List[str], List[JoinEdge]]]:
+        """
+        Arbre couvrant approché : chaque entité est reliée à l'arbre par son plus court chemin,
+        puis chaque entité reçoit ses voisins par les relations obligatoires des prompts
+        (ex: eleve → personne pour les noms).
+        """
+        tree = [entities[0]]
+        edges: List[JoinEdge] = []
+        for entity in entities[1:]:
+            if entity in tree:
+                continue
+            # D'abord par les tables des domaines choisis, puis par tout le schéma
+            path = self._shortest_path(set(tree), entity, candidates) or self._shortest_path(set(tree), entity, None)
+            if path is None:
+                return None
+            for left, right in zip(path, path[1:]):
+                edges.extend(self._adjacency[left][right])
+                if right not in tree:
+                    tree.append(right)
+
+        for entity in entities:
+            for neighbor, pair in self._adjacency.get(entity, {}).items():
+                mandatory = [edge for edge in pair if edge.source == "prompt"]
+                if mandatory and neighbor not in tree:
+                    tree.append(neighbor)
+                    edges.extend(mandatory)
+        return tree, list(dict.fromkeys(edges))
+
+    def plan(self, question: str, candidate_tables: Iterable[str]) -> JoinPlan:
+        """
+        Tables à envoyer au prompt SQL pour une question.
+        L'élagage n'a lieu qu'à partir de deux entités reliées : une seule entité ne dit rien
+        des tables du domaine nécessaires (absences, notes...). Sinon les tables candidates
+        sont conservées, sauf les vues que la question ne nomme pas.
+        """
+        self._sync()
+        candidates = list(dict.fromkeys(t.lower() for t in candidate_tables))
+        # Les entités peuvent sortir des domaines choisis (ex: classe pour une question sur les élèves)
+        entities = self.mentioned_tables(question, list(dict.fromkeys(candidates + list(self.catalog.tables))))
+        self.stats["plans"] += 1
+        self.stats["tables_before"] += len(candidates)
+
+        connected = self._connect(entities, set(candidates)) if len(entities) >= 2 else None
+        if connected is None:
+            tables = [
+                t for t in candidates
+                if t in entities or not getattr(self.catalog.get(t), 'is_view', False)
+            ]
+            self.stats["fallback"] += 1
+            self.stats["tables_after"] += len(tables)
+            return JoinPlan(tables, entities=entities, pruned=False)
+
+        tables, edges = connected
+        self.stats["pruned"] += 1
+        self.stats["tables_after"] += len(tables)
+        logger.info(f"🕸️ Tables retenues par le graphe de jointures: {len(tables)}/{len(candidates)} ({', '.join(tables)})")
+        return JoinPlan(tables, edges, entities)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "schema_version": self._version,
+            "tables": len(self._adjacency),
+            **self.stats,
+        }
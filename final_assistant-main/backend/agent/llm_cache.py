@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Étapes déterministes dont la réponse ne dépend que du prompt et des paramètres
+DEFAULT_CACHEABLE_STAGES = "domain,sql,repair,single_call"
+
+# Paramètres sans effet sur le contenu de la réponse, exclus de la clé
+NON_SEMANTIC_PARAMS = {"timeout"}
+
+
+class LLMCompletionCache:
+    """
+    Cache disque prompt → réponse pour les étapes LLM déterministes.
+    SQLite en mode WAL : partageable entre processus workers (verrouillage géré par SQLite).
+    Clé = sha256(modèle, paramètres, messages) ; TTL, éviction LRU bornée et compteurs hit/miss.
+    Les lectures ne prennent aucun verrou d'écriture : compteurs et dates d'accès sont
+    accumulés en mémoire puis écrits avec la prochaine écriture (put, invalidate, stats).
+    """
+
+    def __init__(self, db_path: str = None, ttl_seconds: Optional[int] = None,
+                 max_entries: Optional[int] = None, stages: Optional[str] = None):
+        if db_path is None:
+            db_path = os.getenv('LLM_CACHE_PATH') or os.path.join(
+                os.path.dirname(__file__), '..', 'data', 'llm_cache.db'
+            )
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+        self.stages = {
+            stage.strip() for stage in (stages or os.getenv('LLM_CACHE_STAGES', DEFAULT_CACHEABLE_STAGES)).split(',')
+            if stage.strip()
+        }
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        self._pending_counters: Dict[str, int] = {}
+        self._pending_access: Dict[str, float] = {}
+        self.init_database()
+
+    def init_database(self):
+        """Crée les tables du cache si elles n'existent pas"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions(last_access)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.commit()
+        logger.info(f"✅ Cache des complétions LLM initialisé: {self.db_path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Une connexion par thread, en WAL pour les accès concurrents inter-processus"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def is_cacheable(self, stage: str, params: Dict[str, Any]) -> bool:
+        return stage in self.stages and not params.get('stream')
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        semantic = {k: v for k, v in params.items() if k not in NON_SEMANTIC_PARAMS}
+        payload = json.dumps({"params": semantic, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Réponse sérialisée si présente et non expirée (None sinon) ; simple lecture"""
+        try:
+            row = self._connection().execute(
+                'SELECT response, created_at FROM completions WHERE key = ?', (key,)
+            ).fetchone()
+        except Exception as e:
+            logger.warning(f"⚠️ Lecture du cache LLM impossible: {e}")
+            return None
+
+        now = time.time()
+        with self._pending_lock:
+            if row and now - row[1] <= self.ttl_seconds:
+                self._pending_access[key] = now
+                self._count('hits')
+                return json.loads(row[0])
+            # Entrée expirée : supprimée (et comptée) par la prochaine écriture (_evict)
+            self._count('misses')
+        return None
+
+    def put(self, key: str, stage: str, model: str, response: Dict[str, Any]):
+        try:
+            conn = self._connection()
+            now = time.time()
+            conn.execute('''
+                INSERT OR REPLACE INTO completions (key, stage, model, response, created_at, last_access, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+            ''', (key, stage, model, json.dumps(response, ensure_ascii=False), now, now))
+            self._flush(conn)
+            self._evict(conn)
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Écriture du cache LLM impossible: {e}")
+
+    def invalidate(self, key: str) -> bool:
+        """Supprime une réponse dont le résultat s'est révélé faux (SQL invalide ou en échec)"""
+        try:
+            conn = self._connection()
+            deleted = conn.execute('DELETE FROM completions WHERE key = ?', (key,)).rowcount
+            with self._pending_lock:
+                self._pending_access.pop(key, None)
+                if deleted:
+                    self._count('invalidated')
+            self._flush(conn)
+            conn.commit()
+            return bool(deleted)
+        except Exception as e:
+            logger.warning(f"⚠️ Invalidation du cache LLM impossible: {e}")
+            return False
+
+    def _count(self, name: str, amount: int = 1):
+        """Compteur en attente d'écriture (appelé sous _pending_lock)"""
+        self._pending_counters[name] = self._pending_counters.get(name, 0) + amount
+
+    def _flush(self, conn: sqlite3.Connection):
+        """Écrit les compteurs et dates d'accès accumulés depuis la dernière écriture"""
+        with self._pending_lock:
+            counters, self._pending_counters = self._pending_counters, {}
+            access, self._pending_access = self._pending_access, {}
+        if access:
+            conn.executemany('UPDATE completions SET last_access = ?, hits = hits + 1 WHERE key = ?',
+                             [(when, key) for key, when in access.items()])
+        for name, amount in counters.items():
+            self._increment(conn, name, amount)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de max_entries"""
+        expired = conn.execute('DELETE FROM completions WHERE created_at < ?',
+                               (time.time() - self.ttl_seconds,)).rowcount
+        if expired > 0:
+            self._increment(conn, 'expired', expired)
+        count = conn.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute('''
+                DELETE FROM completions WHERE key IN (
+                    SELECT key FROM completions ORDER BY last_access ASC LIMIT ?
+                )
+            ''', (overflow,))
+            self._increment(conn, 'evictions', overflow)
+
+    @staticmethod
+    def _increment(conn: sqlite3.Connection, name: str, amount: int = 1):
+        conn.execute('''
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', (name, amount))
+
+    def stats(self) -> Dict[str, Any]:
+        """Compteurs partagés par tous les processus utilisant ce fichier"""
+        try:
+            conn = self._connection()
+            self._flush(conn)
+            conn.commit()
+            counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            entries = conn.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+            by_stage = dict(conn.execute('SELECT stage, COUNT(*) FROM completions GROUP BY stage').fetchall())
+        except Exception as e:
+            logger.warning(f"⚠️ Statistiques du cache LLM indisponibles: {e}")
+            return {"error": str(e)}
+
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stages": sorted(self.stages),
+            "entries_by_stage": by_stage,
+            "hits": hits,
+            "misses": misses,
+            "expired": counters.get('expired', 0),
+            "evictions": counters.get('evictions', 0),
+            "invalidated": counters.get('invalidated', 0),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        }
+
+    def clear(self):
+        conn = self._connection()
+        with self._pending_lock:
+            self._pending_counters.clear()
+            self._pending_access.clear()
+        conn.execute('DELETE FROM completions')
+        conn.execute('DELETE FROM counters')
+        conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCompletionCache]:
+    """Cache partagé du processus ; None si désactivé (LLM_CACHE_ENABLED=false) ou indisponible"""
+    global _cache
+    if os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = LLMCompletionCache()
+                except Exception as e:
+                    logger.error(f"❌ Cache LLM indisponible: {e}")
+                    _cache = False
+    return _cache or None
@@ -1,35 +1,341 @@
-from openai import OpenAI
+import httpx
 import os
+import json
 import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional, Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Le SDK OpenAI (modèles pydantic) est importé au premier appel LLM, pas au démarrage
+    from openai import OpenAI
+
+from agent.usage_tracker import usage_tracker
+from agent.llm_cache import get_llm_cache
+from agent.resilience import LLMUnavailableError, get_breaker, stage_timeout, is_outage
 
 logger = logging.getLogger(__name__)
 
-def ask_llm(prompt: str) -> str:
+# Clé de cache de la dernière complétion de chaque étape, pour la requête en cours
+_completion_keys: ContextVar[Dict[str, str]] = ContextVar("llm_completion_keys", default={})
+
+# Profils par étape du pipeline : chaque appel LLM choisit son profil
+# (modèle, température, max_tokens, timeout) au lieu de paramètres codés en dur.
+# Valeurs de base, complétées par le jeu de profils actif de config/llm_profiles.json.
+BASE_STAGE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {"model": "gpt-4o", "temperature": 0.1, "max_tokens": 2048, "timeout": 100},
+    "domain": {"model": "gpt-4o", "temperature": 0.1, "max_tokens": 2048, "timeout": 100},
+    "sql": {"model": "gpt-4o", "temperature": 0.1, "max_tokens": 2048, "timeout": 100},
+    "repair": {"model": "gpt-4o", "temperature": 0, "max_tokens": 300, "timeout": 100},
+    "format": {"model": "gpt-4o", "temperature": 0.2, "max_tokens": 400, "timeout": 100},
+    # Appel unique domaines + SQL : réponse JSON structurée
+    "single_call": {"model": "gpt-4o", "temperature": 0.1, "max_tokens": 2048, "timeout": 100,
+                    "response_format": {"type": "json_object"}},
+}
+
+PROFILES_PATH = os.getenv("LLM_PROFILES_PATH") or os.path.join(
+    os.path.dirname(__file__), '..', 'config', 'llm_profiles.json'
+)
+PROFILE_FIELDS = ("model", "temperature", "max_tokens", "timeout", "response_format")
+
+# Table active (modifiée en place par apply_profile_set pour rester partagée entre modules)
+STAGE_PROFILES: Dict[str, Dict[str, Any]] = {}
+_profile_state: Dict[str, Any] = {"active": None, "available": {}, "source": None}
+
+
+def _read_profile_config(path: str) -> Dict[str, Any]:
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            logger.error("❌ OPENAI_API_KEY non définie dans les variables d'environnement")
-            raise ValueError("Clé API OpenAI manquante")
-        
-        client = OpenAI(api_key=api_key)
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,
-            max_tokens=2048,
-            timeout=100  
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning(f"⚠️ Fichier de profils LLM introuvable ({path}), profils de base utilisés")
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"❌ Fichier de profils LLM invalide ({path}): {e}")
+    return {}
+
+
+def load_stage_profiles(profile_set: Optional[str] = None, path: str = PROFILES_PATH):
+    """
+    Construit la table étape → profil : profils de base, surchargés par le jeu choisi
+    (argument, LLM_PROFILE_SET ou clé "active" du fichier), puis par LLM_MODEL_<ETAPE>.
+    Retourne (nom du jeu, table des profils, jeux disponibles).
+    """
+    config = _read_profile_config(path)
+    profile_sets = config.get("profile_sets", {})
+    name = profile_set or os.getenv("LLM_PROFILE_SET") or config.get("active")
+
+    if name and name not in profile_sets:
+        logger.warning(f"⚠️ Jeu de profils LLM inconnu: {name} (disponibles: {', '.join(profile_sets) or 'aucun'})")
+        name = None
+
+    profiles = {stage: dict(profile) for stage, profile in BASE_STAGE_PROFILES.items()}
+    for stage, values in (profile_sets.get(name, {}) if name else {}).items():
+        if not isinstance(values, dict):
+            continue
+        profile = profiles.setdefault(stage, dict(profiles["default"]))
+        profile.update({k: v for k, v in values.items() if k in PROFILE_FIELDS})
+
+    for stage, profile in profiles.items():
+        model = os.getenv(f"LLM_MODEL_{stage.upper()}")
+        if model:
+            profile["model"] = model
+
+    available = {
+        set_name: values.get("description", "") if isinstance(values, dict) else ""
+        for set_name, values in profile_sets.items()
+    }
+    return name or "base", profiles, available
+
+
+def apply_profile_set(profile_set: Optional[str] = None, path: str = PROFILES_PATH) -> str:
+    """Active un jeu de profils (au démarrage, ou depuis un benchmark) et retourne son nom"""
+    name, profiles, available = load_stage_profiles(profile_set, path)
+    STAGE_PROFILES.clear()
+    STAGE_PROFILES.update(profiles)
+    _profile_state.update({"active": name, "available": available, "source": os.path.abspath(path)})
+    logger.info("✅ Profils LLM '%s': %s", name, ", ".join(
+        f"{stage}={profile['model']}" for stage, profile in profiles.items()
+    ))
+    return name
+
+
+def describe_profiles() -> Dict[str, Any]:
+    """Jeu actif, jeux disponibles et table étape → modèle/température/max_tokens (pour /api/status)"""
+    return {
+        "active": _profile_state["active"],
+        "available": _profile_state["available"],
+        "source": _profile_state["source"],
+        "stages": {
+            stage: {k: profile.get(k) for k in ("model", "temperature", "max_tokens", "timeout")}
+            for stage, profile in STAGE_PROFILES.items()
+        },
+    }
+
+
+apply_profile_set()
+
+# Pool HTTP keep-alive partagé par tous les appels
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "120"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))
+# Les relances du SDK se cumulent avec le timeout : une seule par défaut, l'échéance de la requête borne le reste
+HTTP_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+_client: Optional["OpenAI"] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> "OpenAI":
+    """Retourne le client OpenAI partagé (créé une seule fois par processus)"""
+    global _client
+    if _client is not None:
+        return _client
+
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                logger.error("❌ OPENAI_API_KEY non définie dans les variables d'environnement")
+                raise ValueError("Clé API OpenAI manquante")
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(STAGE_PROFILES["default"]["timeout"], connect=HTTP_CONNECT_TIMEOUT)
+            )
+            # OPENAI_BASE_URL permet de viser un serveur compatible (ex: benchmarks/fake_openai_server.py)
+            base_url = os.getenv("OPENAI_BASE_URL") or None
+            _client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                             max_retries=HTTP_MAX_RETRIES)
+            logger.info(f"✅ Client LLM partagé initialisé (pool keep-alive{', ' + base_url if base_url else ''})")
+    return _client
+
+
+def reset_client():
+    """Ferme le pool HTTP et force la recréation du client au prochain appel"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            try:
+                _client.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Erreur fermeture client LLM: {e}")
+        _client = None
+
+
+def get_profile(stage: str) -> Dict[str, Any]:
+    """Retourne le profil d'une étape (ou le profil par défaut)"""
+    return dict(STAGE_PROFILES.get(stage, STAGE_PROFILES["default"]))
+
+
+def chat_completion(messages: List[Dict[str, str]], stage: str = "default", **overrides):
+    """
+    Point d'entrée unique pour les appels chat.completions.
+    Les paramètres du profil de l'étape peuvent être surchargés (model, temperature...).
+    """
+    params = _build_params(stage, overrides)
+    start = time.perf_counter()
+
+    # Étapes déterministes : réponse servie depuis le cache disque si possible
+    cache = get_llm_cache()
+    cache_key = None
+    if cache is not None and cache.is_cacheable(stage, params):
+        cache_key = cache.make_key(messages, params)
+    _remember_completion(stage, cache_key)
+    if cache_key is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            _record_usage(f"{stage}:cache", params["model"], None, start)
+            logger.debug(f"⚡ Réponse LLM ({stage}) servie depuis le cache")
+            from openai.types.chat import ChatCompletion
+            return ChatCompletion.model_validate(cached)
+
+    _prepare_call(stage, params)
+    try:
+        response = get_client().chat.completions.create(
+            messages=messages,
+            **params
         )
-        
+    except Exception as e:
+        _record_usage(stage, params["model"], None, start, error=True)
+        _report_outcome(e)
+        if is_outage(e):
+            raise LLMUnavailableError(f"Service IA indisponible: {e}") from e
+        raise
+
+    _record_usage(stage, params["model"], getattr(response, "usage", None), start)
+    _report_outcome()
+
+    if cache_key is not None and _is_complete(response):
+        cache.put(cache_key, stage, params["model"], response.model_dump(mode="json"))
+    return response
+
+
+def _remember_completion(stage: str, cache_key: Optional[str]):
+    keys = {k: v for k, v in _completion_keys.get().items() if k != stage}
+    if cache_key is not None:
+        keys[stage] = cache_key
+    _completion_keys.set(keys)
+
+
+def discard_cached_completion(stage: str) -> bool:
+    """
+    Retire du cache la dernière réponse de l'étape pour la requête en cours
+    (ex: SQL généré rejeté par la validation ou en échec à l'exécution)
+    """
+    keys = _completion_keys.get()
+    cache = get_llm_cache()
+    if stage not in keys or cache is None:
+        return False
+    _completion_keys.set({k: v for k, v in keys.items() if k != stage})
+    if cache.invalidate(keys[stage]):
+        logger.info(f"🧹 Réponse LLM ({stage}) retirée du cache")
+        return True
+    return False
+
+
+def _is_complete(response) -> bool:
+    """Seules les réponses non vides et non tronquées sont mises en cache"""
+    choice = response.choices[0] if response.choices else None
+    return bool(choice and choice.message.content and choice.finish_reason == "stop")
+
+
+def stream_chat_completion(messages: List[Dict[str, str]], stage: str = "default", **overrides) -> Iterator[str]:
+    """Variante streaming de chat_completion : produit les fragments de texte au fil de l'eau"""
+    params = _build_params(stage, overrides)
+    start = time.perf_counter()
+    _prepare_call(stage, params)
+    usage, failed, reported = None, True, False
+    try:
+        stream = get_client().chat.completions.create(
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        failed = False
+        reported = True
+        _report_outcome()
+    except Exception as e:
+        reported = True
+        _report_outcome(e)
+        if is_outage(e):
+            raise LLMUnavailableError(f"Service IA indisponible: {e}") from e
+        raise
+    finally:
+        # GeneratorExit (client SSE déconnecté) n'est pas une Exception : ni succès ni panne,
+        # mais l'appel d'essai du disjoncteur semi-ouvert doit être libéré
+        if not reported:
+            get_breaker().release_probe()
+        _record_usage(stage, params["model"], usage, start, error=failed)
+
+
+def _prepare_call(stage: str, params: Dict[str, Any]):
+    """Borne le timeout par l'échéance de la requête puis consulte le disjoncteur"""
+    params["timeout"] = stage_timeout(stage, params["timeout"])
+    if not get_breaker().allow():
+        raise LLMUnavailableError("Service IA temporairement indisponible (circuit ouvert)")
+
+
+def _report_outcome(error: Optional[Exception] = None):
+    """Informe le disjoncteur : seules les pannes du fournisseur comptent comme échecs"""
+    if error is not None and is_outage(error):
+        get_breaker().record_failure(error)
+    else:
+        get_breaker().record_success()
+
+
+def _record_usage(stage: str, model: str, usage, start: float, error: bool = False):
+    """Transmet tokens et latence d'un appel au suivi de consommation"""
+    try:
+        usage_tracker.record(
+            stage=stage,
+            model=model,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            error=error
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Suivi de consommation LLM impossible: {e}")
+
+
+def _build_params(stage: str, overrides: Dict[str, Any]) -> Dict[str, Any]:
+    params = get_profile(stage)
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    return params
+
+
+def ask_llm(prompt: str, stage: str = "sql") -> str:
+    try:
+        response = chat_completion([{"role": "user", "content": prompt}], stage=stage)
+
         result = response.choices[0].message.content
         if not result or result.strip() == "":
             raise ValueError("Réponse vide de l'IA")
-            
+
         return result
-        
+
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         error_msg = f"❌ Erreur LLM: {str(e)}"
         logger.error(error_msg)
         print(error_msg)
-        
-        raise ConnectionError(f"Service IA indisponible: {str(e)}")
\ No newline at end of file
+
+        # Seule une panne du fournisseur rend le service indisponible ; le reste remonte tel quel
+        if is_outage(e):
+            raise LLMUnavailableError(f"Service IA indisponible: {str(e)}") from e
+        raise
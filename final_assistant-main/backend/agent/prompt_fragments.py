@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Tuple, Iterable, Any
+
+from agent.result_summarizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+MAX_COMBINATIONS = int(os.getenv("PROMPT_FRAGMENTS_MAX_COMBINATIONS", "256"))
+NO_TABLE_TEXT = "Aucune table trouvée"
+
+
+@lru_cache(maxsize=MAX_COMBINATIONS)
+def fragment_tokens(text: str) -> int:
+    """Tokens d'un fragment pré-rendu (mémorisé : les mêmes fragments reviennent d'une question à l'autre)"""
+    return count_tokens(text)
+
+
+class PromptFragments:
+    """
+    Fragments de prompt pré-rendus (table_info et descriptions des domaines).
+    Le texte de chaque table est rendu une fois par version du catalogue du schéma ;
+    chaque combinaison triée de domaines est mémorisée (LRU), si bien que l'assemblage
+    d'un prompt se réduit à quelques jointures de chaînes.
+    """
+
+    def __init__(self, catalog, domain_descriptions: Dict[str, str],
+                 domain_to_tables: Dict[str, List[str]], max_combinations: int = MAX_COMBINATIONS):
+        self.catalog = catalog
+        self.domain_descriptions = domain_descriptions
+        self.domain_to_tables = domain_to_tables
+        self.max_combinations = max_combinations
+        self._lock = threading.Lock()
+        self._version = None
+        self._tables_text: Dict[str, str] = {}
+        self._combinations: "OrderedDict[Tuple[str, ...], Tuple[str, str]]" = OrderedDict()
+        self._signatures: Dict[Tuple[str, ...], str] = {}
+        self.stats = {"hits": 0, "misses": 0, "rebuilds": 0}
+
+    def _sync(self):
+        """Re-rend les tables si le catalogue a été rechargé (schéma modifié)"""
+        self.catalog.ensure_fresh()
+        if self.catalog.version == self._version:
+            return
+        with self._lock:
+            if self.catalog.version == self._version:
+                return
+            start = time.perf_counter()
+            self._tables_text = {key: table.render() for key, table in self.catalog.tables.items()}
+            self._combinations.clear()
+            self._signatures = {}
+            self._version = self.catalog.version
+            self.stats["rebuilds"] += 1
+            logger.info(
+                f"🧩 Fragments de prompt rendus: {len(self._tables_text)} tables "
+                f"({(time.perf_counter() - start) * 1000:.0f} ms, schéma v{self._version})"
+            )
+
+    def domain_key(self, domains: Iterable[str]) -> Tuple[str, ...]:
+        """Combinaison triée des domaines connus (vide = schéma complet)"""
+        return tuple(sorted({
+            domain for domain in domains or []
+            if domain in self.domain_descriptions or domain in self.domain_to_tables
+        }))
+
+    def for_domains(self, domains: Iterable[str]) -> Tuple[str, str]:
+        """Retourne (table_info, descriptions des domaines) pour une combinaison de domaines"""
+        self._sync()
+        key = self.domain_key(domains)
+        with self._lock:
+            fragment = self._combinations.get(key)
+            if fragment is not None:
+                self._combinations.move_to_end(key)
+                self.stats["hits"] += 1
+                return fragment
+
+        fragment = self._render(key)
+        with self._lock:
+            self.stats["misses"] += 1
+            self._combinations[key] = fragment
+            while len(self._combinations) > self.max_combinations:
+                self._combinations.popitem(last=False)
+        return fragment
+
+    def _render(self, key: Tuple[str, ...]) -> Tuple[str, str]:
+        if key:
+            tables = sorted({t.lower() for domain in key for t in self.domain_to_tables.get(domain, [])})
+            descriptions = "\n".join(
+                f"{domain}: {self.domain_descriptions[domain]}" for domain in key if domain in self.domain_descriptions
+            )
+        else:
+            tables = sorted(self._tables_text)
+            descriptions = "\n".join(self.domain_descriptions.values())
+
+        texts = [self._tables_text[t] for t in tables if t in self._tables_text]
+        return ("\n\n".join(texts) if texts else NO_TABLE_TEXT), descriptions
+
+    def for_tables(self, tables: Iterable[str]) -> str:
+        """table_info d'une liste de tables (ex: tables retenues par le graphe de jointures)"""
+        self._sync()
+        texts = [self._tables_text[t] for t in dict.fromkeys(t.lower() for t in tables) if t in self._tables_text]
+        return "\n\n".join(texts) if texts else NO_TABLE_TEXT
+
+    def signatures(self, domains: Iterable[str] = ()) -> str:
+        """
+        Signatures condensées des tables des domaines donnés (mode appel unique) ;
+        sans domaine, toutes les tables du catalogue des domaines
+        """
+        self._sync()
+        key = self.domain_key(domains)
+        signatures = self._signatures.get(key)
+        if signatures is None:
+            mapping = {domain: self.domain_to_tables.get(domain, []) for domain in key} or self.domain_to_tables
+            tables = sorted({t.lower() for tables in mapping.values() for t in tables})
+            signatures = self.catalog.render_signatures(tables or None)
+            with self._lock:
+                if len(self._signatures) >= self.max_combinations:
+                    self._signatures.clear()
+                self._signatures[key] = signatures
+        return signatures
+
+    def warm(self):
+        """Pré-rend chaque domaine seul et le schéma complet (au démarrage)"""
+        start = time.perf_counter()
+        for domain in self.domain_to_tables:
+            self.for_domains([domain])
+        self.for_domains([])
+        logger.info(f"🧩 {len(self._combinations)} fragments de prompt pré-rendus "
+                    f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "schema_version": self._version,
+            "tables": len(self._tables_text),
+            "combinations": len(self._combinations),
+            **self.stats,
+        }
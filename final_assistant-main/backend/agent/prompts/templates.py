@@ -1,4 +1,4 @@
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 
 # Template pour les super admins (accès complet)
 ADMIN_PROMPT_TEMPLATE = PromptTemplate(
@@ -310,3 +310,22 @@ Requête SQL :
 """
 )
 
+# Consigne système du mode appel unique : le message utilisateur est le template du rôle
+# (règles SQL + signatures condensées + catalogue complet des domaines)
+SINGLE_CALL_SYSTEM_PROMPT = PromptTemplate(
+    input_variables=["domain_names"],
+    template="""
+Vous êtes un assistant SQL expert pour une base de données scolaire.
+Le message suivant contient les règles de génération SQL, les signatures condensées des tables
+au format `table(colonne1, colonne2, ...)` (* = clé primaire) et le catalogue complet des domaines.
+
+En UN SEUL passage :
+1. Choisissez les domaines pertinents pour la question parmi : {domain_names}
+2. Générez la requête SQL MySQL en respectant toutes les règles du message (SELECT uniquement).
+3. Estimez votre confiance (0 à 1) que la requête répond exactement à la question
+   avec les tables et colonnes fournies.
+
+Au lieu de la requête seule, répondez UNIQUEMENT par un objet JSON de la forme :
+{{"domains": ["DOMAINE_1"], "sql": "SELECT ...", "confidence": 0.9}}
+"""
+)
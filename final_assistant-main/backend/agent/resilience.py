@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Délai global d'une requête /ask, réparti entre les étapes LLM
+REQUEST_DEADLINE_SECONDS = float(os.getenv("LLM_REQUEST_DEADLINE", "45"))
+MIN_STAGE_SECONDS = float(os.getenv("LLM_MIN_STAGE_SECONDS", "1.5"))
+
+# Part maximale du délai total accordée à chaque étape (le reste non consommé profite aux suivantes)
+STAGE_DEADLINE_SHARES = {
+    "domain": 0.2,
+    "sql": 0.6,
+    "single_call": 0.7,
+    "repair": 0.3,
+    "format": 0.35,
+    "default": 0.5,
+}
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RECOVERY_SECONDS = float(os.getenv("LLM_BREAKER_RECOVERY", "30"))
+
+
+class LLMUnavailableError(ConnectionError):
+    """Le LLM ne peut pas être appelé : circuit ouvert, délai dépassé ou panne du fournisseur"""
+
+
+class Deadline:
+    """Échéance absolue d'une requête ; chaque étape reçoit un timeout borné par le temps restant"""
+
+    def __init__(self, total_seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.total_seconds = total_seconds
+        self.expires_at = time.monotonic() + total_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def stage_timeout(self, stage: str, profile_timeout: float) -> float:
+        """Timeout de l'étape : min(profil, part de l'étape, temps restant)"""
+        share = STAGE_DEADLINE_SHARES.get(stage, STAGE_DEADLINE_SHARES["default"])
+        timeout = min(profile_timeout, share * self.total_seconds, self.remaining())
+        if timeout < MIN_STAGE_SECONDS:
+            raise LLMUnavailableError(
+                f"Délai de la requête dépassé avant l'étape {stage} ({self.remaining():.1f}s restantes)"
+            )
+        return timeout
+
+
+_deadline: ContextVar[Optional[Deadline]] = ContextVar("llm_request_deadline", default=None)
+
+
+@contextmanager
+def deadline_context(total_seconds: float = REQUEST_DEADLINE_SECONDS) -> Iterator[Deadline]:
+    """Ouvre l'échéance d'une requête (les appels LLM hors contexte gardent le timeout du profil)"""
+    deadline = Deadline(total_seconds)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            _deadline.set(None)
+
+
+def stage_timeout(stage: str, profile_timeout: float) -> float:
+    deadline = _deadline.get()
+    return deadline.stage_timeout(stage, profile_timeout) if deadline else profile_timeout
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur des appels LLM : s'ouvre après N échecs consécutifs, refuse alors
+    immédiatement les appels, puis laisse passer un appel d'essai après le délai de récupération.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 recovery_seconds: float = BREAKER_RECOVERY_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._trips = 0
+        self._rejected = 0
+        self._last_error = None
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """True si un appel peut partir (en semi-ouvert, un seul appel d'essai à la fois)"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def is_open(self) -> bool:
+        """True si le LLM est considéré indisponible (sans consommer l'appel d'essai)"""
+        with self._lock:
+            return self._current_state() == self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("✅ Circuit LLM refermé")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Appel interrompu sans verdict (client déconnecté) : l'appel d'essai est libéré, l'état inchangé"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error)[:200]
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._trips += 1
+                    logger.error(f"🔌 Circuit LLM ouvert après {self._failures} échec(s): {self._last_error}")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state()
+            retry_in = max(0.0, self.recovery_seconds - (time.monotonic() - self._opened_at)) if state == self.OPEN else 0.0
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "recovery_seconds": self.recovery_seconds,
+                "retry_in_seconds": round(retry_in, 1),
+                "trips": self._trips,
+                "rejected_calls": self._rejected,
+                "last_error": self._last_error,
+            }
+
+
+llm_breaker = CircuitBreaker()
+
+
+def get_breaker() -> CircuitBreaker:
+    return llm_breaker
+
+
+def is_outage(error: Exception) -> bool:
+    """Erreurs qui signalent une indisponibilité du fournisseur (et non une requête invalide)"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import openai
+        return isinstance(error, (openai.APITimeoutError, openai.APIConnectionError,
+                                  openai.InternalServerError, openai.RateLimitError))
+    except ImportError:
+        return False
@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from agent.sql_repair import table_aliases
+from utils.sql_utils import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500"))
+# Borne mémoire : lignes conservées toutes entrées confondues
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "50000"))
+RESULT_CACHE_CONFIG = os.getenv("RESULT_CACHE_CONFIG") or os.path.join(
+    os.path.dirname(__file__), '..', 'config', 'result_cache.json'
+)
+
+READ_QUERY = re.compile(r'^\s*(?:\(\s*)*(?:select|with)\b', re.IGNORECASE)
+# Résultat différent à chaque exécution : jamais mis en cache
+NON_DETERMINISTIC = re.compile(r'\b(?:rand|uuid|uuid_short|connection_id|last_insert_id|found_rows)\s*\(',
+                               re.IGNORECASE)
+# Dépend de la date du jour (menu de la cantine, emploi du temps d'aujourd'hui) : TTL borné à minuit.
+# CURRENT_DATE, CURRENT_TIMESTAMP... s'écrivent aussi sans parenthèses.
+DATE_DEPENDENT = re.compile(r'\b(?:(?:curdate|utc_date)\s*\(|current_date\b)', re.IGNORECASE)
+# Dépend de l'heure : TTL borné par clock_ttl en plus de minuit
+CLOCK_DEPENDENT = re.compile(
+    r'\b(?:(?:now|sysdate|curtime|unix_timestamp|utc_time|utc_timestamp)\s*\('
+    r'|(?:current_time|current_timestamp|localtime|localtimestamp)\b)',
+    re.IGNORECASE
+)
+
+
+def seconds_until_midnight(now: Optional[float] = None) -> float:
+    """Secondes restantes avant minuit (heure locale du serveur, comme CURDATE() de MySQL)"""
+    current = datetime.fromtimestamp(now if now is not None else time.time())
+    midnight = datetime.combine(current.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - current).total_seconds()
+
+
+def _read_config(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning(f"⚠️ Configuration du cache de résultats introuvable ({path}), TTL par défaut")
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"❌ Configuration du cache de résultats invalide ({path}): {e}")
+    return {}
+
+
+def query_tables(sql: str) -> List[str]:
+    """Tables lues par une requête (FROM / JOIN), en minuscules"""
+    return sorted({table.lower() for table in table_aliases(sql).values()})
+
+
+class ResultCache:
+    """
+    Cache mémoire des résultats SQL, clé = empreinte normalisée du SQL + paramètres liés.
+    Le TTL d'une entrée est le plus court des TTL de ses tables, configurés par domaine
+    (tables de référence longues, notes/absences courtes) ; les entrées sont invalidées par
+    table (hooks d'écriture), en bloc au rechargement du schéma, et bornées en lignes (LRU).
+    """
+
+    def __init__(self, domain_to_tables: Optional[Dict[str, List[str]]] = None, catalog=None,
+                 config_path: str = RESULT_CACHE_CONFIG, enabled: bool = RESULT_CACHE_ENABLED,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_rows: int = RESULT_CACHE_MAX_ROWS):
+        self.enabled = enabled
+        self.catalog = catalog
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_table: Dict[str, set] = {}
+        self._rows = 0
+        self._version = catalog.version if catalog is not None else None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "skipped": 0, "expired": 0,
+                      "evicted": 0, "invalidated": 0}
+
+        config = _read_config(config_path)
+        self.default_ttl = float(config.get("default_ttl", 60))
+        self.clock_ttl = float(config.get("clock_ttl", 300))
+        self.table_ttls = self._table_ttls(config, domain_to_tables or {})
+
+    @staticmethod
+    def _table_ttls(config: Dict[str, Any], domain_to_tables: Dict[str, List[str]]) -> Dict[str, float]:
+        """TTL par table : le plus court des domaines qui la contiennent, puis surcharges par table"""
+        ttls: Dict[str, float] = {}
+        for domain, ttl in config.get("domains", {}).items():
+            for table in domain_to_tables.get(domain, []):
+                key = table.lower()
+                ttls[key] = min(ttls.get(key, float(ttl)), float(ttl))
+        ttls.update({table.lower(): float(ttl) for table, ttl in config.get("tables", {}).items()})
+        return ttls
+
+    def ttl_for(self, tables: Iterable[str]) -> float:
+        return min((self.table_ttls.get(table, self.default_ttl) for table in tables), default=self.default_ttl)
+
+    def ttl_for_query(self, sql: str, tables: Iterable[str]) -> float:
+        """TTL des tables, borné à minuit si la requête dépend de la date (et à clock_ttl de l'heure)"""
+        ttl = self.ttl_for(tables)
+        if CLOCK_DEPENDENT.search(sql):
+            ttl = min(ttl, self.clock_ttl, seconds_until_midnight())
+        elif DATE_DEPENDENT.search(sql):
+            ttl = min(ttl, seconds_until_midnight())
+        return ttl
+
+    @staticmethod
+    def key(sql: str, params: Optional[Sequence[Any]] = None) -> str:
+        bound = json.dumps(list(params), default=str) if params else ""
+        return hashlib.sha1(f"{sql_fingerprint(sql)}|{bound}".encode('utf-8')).hexdigest()
+
+    # ---- Lecture / écriture ----
+
+    def _check_schema(self):
+        """Schéma rechargé (nouvelle version du catalogue) : tout le cache est invalidé"""
+        if self.catalog is not None and self.catalog.version != self._version:
+            self._version = self.catalog.version
+            self.invalidate_all()
+
+    def get(self, sql: str, params: Optional[Sequence[Any]] = None) -> Optional[Dict[str, Any]]:
+        if not self.enabled or not sql:
+            return None
+        self._check_schema()
+        key = self.key(sql, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= time.time():
+                self._drop(key, "expired")
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry["value"]
+
+    def put(self, sql: str, params: Optional[Sequence[Any]], rows: List[Dict[str, Any]], **meta) -> bool:
+        """
+        Mémorise un résultat réussi ; False s'il n'est pas cacheable (aucune table lue, TTL nul,
+        non déterministe, trop gros). Une requête qui dépend de la date du jour expire au plus
+        tard à minuit. Une requête d'écriture n'est pas mémorisée mais invalide les tables modifiées.
+        """
+        if not self.enabled or not sql:
+            return False
+        if not READ_QUERY.match(sql):
+            self.invalidate_sql(sql)
+            return False
+        tables = query_tables(sql)
+        ttl = self.ttl_for_query(sql, tables)
+        # Sans table lue, aucune invalidation ne pourrait atteindre l'entrée (SELECT 1, SELECT NOW()...)
+        if not tables or ttl <= 0 or NON_DETERMINISTIC.search(sql) or len(rows) > self.max_rows:
+            with self._lock:
+                self.stats["skipped"] += 1
+            return False
+
+        key = self.key(sql, params)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key, None)
+            while self._entries and (len(self._entries) >= self.max_entries
+                                     or self._rows + len(rows) > self.max_rows):
+                self._drop(next(iter(self._entries)), "evicted")
+            self._entries[key] = {
+                "value": {"rows": rows, **meta},
+                "tables": tables,
+                "expires_at": time.time() + ttl,
+            }
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            self._rows += len(rows)
+            self.stats["stores"] += 1
+        return True
+
+    def _drop(self, key: str, reason: Optional[str]):
+        entry = self._entries.pop(key)
+        self._rows -= len(entry["value"]["rows"])
+        for table in entry["tables"]:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+        if reason:
+            self.stats[reason] += 1
+
+    # ---- Invalidation ----
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """Hook d'écriture : supprime les résultats qui lisent l'une de ces tables"""
+        with self._lock:
+            keys = {key for table in tables for key in self._by_table.get(table.lower(), ())}
+            for key in keys:
+                self._drop(key, "invalidated")
+        if keys:
+            logger.info(f"🧹 {len(keys)} résultat(s) SQL invalidé(s) ({', '.join(tables)})")
+        return len(keys)
+
+    def invalidate_sql(self, sql: str) -> int:
+        """Invalide les tables touchées par une requête d'écriture (INSERT/UPDATE/DELETE ... table)"""
+        written = re.findall(r'\b(?:insert\s+(?:ignore\s+)?into|update|delete\s+from|replace\s+into)\s+`?(\w+)',
+                             sql or "", re.IGNORECASE)
+        return self.invalidate_tables(written) if written else 0
+
+    def invalidate_all(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._by_table.clear()
+            self._rows = 0
+            self.stats["invalidated"] += count
+        if count:
+            logger.info(f"🧹 Cache des résultats SQL vidé ({count} entrée(s))")
+        return count
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "max_entries": self.max_entries,
+                "max_rows": self.max_rows,
+                "default_ttl_s": self.default_ttl,
+                "clock_ttl_s": self.clock_ttl,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+                **self.stats,
+            }
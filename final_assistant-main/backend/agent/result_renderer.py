@@ -0,0 +1,204 @@
+import os
+import re
+import logging
+import unicodedata
+from datetime import timedelta
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Questions qui demandent une analyse (et donc le résumé LLM) plutôt qu'une simple restitution
+ANALYSIS_KEYWORDS = [
+    "analyse", "analyser", "compare", "comparer", "comparaison", "evolution", "tendance",
+    "pourquoi", "explique", "expliquer", "resume", "resumer", "synthese", "commente",
+    "commenter", "interprete", "interpreter", "conseil", "recommand", "progresse",
+    "progression", "point fort", "points forts", "point faible", "points faibles", "ameliorer", "bilan"
+]
+
+# Libellés français des colonnes fréquentes du schéma
+COLUMN_LABELS = {
+    "nomfr": "Nom",
+    "prenomfr": "Prénom",
+    "nomar": "Nom (ar)",
+    "prenomar": "Prénom (ar)",
+    "nommatierefr": "Matière",
+    "libematifr": "Matière",
+    "codeclassefr": "Classe",
+    "nomclassefr": "Classe",
+    "nomnivfr": "Niveau",
+    "libellejourfr": "Jour",
+    "nomsallefr": "Salle",
+    "debut": "Début",
+    "fin": "Fin",
+    "anneescolaire": "Année scolaire",
+    "moyemati": "Moyenne",
+    "moyeperiexam": "Moyenne trimestrielle",
+    "totalttc": "Total TTC",
+    "montantrestant": "Montant restant",
+    "libellelocalitefr": "Localité",
+    "nationalitefr": "Nationalité",
+    "tel1": "Téléphone",
+    "tel2": "Téléphone 2",
+    "ds": "DS",
+    "dc1": "DC1",
+    "dc2": "DC2",
+    "tp": "TP",
+    "examenecrit": "Examen écrit",
+    "orale": "Oral",
+}
+
+# Colonnes qui structurent naturellement une réponse (emploi du temps, menu...)
+GROUP_COLUMNS = ["libellejourfr", "jour", "date"]
+GROUP_INTENT_KEYWORDS = ["emploi du temps", "menu", "planning", "calendrier", "par jour"]
+
+# Colonnes de mesure ou d'agrégat : seules à recevoir séparateurs de milliers et alignement à droite
+MEASURE_COLUMN = re.compile(
+    r'count|nombre|^nb|_nb|total|somme|sum|montant|moyen|^moy|avg|prix|solde|reste|restant|effectif|'
+    r'^max|^min|_max|_min|quantite|nbr|ttc|^ht$|_ht$|remise|frais|pourcentage|taux',
+    re.IGNORECASE
+)
+# Identifiants, années, téléphones, codes : jamais groupés par milliers
+IDENTIFIER_COLUMN = re.compile(r'^id|id$|_id|annee|year|tel|phone|gsm|fax|code|matricule|cin$|^cin|numero|^num', re.IGNORECASE)
+
+ISO_DATE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::\d{2}(?:\.\d+)?)?)?$')
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFD', (text or '').lower())
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+
+
+def wants_analysis(question: str) -> bool:
+    """True si la question demande une analyse plutôt qu'une restitution des résultats"""
+    normalized = _normalize(question)
+    return any(keyword in normalized for keyword in ANALYSIS_KEYWORDS)
+
+
+class ResultRenderer:
+    """
+    Rendu déterministe des résultats SQL en markdown français (tableau, liste ou fiche),
+    à partir des noms de colonnes, du type des valeurs et de l'intention de la question.
+    """
+
+    def __init__(self, max_rows: Optional[int] = None):
+        self.max_rows = max_rows or int(os.getenv("RESULT_RENDER_MAX_ROWS", "50"))
+
+    def render(self, data: List[Dict], question: str) -> str:
+        if not data:
+            return "✅ Requête exécutée mais aucun résultat trouvé."
+
+        columns = list(data[0].keys())
+        total = len(data)
+
+        if total == 1 and len(columns) > 1:
+            return self._render_record(data[0])
+
+        if len(columns) == 1:
+            body = self._render_list(data, columns[0])
+        else:
+            group_column = self._group_column(columns, question)
+            if group_column:
+                body = self._render_grouped(data, columns, group_column)
+            else:
+                body = self._render_table(data[:self.max_rows], columns)
+
+        header = f"📋 {total} résultat{'s' if total > 1 else ''} :"
+        footer = ""
+        if total > self.max_rows:
+            footer = f"\n\n… et {total - self.max_rows} autre(s) ligne(s) non affichée(s)."
+        return f"{header}\n\n{body}{footer}"
+
+    # ------------------------------------------------------------------
+    # Formes de rendu
+    # ------------------------------------------------------------------
+
+    def _render_record(self, row: Dict[str, Any]) -> str:
+        lines = [f"- **{self.label(column)}** : {self.format_value(value, column)}" for column, value in row.items()]
+        return "📋 Résultat :\n\n" + "\n".join(lines)
+
+    def _render_list(self, data: List[Dict], column: str) -> str:
+        lines = [f"- {self.format_value(row[column], column)}" for row in data[:self.max_rows]]
+        return f"**{self.label(column)}**\n\n" + "\n".join(lines)
+
+    def _render_table(self, rows: List[Dict], columns: List[str]) -> str:
+        numeric = {column: self.is_measure(column) and self._is_numeric_column(rows, column) for column in columns}
+        header = "| " + " | ".join(self.label(column) for column in columns) + " |"
+        separator = "| " + " | ".join("---:" if numeric[column] else "---" for column in columns) + " |"
+        lines = [header, separator]
+        for row in rows:
+            cells = [self._escape(self.format_value(row.get(column), column)) for column in columns]
+            lines.append("| " + " | ".join(cells) + " |")
+        return "\n".join(lines)
+
+    def _render_grouped(self, data: List[Dict], columns: List[str], group_column: str) -> str:
+        other_columns = [column for column in columns if column != group_column]
+        groups: Dict[str, List[Dict]] = {}
+        for row in data[:self.max_rows]:
+            groups.setdefault(self.format_value(row.get(group_column), group_column), []).append(row)
+
+        sections = [f"### {key}\n\n{self._render_table(rows, other_columns)}" for key, rows in groups.items()]
+        return "\n\n".join(sections)
+
+    def _group_column(self, columns: List[str], question: str) -> Optional[str]:
+        """Colonne de regroupement si la question porte sur un planning (emploi du temps, menu...)"""
+        normalized = _normalize(question)
+        if len(columns) < 3 or not any(keyword in normalized for keyword in GROUP_INTENT_KEYWORDS):
+            return None
+        lowered = {column.lower(): column for column in columns}
+        for candidate in GROUP_COLUMNS:
+            if candidate in lowered:
+                return lowered[candidate]
+        return None
+
+    # ------------------------------------------------------------------
+    # Colonnes et valeurs
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def label(column: str) -> str:
+        """Libellé lisible d'une colonne (alias SQL ou nom technique)"""
+        known = COLUMN_LABELS.get(column.lower())
+        if known:
+            return known
+        words = re.sub(r'(?<=[a-zà-ÿ])(?=[A-Z])', ' ', column).replace('_', ' ').split()
+        return " ".join(words).capitalize() if words else column
+
+    @staticmethod
+    def is_measure(column: Optional[str]) -> bool:
+        """Colonne de mesure ou d'agrégat (nombre, total, montant, moyenne...), hors identifiants"""
+        return bool(column) and bool(MEASURE_COLUMN.search(column)) and not IDENTIFIER_COLUMN.search(column)
+
+    @classmethod
+    def format_value(cls, value: Any, column: Optional[str] = None) -> str:
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return "—"
+        if isinstance(value, bool):
+            return "Oui" if value else "Non"
+        if isinstance(value, (int, float)):
+            if isinstance(value, float) and not value.is_integer():
+                grouping = "," if cls.is_measure(column) else ""
+                return f"{value:{grouping}.2f}".replace(",", " ").replace(".", ",")
+            number = int(value)
+            # Années (2024) et identifiants restent tels quels ; séparateurs pour les mesures seulement
+            if cls.is_measure(column) and not 1900 <= number <= 2100:
+                return f"{number:,}".replace(",", " ")
+            return str(number)
+        if isinstance(value, timedelta):
+            minutes = int(value.total_seconds()) // 60
+            return f"{minutes // 60:02d}:{minutes % 60:02d}"
+        text = str(value).strip()
+        match = ISO_DATE.match(text)
+        if match:
+            year, month, day, hour, minute = match.groups()
+            date_text = f"{day}/{month}/{year}"
+            return f"{date_text} {hour}:{minute}" if hour and (hour, minute) != ("00", "00") else date_text
+        return text
+
+    @staticmethod
+    def _is_numeric_column(rows: List[Dict], column: str) -> bool:
+        values = [row.get(column) for row in rows if row.get(column) is not None]
+        return bool(values) and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+
+    @staticmethod
+    def _escape(text: str) -> str:
+        return text.replace("|", "\\|").replace("\n", " ")
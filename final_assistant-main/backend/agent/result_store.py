@@ -0,0 +1,148 @@
+import os
+import time
+import socket
+import hashlib
+import math
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", "600"))
+# Borne mémoire : lignes conservées toutes requêtes confondues (les plus anciennes sont évincées)
+RESULT_STORE_MAX_ROWS = int(os.getenv("RESULT_STORE_MAX_ROWS", "20000"))
+# Jetons expirés ou évincés mémorisés pour distinguer « expiré » de « inconnu »
+FORGOTTEN_TOKENS = 1000
+
+_HOST = hashlib.sha1(socket.gethostname().encode('utf-8')).hexdigest()[:6]
+
+
+def worker_id() -> str:
+    """Identifiant du processus (machine + pid) : calculé à l'appel, valable après un fork de gunicorn"""
+    return f"{_HOST}{os.getpid():x}"
+
+# Pagination du dernier résultat exécuté dans la requête HTTP en cours (lue par /api/ask)
+_current_page: ContextVar[Optional[Dict[str, Any]]] = ContextVar("sql_result_page", default=None)
+
+
+def set_current_page(page: Optional[Dict[str, Any]]):
+    _current_page.set(page)
+
+
+def pop_current_page() -> Optional[Dict[str, Any]]:
+    """Pagination du dernier résultat (et remise à zéro : les threads des workers sont réutilisés)"""
+    page = _current_page.get()
+    _current_page.set(None)
+    return page
+
+
+class ResultStore:
+    """
+    Conservation de courte durée des lignes d'un résultat SQL au-delà de la première page :
+    le client récupère les pages suivantes par jeton, sans relancer le LLM ni la requête.
+    Les entrées expirent après `ttl` secondes et le total des lignes conservées est borné.
+    Le stockage est propre au processus : avec plusieurs workers, les pages suivantes doivent
+    revenir au worker qui a exécuté la requête (sessions persistantes) ; le jeton porte
+    l'identifiant du worker pour que l'erreur soit explicite ailleurs.
+    """
+
+    def __init__(self, ttl: float = RESULT_STORE_TTL, max_rows: int = RESULT_STORE_MAX_ROWS):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._rows = 0
+        self._forgotten: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"stored": 0, "pages_served": 0, "expired": 0, "evicted": 0, "misses": 0,
+                      "other_worker": 0}
+
+    def _drop(self, token: str, reason: str):
+        entry = self._entries.pop(token)
+        self._rows -= len(entry["rows"])
+        self.stats[reason] += 1
+        self._forgotten[token] = reason
+        while len(self._forgotten) > FORGOTTEN_TOKENS:
+            self._forgotten.popitem(last=False)
+
+    def _purge(self, now: float):
+        for token in [t for t, entry in self._entries.items() if entry["expires_at"] <= now]:
+            self._drop(token, "expired")
+
+    def put(self, rows: List[Dict[str, Any]], page_size: int, total_rows: Optional[int] = None,
+            truncated: bool = False, owner: Optional[int] = None) -> Optional[str]:
+        """Conserve les lignes et retourne le jeton (None si elles dépassent à elles seules la borne)"""
+        if len(rows) > self.max_rows:
+            return None
+        token = f"{worker_id()}.{secrets.token_urlsafe(16)}"
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            while self._entries and self._rows + len(rows) > self.max_rows:
+                self._drop(next(iter(self._entries)), "evicted")
+            self._entries[token] = {
+                "rows": rows, "page_size": page_size, "total_rows": total_rows,
+                "truncated": truncated, "owner": owner, "expires_at": now + self.ttl,
+            }
+            self._rows += len(rows)
+            self.stats["stored"] += 1
+        return token
+
+    def page(self, token: str, page: int, owner: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Page demandée (à partir de 1) ; None si le jeton est inconnu, expiré ou d'un autre utilisateur"""
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(token)
+            if entry is None or (entry["owner"] is not None and entry["owner"] != owner):
+                self.stats["other_worker" if self.miss_reason(token) == "other_worker" else "misses"] += 1
+                return None
+            self.stats["pages_served"] += 1
+
+        rows, page_size = entry["rows"], entry["page_size"]
+        pages = max(1, math.ceil(len(rows) / page_size))
+        page = min(max(1, page), pages)
+        start = (page - 1) * page_size
+        return {
+            "data": rows[start:start + page_size],
+            "page": page,
+            "pages": pages,
+            "page_size": page_size,
+            "rows_available": len(rows),
+            "total_rows": entry["total_rows"],
+            "truncated": entry["truncated"],
+            "has_more": page < pages,
+            "expires_in": round(entry["expires_at"] - now),
+        }
+
+    def miss_reason(self, token: str) -> str:
+        """
+        Cause d'un jeton introuvable : other_worker (émis par un autre processus),
+        expired (expiré ou évincé sur ce worker) ou unknown
+        """
+        issuer = token.split('.', 1)[0] if '.' in token else None
+        if issuer is not None and issuer != worker_id():
+            return "other_worker"
+        return "expired" if token in self._forgotten else "unknown"
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge(time.time())
+            return {
+                "worker": worker_id(),
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "max_rows": self.max_rows,
+                "ttl_s": self.ttl,
+                **self.stats,
+            }
+
+
+result_store = ResultStore()
+
+
+def get_result_store() -> ResultStore:
+    return result_store
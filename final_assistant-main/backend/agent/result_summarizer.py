@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("LLM_FORMAT_TOKEN_BUDGET", "1500"))
+DEFAULT_TOP_K = int(os.getenv("LLM_FORMAT_TOP_K", "5"))
+
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+ID_COLUMN = re.compile(r'^(id|id_\w+|\w+_id|[Ii]d[A-Z]\w*|\w+Id)$')
+
+_encoders: Dict[str, Any] = {}
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Nombre de tokens via tiktoken (import paresseux) ; estimation len/4 s'il est indisponible"""
+    encoder = _encoders.get(model)
+    if encoder is None and model not in _encoders:
+        try:
+            import tiktoken
+            try:
+                encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"⚠️ tiktoken indisponible, estimation des tokens: {e}")
+            encoder = None
+        _encoders[model] = encoder
+
+    if encoder is None:
+        return max(1, len(text) // 4)
+    return len(encoder.encode(text))
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class ResultSummarizer:
+    """
+    Réduit les résultats SQL envoyés au LLM de formatage à un budget de tokens :
+    colonnes constantes factorisées, colonnes vides ou techniques (ID) retirées,
+    agrégats par colonne (count, min/max/moyenne, top-k) et échantillon de lignes.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, top_k: int = DEFAULT_TOP_K,
+                 model: str = "gpt-4o"):
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.model = model
+
+    def summarize(self, data: List[Dict], question: str = "", total_rows: Optional[int] = None,
+                  truncated: bool = False) -> Dict[str, Any]:
+        """
+        Retourne la charge utile à sérialiser dans le prompt de formatage.
+        `data` : toutes les lignes lues (pas seulement la page affichée) ; si le résultat est tronqué,
+        `total_rows` est le total réel (None s'il est inconnu) et les agrégats sont signalés partiels.
+        """
+        counts: Dict[str, Any] = {"total_lignes": len(data)}
+        if truncated:
+            counts = {"total_lignes": total_rows, "lignes_analysees": len(data)}
+        raw_payload = {**counts, "lignes": data[:100]}
+        tokens_before = count_tokens(_dumps(raw_payload), self.model)
+
+        if tokens_before <= self.token_budget:
+            logger.info(f"🧮 Formatage: {tokens_before} tokens (sous le budget {self.token_budget})")
+            return raw_payload
+
+        columns = list(data[0].keys()) if data else []
+        constants, dropped, kept = self._classify_columns(data, columns, question)
+
+        payload: Dict[str, Any] = dict(counts)
+        if constants:
+            payload["valeurs_communes"] = constants
+        if dropped:
+            payload["colonnes_ignorees"] = dropped
+        payload["colonnes"] = {column: self._column_stats(data, column) for column in kept}
+        payload["echantillon"] = self._sample(data, kept, count_tokens(_dumps(payload), self.model))
+
+        tokens_after = count_tokens(_dumps(payload), self.model)
+        saved = 100 * (1 - tokens_after / tokens_before) if tokens_before else 0
+        logger.info(
+            f"🧮 Formatage résumé: {tokens_before} → {tokens_after} tokens (-{saved:.0f}%), "
+            f"{len(payload['echantillon'])}/{len(data)} lignes en échantillon"
+        )
+        return payload
+
+    def _classify_columns(self, data: List[Dict], columns: List[str],
+                          question: str) -> Tuple[Dict[str, Any], List[str], List[str]]:
+        """Sépare les colonnes constantes, ignorées (vides, ID) et conservées"""
+        question_lower = question.lower()
+        constants, dropped, kept = {}, [], []
+
+        for column in columns:
+            values = [row.get(column) for row in data]
+            non_null = [v for v in values if v is not None and v != ""]
+            if not non_null:
+                dropped.append(column)
+                continue
+            if ID_COLUMN.match(column) and column.lower() not in question_lower and len(columns) > 1:
+                dropped.append(column)
+                continue
+            distinct = {_dumps(v) for v in values}
+            if len(distinct) == 1 and len(data) > 1:
+                constants[column] = non_null[0]
+                continue
+            kept.append(column)
+
+        return constants, dropped, kept
+
+    def _column_stats(self, data: List[Dict], column: str) -> Dict[str, Any]:
+        values = [row.get(column) for row in data if row.get(column) not in (None, "")]
+        stats: Dict[str, Any] = {"count": len(values)}
+
+        numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        if numbers and len(numbers) == len(values):
+            stats.update({
+                "min": round(min(numbers), 2),
+                "max": round(max(numbers), 2),
+                "moyenne": round(sum(numbers) / len(numbers), 2)
+            })
+            return stats
+
+        texts = [str(v) for v in values]
+        if texts and all(ISO_DATE.match(t) for t in texts):
+            stats.update({"min": min(texts), "max": max(texts)})
+            return stats
+
+        counts = Counter(t if len(t) <= 80 else t[:77] + "..." for t in texts)
+        stats["distincts"] = len(counts)
+        stats["top"] = dict(counts.most_common(self.top_k))
+        return stats
+
+    def _sample(self, data: List[Dict], columns: List[str], used_tokens: int) -> List[Dict]:
+        """Premières lignes (colonnes conservées) tant que le budget le permet"""
+        remaining = self.token_budget - used_tokens
+        sample = []
+        for row in data:
+            reduced = {column: row.get(column) for column in columns}
+            cost = count_tokens(_dumps(reduced), self.model) + 1
+            if cost > remaining:
+                break
+            sample.append(reduced)
+            remaining -= cost
+        return sample
+
+    def to_prompt(self, data: List[Dict], question: str = "", total_rows: Optional[int] = None,
+                  truncated: bool = False) -> str:
+        """Charge utile sérialisée pour le message utilisateur du formatage"""
+        return _dumps(self.summarize(data, question, total_rows, truncated))
@@ -0,0 +1,189 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from utils.sql_utils import STRING_LITERAL
+
+# Paramètre d'un template : {colonne} (ou {{colonne}}, ancien format des caches)
+PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}|\{(\w+)\}')
+LIST_CONTEXT = re.compile(r'\bIN\s*\(\s*$', re.IGNORECASE)
+# `colonne = {param}` : réécrit en IN (...) quand le paramètre porte plusieurs IDs
+EQUALITY_CONTEXT = re.compile(r'(?<![<>!:])=\s*$')
+# Position d'identifiant (table, colonne, alias) : la valeur ne peut pas être liée par le driver
+IDENTIFIER_CONTEXT = re.compile(r'(?:\.|\b(?:from|join|by|select|as|into|update))\s*$', re.IGNORECASE)
+IDENTIFIER = re.compile(r'^\w+$')
+INTEGER = re.compile(r'^[+-]?\d{1,18}$')
+BOUND_MARKER = re.compile(r'%%|%s')
+
+
+@dataclass(frozen=True)
+class Slot:
+    """
+    Emplacement d'un paramètre dans un template compilé :
+    value (valeur nue, typée), list (IN ({ids}), une valeur liée par élément),
+    literal (littéral chaîne contenant des paramètres, lié comme chaîne),
+    identifier (nom de colonne/table, substitué textuellement s'il est un identifiant simple).
+    `operator` garde le « = » qui précède une valeur, remplacé par IN (...) pour une liste d'IDs.
+    """
+    kind: str
+    names: Tuple[str, ...]
+    raw: str
+    pattern: str = ""
+    operator: str = ""
+
+
+def _names(text: str) -> Tuple[str, ...]:
+    return tuple(double or single for double, single in PLACEHOLDER.findall(text))
+
+
+def _unquote(literal: str) -> str:
+    """Contenu d'un littéral SQL ('...' ou "..."), échappements retirés"""
+    quote, body = literal[0], literal[1:-1]
+    return re.sub(r"\\(.)", r"\1", body.replace(quote * 2, quote))
+
+
+def typed_value(value: Any) -> Any:
+    """Valeur liée : entier si elle en a la forme, chaîne sinon (guillemets éventuels retirés)"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = str(value).strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    return int(text) if INTEGER.match(text) else text
+
+
+def split_values(value: Any) -> List[Any]:
+    """Éléments d'une liste de valeurs : liste/tuple/ensemble tel quel, chaîne découpée sur les virgules"""
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    if value is None:
+        return []
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
+def multi_values(value: Any) -> Optional[List[Any]]:
+    """Valeurs d'un paramètre multiple (liste, ou IDs séparés par des virgules), None sinon"""
+    if isinstance(value, str):
+        if ',' not in value:
+            return None
+        items = split_values(value)
+        if not all(INTEGER.match(item) for item in items):
+            return None
+    elif isinstance(value, (list, tuple, set)):
+        items = split_values(value)
+    else:
+        return None
+    return [typed_value(item) for item in items] if len(items) != 1 else None
+
+
+def sql_literal(value: Any) -> str:
+    """Littéral SQL d'une valeur liée (affichage et journalisation uniquement)"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def inline_params(sql: str, params: Optional[Sequence[Any]]) -> str:
+    """SQL lisible avec les valeurs liées en littéraux (réponse, historique, empreinte)"""
+    if not params:
+        return sql
+    values = iter(params)
+    return BOUND_MARKER.sub(lambda m: '%' if m.group(0) == '%%' else sql_literal(next(values, None)), sql)
+
+
+class CompiledSql:
+    """
+    Template SQL compilé une fois en texte + emplacements de paramètres. bind() produit la
+    requête paramétrée (%s) et les valeurs typées à passer au driver : le texte de la requête
+    est le même pour toutes les valeurs, ce qui stabilise les clés du cache de résultats.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parts: List[Union[str, Slot]] = []
+        last = 0
+        for literal in STRING_LITERAL.finditer(template):
+            if not PLACEHOLDER.search(literal.group(0)):
+                continue
+            self._compile_code(template[last:literal.start()])
+            text = literal.group(0)
+            self.parts.append(Slot("literal", _names(text), text, _unquote(text)))
+            last = literal.end()
+        self._compile_code(template[last:])
+        self.names = tuple(dict.fromkeys(name for part in self.parts if isinstance(part, Slot)
+                                         for name in part.names))
+
+    def _compile_code(self, code: str):
+        last = 0
+        for match in PLACEHOLDER.finditer(code):
+            before = code[last:match.start()]
+            self.parts.append(before)
+            preceding = "".join(part for part in self.parts if isinstance(part, str))[-40:]
+            if LIST_CONTEXT.search(preceding):
+                kind = "list"
+            elif IDENTIFIER_CONTEXT.search(preceding) or code[match.end():match.end() + 1] == '.':
+                kind = "identifier"
+            else:
+                kind = "value"
+            operator = EQUALITY_CONTEXT.search(before) if kind == "value" else None
+            if operator:
+                self.parts[-1] = before[:operator.start()]
+            self.parts.append(Slot(kind, _names(match.group(0)), match.group(0),
+                                   operator=operator.group(0) if operator else ""))
+            last = match.end()
+        self.parts.append(code[last:])
+
+    def bind(self, variables: Dict[str, Any]) -> Tuple[str, Tuple[Any, ...]]:
+        """
+        (sql paramétré, valeurs) ; un paramètre sans valeur reste tel quel dans le SQL.
+        Une liste d'IDs n'est acceptée que dans IN (...) ou après « = » (réécrit en IN) :
+        ailleurs elle serait liée comme une seule chaîne '12,13' (ValueError).
+        """
+        pieces: List[Tuple[str, bool]] = []
+        params: List[Any] = []
+        for part in self.parts:
+            if isinstance(part, str):
+                pieces.append((part, False))
+            elif any(name not in variables for name in part.names):
+                pieces.append((part.operator + part.raw, False))
+            elif part.kind == "literal":
+                value = PLACEHOLDER.sub(lambda m: str(variables[m.group(1) or m.group(2)]), part.pattern)
+                pieces.append(("%s", True))
+                params.append(value)
+            elif part.kind == "list":
+                values = [typed_value(item) for item in split_values(variables[part.names[0]])]
+                pieces.append((", ".join(["%s"] * len(values)) or "NULL", True))
+                params.extend(values)
+            elif part.kind == "identifier":
+                value = str(variables[part.names[0]]).strip()
+                pieces.append((value if IDENTIFIER.match(value) else part.raw, False))
+            else:
+                values = multi_values(variables[part.names[0]])
+                if values is None:
+                    pieces.append((part.operator + "%s", True))
+                    params.append(typed_value(variables[part.names[0]]))
+                elif part.operator:
+                    spacing = "" if pieces and pieces[-1][0][-1:].isspace() else " "
+                    pieces.append((spacing + "IN (" + ", ".join(["%s"] * len(values)) + ")", True))
+                    params.extend(values)
+                else:
+                    raise ValueError(f"Paramètre {part.raw} à plusieurs valeurs hors d'un IN (...) ou d'un « = »")
+
+        # Avec des paramètres, le driver formate la requête : les % du texte sont doublés
+        sql = "".join(text if marker or not params else text.replace('%', '%%') for text, marker in pieces)
+        return sql, tuple(params)
+
+
+@lru_cache(maxsize=512)
+def compile_sql(template: str) -> CompiledSql:
+    return CompiledSql(template)
+
+
+def bind_template(template: str, variables: Dict[str, Any]) -> Tuple[str, Tuple[Any, ...]]:
+    """Compile (une fois par template) puis lie les valeurs : (sql paramétré, paramètres)"""
+    return compile_sql(template).bind(variables or {})
@@ -0,0 +1,194 @@
+import re
+import difflib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_SUGGESTIONS = 5
+SUGGESTION_CUTOFF = 0.6
+
+ERROR_CODE = re.compile(r'^\(?\s*(\d{4})\s*,')
+UNKNOWN_COLUMN = re.compile(r"Unknown column '([^']+)' in '([^']+)'", re.IGNORECASE)
+UNKNOWN_TABLE = re.compile(r"Table '(?:[^'.]+\.)?([^'.]+)' doesn't exist|Unknown table '([^']+)'", re.IGNORECASE)
+AMBIGUOUS_COLUMN = re.compile(r"Column '([^']+)' in ([\w ]+?) is ambiguous", re.IGNORECASE)
+SYNTAX_NEAR = re.compile(r"near '(.*)' at line (\d+)", re.IGNORECASE | re.S)
+# FROM / JOIN table [AS] alias (les sous-requêtes et mots-clés sont ignorés)
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?', re.IGNORECASE)
+ALIAS_STOPWORDS = {
+    'on', 'where', 'join', 'left', 'right', 'inner', 'outer', 'cross', 'natural', 'group', 'order',
+    'limit', 'having', 'union', 'using', 'and', 'or', 'set', 'straight_join',
+}
+
+
+@dataclass
+class SqlError:
+    """Erreur MySQL analysée"""
+    kind: str
+    message: str
+    code: Optional[int] = None
+    identifier: str = ""
+    qualifier: str = ""
+    clause: str = ""
+    near: str = ""
+    line: Optional[int] = None
+
+
+@dataclass
+class RepairHint:
+    """Contexte ciblé envoyé à l'étape repair"""
+    error: SqlError
+    tables: List[str] = field(default_factory=list)
+    suggestions: List[str] = field(default_factory=list)
+    text: str = ""
+
+
+def parse_mysql_error(error_msg: str) -> SqlError:
+    """Type d'erreur (colonne/table inconnue, colonne ambiguë, syntaxe) et identifiant en cause"""
+    message = str(error_msg or "")
+    code_match = ERROR_CODE.match(message)
+    code = int(code_match.group(1)) if code_match else None
+
+    match = UNKNOWN_COLUMN.search(message)
+    if match:
+        qualifier, _, identifier = match.group(1).rpartition('.')
+        return SqlError("unknown_column", message, code, identifier, qualifier, match.group(2))
+
+    match = UNKNOWN_TABLE.search(message)
+    if match:
+        return SqlError("unknown_table", message, code, match.group(1) or match.group(2))
+
+    match = AMBIGUOUS_COLUMN.search(message)
+    if match:
+        return SqlError("ambiguous_column", message, code, match.group(1), clause=match.group(2))
+
+    match = SYNTAX_NEAR.search(message)
+    if match or code == 1064:
+        return SqlError(
+            "syntax", message, code,
+            near=match.group(1)[:120] if match else "",
+            line=int(match.group(2)) if match else None
+        )
+
+    return SqlError("other", message, code)
+
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """Alias (et noms) des tables de la requête : {alias en minuscules: table}"""
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql or ""):
+        if table.lower() == 'select':
+            continue
+        aliases[table.lower()] = table
+        if alias and alias.lower() not in ALIAS_STOPWORDS:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+class SqlRepairContext:
+    """
+    Construit le contexte de l'étape repair à partir de l'erreur MySQL : seules les tables
+    concernées (signatures du catalogue du schéma) et les noms de colonnes ou de tables les
+    plus proches de l'identifiant fautif sont envoyés au LLM.
+    """
+
+    def __init__(self, catalog, max_suggestions: int = MAX_SUGGESTIONS):
+        self.catalog = catalog
+        self.max_suggestions = max_suggestions
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _query_tables(self, sql: str) -> Tuple[Dict[str, str], List[str]]:
+        """Alias → table connue du catalogue, et tables connues de la requête"""
+        aliases = {
+            alias: self.catalog.get(table).name
+            for alias, table in table_aliases(sql).items() if self.catalog.get(table)
+        }
+        return aliases, list(dict.fromkeys(aliases.values()))
+
+    def _closest(self, name: str, candidates: List[str]) -> List[str]:
+        by_lower = {}
+        for candidate in candidates:
+            by_lower.setdefault(candidate.lower(), candidate)
+        matches = difflib.get_close_matches(name.lower(), list(by_lower), n=self.max_suggestions, cutoff=SUGGESTION_CUTOFF)
+        return [by_lower[match] for match in matches]
+
+    def _tables_with_column(self, column: str) -> List[str]:
+        return [table.name for table in self.catalog.tables.values() if table.column(column)]
+
+    def build(self, sql: str, error_msg: str) -> RepairHint:
+        self.catalog.ensure_fresh()
+        error = parse_mysql_error(error_msg)
+        aliases, query_tables = self._query_tables(sql)
+        hint = RepairHint(error)
+        lines = []
+
+        if error.kind == "unknown_column":
+            target = aliases.get(error.qualifier.lower()) if error.qualifier else None
+            scope = [target] if target else query_tables
+            columns = [(t, c.name) for t in scope for c in self.catalog.get(t).columns]
+            closest = self._closest(error.identifier, [name for _, name in columns])
+            hint.suggestions = [f"{t}.{name}" for t, name in columns if name in closest][:self.max_suggestions]
+            hint.tables = list(scope)
+            label = f"{error.qualifier}.{error.identifier}" if error.qualifier else error.identifier
+            lines.append(f"Colonne inconnue `{label}` (dans '{error.clause}')"
+                         + (f", l'alias `{error.qualifier}` désigne la table {target}." if target else "."))
+            elsewhere = [t for t in self._tables_with_column(error.identifier) if t not in scope]
+            if elsewhere:
+                lines.append(f"La colonne `{error.identifier}` existe dans : {', '.join(elsewhere[:5])} (jointure manquante ?).")
+                hint.tables += elsewhere[:2]
+
+        elif error.kind == "unknown_table":
+            hint.suggestions = self._closest(error.identifier, self.catalog.table_names())
+            hint.tables = hint.suggestions[:2] + [t for t in query_tables if t not in hint.suggestions[:2]]
+            lines.append(f"Table inconnue `{error.identifier}`.")
+
+        elif error.kind == "ambiguous_column":
+            # Préfixe utilisable : l'alias de la table s'il existe, sinon son nom
+            qualifiers = {}
+            for alias, table in aliases.items():
+                if self.catalog.get(table).column(error.identifier) and (alias != table.lower() or table not in qualifiers):
+                    qualifiers[table] = alias
+            hint.suggestions = [f"{alias}.{error.identifier} ({table})" for table, alias in qualifiers.items()]
+            hint.tables = query_tables
+            lines.append(f"Colonne ambiguë `{error.identifier}` ({error.clause}) : préfixez-la par l'alias de sa table.")
+
+        elif error.kind == "syntax":
+            hint.tables = query_tables
+            location = f" à la ligne {error.line}" if error.line else ""
+            lines.append(f"Erreur de syntaxe{location}" + (f", près de : {error.near}" if error.near else "."))
+
+        else:
+            hint.tables = query_tables
+            lines.append(f"Erreur MySQL{f' {error.code}' if error.code else ''} : {error.message[:200]}")
+
+        if hint.suggestions:
+            lines.append(f"Suggestions : {', '.join(hint.suggestions)}")
+        hint.tables = list(dict.fromkeys(hint.tables))
+        if hint.tables:
+            lines.append("Tables concernées (* = clé primaire) :")
+            lines.append(self.catalog.render_signatures(hint.tables))
+        hint.text = "\n".join(lines)
+        logger.info(f"🩹 Contexte de correction ({error.kind}): {len(hint.tables)} table(s), "
+                    f"{len(hint.suggestions)} suggestion(s)")
+        return hint
+
+    def record(self, kind: str, success: bool):
+        """Comptabilise le résultat d'une correction (la requête corrigée s'est-elle exécutée ?)"""
+        with self._lock:
+            bucket = self.stats.setdefault(kind, {"attempts": 0, "fixed": 0})
+            bucket["attempts"] += 1
+            bucket["fixed"] += int(success)
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = sum(b["attempts"] for b in self.stats.values())
+            fixed = sum(b["fixed"] for b in self.stats.values())
+            return {
+                "attempts": attempts,
+                "fixed": fixed,
+                "first_repair_success_rate": round(fixed / attempts, 3) if attempts else None,
+                "by_kind": {kind: dict(bucket) for kind, bucket in self.stats.items()},
+            }
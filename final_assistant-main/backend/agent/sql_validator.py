@@ -0,0 +1,318 @@
+import re
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple, Any
+
+from agent.sql_repair import SqlError
+from utils.sql_utils import STRING_LITERAL
+
+logger = logging.getLogger(__name__)
+
+COMMENT = re.compile(r'--[^\n]*|#[^\n]*|/\*.*?\*/', re.S)
+TOKEN = re.compile(r'\w+|\S')
+BOUND_MARKER = re.compile(r'%s')
+
+# Mots réservés, types et unités : jamais des colonnes (les fonctions sont reconnues à la parenthèse)
+KEYWORDS = {
+    'select', 'distinct', 'from', 'join', 'inner', 'left', 'right', 'outer', 'cross', 'natural',
+    'straight_join', 'on', 'using', 'where', 'group', 'by', 'having', 'order', 'asc', 'desc', 'limit',
+    'offset', 'union', 'all', 'as', 'and', 'or', 'not', 'xor', 'is', 'null', 'true', 'false', 'in',
+    'exists', 'like', 'between', 'regexp', 'rlike', 'case', 'when', 'then', 'else', 'end', 'div', 'mod',
+    'interval', 'with', 'recursive', 'rollup', 'over', 'partition', 'rows', 'range', 'unbounded',
+    'preceding', 'following', 'current', 'row', 'separator', 'collate', 'binary', 'escape', 'any', 'some',
+    'unknown', 'date', 'time', 'timestamp', 'datetime', 'char', 'signed', 'unsigned', 'decimal', 'integer',
+    'year', 'quarter', 'month', 'week', 'day', 'hour', 'minute', 'second', 'microsecond',
+    'year_month', 'day_hour', 'day_minute', 'day_second', 'hour_minute', 'hour_second', 'minute_second',
+    'current_date', 'current_time', 'current_timestamp', 'current_user', 'localtime', 'localtimestamp',
+    'utc_date', 'utc_time', 'utc_timestamp', 'for', 'lock', 'share', 'mode', 'into', 'dual', 'high_priority',
+    'sql_no_cache', 'sql_calc_found_rows', 'ignore', 'force', 'index', 'key', 'use',
+}
+# Clause courante → libellé MySQL de l'erreur « Unknown column ... in '...' »
+CLAUSES = {
+    'select': 'field list', 'from': 'from clause', 'join': 'from clause', 'on': 'on clause',
+    'where': 'where clause', 'group': 'group statement', 'having': 'having clause', 'order': 'order clause',
+}
+
+
+def edit_distance(a: str, b: str, limit: int = 2) -> int:
+    """Distance de Damerau-Levenshtein (transpositions adjacentes comptées 1), bornée à limit + 1"""
+    a, b = a.lower(), b.lower()
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def max_typo_distance(name: str) -> int:
+    """Fautes tolérées : une pour les noms courts, deux au-delà de 6 caractères"""
+    return 1 if len(name) <= 6 else 2
+
+
+@dataclass
+class Token:
+    text: str
+    start: int
+    end: int
+
+    @property
+    def lower(self) -> str:
+        return self.text.lower()
+
+    @property
+    def is_word(self) -> bool:
+        return self.text[0].isalpha() or self.text[0] == '_'
+
+    @property
+    def ends_expression(self) -> bool:
+        """Le jeton peut terminer une expression (le mot suivant est alors un alias implicite)"""
+        return (self.text == ')' or self.text in ("'", '"') or self.text[0].isdigit()
+                or (self.is_word and (self.lower not in KEYWORDS or self.lower in ('end', 'null', 'true', 'false'))))
+
+
+@dataclass
+class ValidationResult:
+    """SQL éventuellement corrigé (fautes de frappe), corrections appliquées et erreurs restantes"""
+    sql: str
+    fixes: List[str] = field(default_factory=list)
+    issues: List[SqlError] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    @property
+    def error(self) -> str:
+        """Erreurs au format des messages MySQL (reconnu par l'étape repair)"""
+        return "\n".join(issue.message for issue in self.issues)
+
+
+def _mask(sql: str) -> str:
+    """Littéraux, commentaires, marqueurs %s et backticks neutralisés, positions conservées"""
+    def blank(match):
+        text = match.group(0)
+        if text[0] in "'\"":
+            return text[0] + ' ' * (len(text) - 2) + text[-1]
+        return ' ' * len(text)
+
+    masked = STRING_LITERAL.sub(blank, sql)
+    masked = COMMENT.sub(blank, masked)
+    # Marqueurs %s des requêtes paramétrées : des valeurs, pas des colonnes
+    return BOUND_MARKER.sub(blank, masked).replace('`', ' ')
+
+
+class SqlValidator:
+    """
+    Validation locale du SQL généré contre le catalogue du schéma, avant tout accès à MySQL.
+    Chaque table, alias et colonne est résolu ; les fautes de frappe sans ambiguïté
+    (distance d'édition ≤ 2, ex: enseignant → enseingant) sont corrigées, les autres
+    erreurs sont renvoyées au format MySQL pour partir directement en correction.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self.stats = {"validated": 0, "fixed": 0, "rejected": 0, "fixes": 0, "by_kind": {}}
+
+    def _closest(self, name: str, candidates: List[str]) -> Optional[str]:
+        """Candidat le plus proche s'il est unique et dans la tolérance"""
+        limit = max_typo_distance(name)
+        best, best_distance, tie = None, limit + 1, False
+        for candidate in dict.fromkeys(candidates):
+            distance = edit_distance(name, candidate, limit)
+            if distance < best_distance:
+                best, best_distance, tie = candidate, distance, False
+            elif distance == best_distance and candidate.lower() != (best or '').lower():
+                tie = True
+        return None if tie or best_distance > limit else best
+
+    def _scan_tables(self, tokens: List[Token]) -> Tuple[List[Tuple[Token, Optional[Token]]], Set[str], Set[int]]:
+        """
+        Références FROM/JOIN (table, alias), noms dérivés (sous-requêtes, CTE, alias de colonnes)
+        et indices des jetons déjà consommés
+        """
+        references, derived, consumed = [], set(), set()
+        # Parenthèses ouvertes : True pour un appel de fonction (EXTRACT(YEAR FROM ...) n'est pas une table)
+        calls: List[bool] = []
+        count = len(tokens)
+        for i, token in enumerate(tokens):
+            lower = token.lower
+            previous = tokens[i - 1] if i else None
+            following = tokens[i + 1] if i + 1 < count else None
+            if token.text == '(':
+                calls.append(bool(previous and previous.is_word and previous.lower not in KEYWORDS))
+            elif token.text == ')' and calls:
+                calls.pop()
+
+            if token.is_word and lower not in KEYWORDS:
+                # CTE « nom AS ( »
+                if following and following.lower == 'as' and i + 2 < count and tokens[i + 2].text == '(':
+                    derived.add(lower)
+                    consumed.add(i)
+                # Alias « AS nom » ou implicite « expression nom » (hors qualificatif t. de t.col)
+                elif (previous and (previous.lower == 'as' or previous.ends_expression)
+                      and not (following and following.text == '.')):
+                    derived.add(lower)
+                    consumed.add(i)
+            if lower not in ('from', 'join') or (calls and calls[-1]):
+                continue
+
+            j = i + 1
+            while j < count:
+                if tokens[j].text == '(' or not tokens[j].is_word or tokens[j].lower in KEYWORDS:
+                    break
+                table = tokens[j]
+                consumed.add(j)
+                if j + 2 < count and tokens[j + 1].text == '.' and tokens[j + 2].is_word:
+                    table = tokens[j + 2]
+                    consumed.update((j + 1, j + 2))
+                    j += 2
+                j += 1
+                alias = None
+                if j < count and tokens[j].lower == 'as':
+                    j += 1
+                if j < count and tokens[j].is_word and tokens[j].lower not in KEYWORDS:
+                    alias = tokens[j]
+                    consumed.add(j)
+                    j += 1
+                references.append((table, alias))
+                if lower != 'from' or j >= count or tokens[j].text != ',':
+                    break
+                j += 1
+        return references, derived, consumed
+
+    def validate(self, sql: str) -> ValidationResult:
+        """Résout tables, alias et colonnes ; sans catalogue disponible, le SQL passe tel quel"""
+        result = ValidationResult(sql)
+        try:
+            self.catalog.ensure_fresh()
+        except Exception as e:
+            logger.warning(f"⚠️ Catalogue indisponible, validation locale ignorée: {e}")
+            return result
+        if not sql or not self.catalog.tables:
+            return result
+
+        masked = _mask(sql)
+        tokens = [Token(m.group(0), m.start(), m.end()) for m in TOKEN.finditer(masked)]
+        references, derived, consumed = self._scan_tables(tokens)
+        replacements: Dict[int, Tuple[int, str]] = {}
+
+        # Tables et alias
+        aliases: Dict[str, Any] = {}
+        for table_token, alias_token in references:
+            name = table_token.text
+            table = self.catalog.get(name)
+            if table is None and name.lower() not in derived:
+                candidate = self._closest(name, self.catalog.table_names())
+                if candidate:
+                    table = self.catalog.get(candidate)
+                else:
+                    result.issues.append(SqlError(
+                        "unknown_table", f"Table '{name}' doesn't exist", 1146, name))
+            # Noms de tables sensibles à la casse sous Linux : la casse du catalogue est rétablie
+            if table is not None and table.name != name:
+                replacements[table_token.start] = (table_token.end, table.name)
+                result.fixes.append(f"table {name} → {table.name}")
+            aliases[name.lower()] = table
+            if table is not None:
+                aliases[table.name.lower()] = table
+            if alias_token is not None:
+                aliases[alias_token.lower] = table
+        query_tables = list({id(t): t for t in aliases.values() if t is not None}.values())
+
+        # Colonnes
+        clause = 'field list'
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            lower = token.lower
+            if lower in CLAUSES:
+                clause = CLAUSES[lower]
+            if i in consumed or not token.is_word or lower in KEYWORDS:
+                i += 1
+                continue
+            previous = tokens[i - 1].text if i else ''
+            following = tokens[i + 1].text if i + 1 < len(tokens) else ''
+
+            if following == '.' and i + 2 < len(tokens):
+                column_token = tokens[i + 2]
+                self._check_qualified(token, column_token, aliases, derived, clause, result, replacements)
+                i += 3
+                continue
+
+            if not (following == '(' or previous in ('@', '{', '.') or lower in derived or lower in aliases):
+                self._check_unqualified(token, query_tables, bool(derived), clause, result, replacements)
+            i += 1
+
+        if replacements:
+            fixed_sql = sql
+            for start in sorted(replacements, reverse=True):
+                end, text = replacements[start]
+                fixed_sql = fixed_sql[:start] + text + fixed_sql[end:]
+            result.sql = fixed_sql
+        self._record(result)
+        return result
+
+    def _check_qualified(self, qualifier: Token, column_token: Token, aliases, derived, clause,
+                         result: ValidationResult, replacements):
+        key = qualifier.lower
+        label = f"{qualifier.text}.{column_token.text}"
+        if key not in aliases:
+            if key not in derived:
+                result.issues.append(SqlError(
+                    "unknown_column", f"Unknown column '{label}' in '{clause}'", 1054,
+                    column_token.text, qualifier.text, clause))
+            return
+        table = aliases[key]
+        if table is None or column_token.text == '*' or not column_token.is_word:
+            return
+        if table.column(column_token.text):
+            return
+        candidate = self._closest(column_token.text, [c.name for c in table.columns])
+        if candidate:
+            replacements[column_token.start] = (column_token.end, candidate)
+            result.fixes.append(f"colonne {label} → {qualifier.text}.{candidate}")
+        else:
+            result.issues.append(SqlError(
+                "unknown_column", f"Unknown column '{label}' in '{clause}'", 1054,
+                column_token.text, qualifier.text, clause))
+
+    def _check_unqualified(self, token: Token, query_tables, has_derived: bool, clause,
+                           result: ValidationResult, replacements):
+        if not query_tables or any(table.column(token.text) for table in query_tables):
+            return
+        candidate = self._closest(token.text, [c.name for table in query_tables for c in table.columns])
+        if candidate and len(token.text) >= 4:
+            replacements[token.start] = (token.end, candidate)
+            result.fixes.append(f"colonne {token.text} → {candidate}")
+        elif not has_derived:
+            # Avec des sous-requêtes nommées, la colonne peut venir d'une table dérivée : MySQL tranchera
+            result.issues.append(SqlError(
+                "unknown_column", f"Unknown column '{token.text}' in '{clause}'", 1054, token.text, clause=clause))
+
+    def _record(self, result: ValidationResult):
+        with self._lock:
+            self.stats["validated"] += 1
+            self.stats["fixed"] += bool(result.fixes)
+            self.stats["fixes"] += len(result.fixes)
+            self.stats["rejected"] += bool(result.issues)
+            for issue in result.issues:
+                self.stats["by_kind"][issue.kind] = self.stats["by_kind"].get(issue.kind, 0) + 1
+        if result.fixes:
+            logger.info(f"🔧 SQL corrigé localement: {', '.join(result.fixes)}")
+        if result.issues:
+            logger.warning(f"🚫 SQL rejeté avant exécution: {result.error}")
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "by_kind": dict(self.stats["by_kind"])}
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import pickle
+import logging
+import threading
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Incrémenter quand la structure de l'instantané change : les anciens fichiers sont ignorés
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_PATH = Path(os.getenv("ASSISTANT_SNAPSHOT_PATH", str(BACKEND_DIR / "data" / "assistant_snapshot.pkl")))
+SNAPSHOT_ENABLED = os.getenv("ASSISTANT_SNAPSHOT_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+def file_signature(path) -> Optional[Tuple[int, int]]:
+    """(mtime en ns, taille) d'un fichier source ; None s'il n'existe pas"""
+    try:
+        stat = Path(path).stat()
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+def _runtime() -> Dict[str, str]:
+    """
+    Versions dont dépend le dépicklage (vectoriseurs scikit-learn, dataclasses du catalogue),
+    lues dans les métadonnées des paquets pour ne pas importer scikit-learn au démarrage
+    """
+    try:
+        sklearn_version = metadata.version("scikit-learn")
+    except metadata.PackageNotFoundError:
+        sklearn_version = None
+    return {"python": sys.version.split()[0], "sklearn": sklearn_version}
+
+
+class StartupSnapshot:
+    """
+    Instantané local et versionné de l'état dérivé de SQLAssistant (catalogue du schéma,
+    templates de questions, index TF-IDF des caches) pour un démarrage en quelques ms.
+    Chaque composant garde la signature de son fichier source et n'est réutilisé que s'il
+    est inchangé ; le catalogue est revérifié contre la base en arrière-plan.
+    """
+
+    def __init__(self, path: Optional[Path] = None, enabled: Optional[bool] = None):
+        self.path = Path(path or SNAPSHOT_PATH)
+        self.enabled = SNAPSHOT_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self.stats = {"loaded": False, "load_ms": 0.0, "saved_at": None, "save_ms": 0.0, "restored": []}
+
+    def load(self) -> Dict[str, Any]:
+        """Composants de l'instantané ; dictionnaire vide s'il est absent, illisible ou d'une autre version"""
+        if not self.enabled or not self.path.exists():
+            return {}
+        start = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Instantané de démarrage illisible, reconstruction complète: {e}")
+            return {}
+
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("runtime") != _runtime():
+            logger.info("🔄 Instantané de démarrage d'une autre version, ignoré")
+            return {}
+
+        self.stats["loaded"] = True
+        self.stats["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"⚡ Instantané de démarrage chargé ({self.stats['load_ms']} ms, "
+                    f"créé le {time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(snapshot.get('created_at', 0)))})")
+        return snapshot.get("components", {})
+
+    def mark_restored(self, component: str):
+        self.stats["restored"].append(component)
+
+    def save(self, components: Dict[str, Any]) -> bool:
+        """Écrit l'instantané (fichier temporaire puis remplacement atomique)"""
+        if not self.enabled:
+            return False
+        start = time.perf_counter()
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "runtime": _runtime(),
+            "created_at": time.time(),
+            "components": components,
+        }
+        with self._lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"⚠️ Écriture de l'instantané de démarrage impossible: {e}")
+                return False
+
+        self.stats["saved_at"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(snapshot["created_at"]))
+        self.stats["save_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"💾 Instantané de démarrage enregistré ({self.stats['save_ms']} ms): {self.path}")
+        return True
+
+    def describe(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "path": str(self.path), **self.stats}
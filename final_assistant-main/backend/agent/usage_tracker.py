@@ -0,0 +1,231 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prix en dollars pour 1K tokens : (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4.1": (0.002, 0.008),
+    "gpt-4.1-mini": (0.0004, 0.0016),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+DEFAULT_PRICE_PER_1K = float(os.getenv("LLM_DEFAULT_PRICE_PER_1K", "0.005"))
+RECENT_REQUESTS = int(os.getenv("LLM_USAGE_RECENT_REQUESTS", "50"))
+# Utilisateurs suivis individuellement ; au-delà, leurs appels sont cumulés sous OTHER_USERS
+MAX_TRACKED_USERS = int(os.getenv("LLM_USAGE_MAX_USERS", "200"))
+OTHER_USERS = "autres"
+
+DIMENSIONS = ("stage", "model", "role", "user", "path")
+# Répartitions nominatives : réservées aux routes d'administration (/metrics)
+PRIVATE_DIMENSIONS = ("role", "user")
+
+# Contexte de la requête en cours : rôle, utilisateur, chemin du pipeline et cumul
+_request_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("llm_request_context", default=None)
+
+
+def _empty_bucket() -> Dict[str, float]:
+    return {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "latency_ms": 0.0}
+
+
+def _add(bucket: Dict[str, float], prompt_tokens: int, completion_tokens: int,
+         cost: float, latency_ms: float, error: bool):
+    bucket["calls"] += 1
+    bucket["errors"] += int(error)
+    bucket["prompt_tokens"] += prompt_tokens
+    bucket["completion_tokens"] += completion_tokens
+    bucket["cost"] += cost
+    bucket["latency_ms"] += latency_ms
+
+
+def _public(bucket: Dict[str, float]) -> Dict[str, Any]:
+    calls = bucket["calls"] or 1
+    return {
+        "calls": bucket["calls"],
+        "errors": bucket["errors"],
+        "prompt_tokens": bucket["prompt_tokens"],
+        "completion_tokens": bucket["completion_tokens"],
+        "total_tokens": bucket["prompt_tokens"] + bucket["completion_tokens"],
+        "cost_usd": round(bucket["cost"], 6),
+        "avg_latency_ms": round(bucket["latency_ms"] / calls, 1),
+    }
+
+
+class UsageTracker:
+    """Agrège tokens, coût et latence des appels LLM par étape, modèle, rôle, utilisateur et chemin"""
+
+    def __init__(self, default_price_per_1k: float = DEFAULT_PRICE_PER_1K, max_users: int = MAX_TRACKED_USERS):
+        self.default_price_per_1k = default_price_per_1k
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._total = _empty_bucket()
+        self._by: Dict[str, Dict[str, Dict[str, float]]] = {dimension: {} for dimension in DIMENSIONS}
+        self._recent_requests = deque(maxlen=RECENT_REQUESTS)
+        self._prompts: Dict[str, Dict[str, float]] = {}
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = MODEL_PRICES.get(
+            model, (self.default_price_per_1k, self.default_price_per_1k)
+        )
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def record(self, stage: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+               latency_ms: float = 0.0, error: bool = False):
+        """Enregistre un appel LLM dans les agrégats et dans le cumul de la requête en cours"""
+        cost = self.cost(model, prompt_tokens, completion_tokens)
+        context = _request_context.get() or {}
+        keys = {
+            "stage": stage,
+            "model": model,
+            "role": context.get("role") or "inconnu",
+            "user": str(context.get("user_id") or "anonyme"),
+            "path": context.get("path") or "hors_pipeline",
+        }
+
+        with self._lock:
+            _add(self._total, prompt_tokens, completion_tokens, cost, latency_ms, error)
+            users = self._by["user"]
+            if keys["user"] not in users and len(users) >= self.max_users:
+                keys["user"] = OTHER_USERS
+            for dimension, key in keys.items():
+                bucket = self._by[dimension].setdefault(key, _empty_bucket())
+                _add(bucket, prompt_tokens, completion_tokens, cost, latency_ms, error)
+
+        if "usage" in context:
+            _add(context["usage"], prompt_tokens, completion_tokens, cost, latency_ms, error)
+
+        logger.debug(
+            f"💰 LLM {stage}/{model}: {prompt_tokens}+{completion_tokens} tokens, "
+            f"{latency_ms:.0f} ms, ${cost:.5f} (chemin {keys['path']})"
+        )
+
+    def record_prompt(self, stage: str, build_ms: float, prompt_chars: int,
+                      table_info_tokens: Optional[Tuple[int, int]] = None):
+        """
+        Enregistre le temps d'assemblage et la taille d'un prompt (hors appel LLM).
+        table_info_tokens : tokens de table_info (avant, après) sélection des tables et colonnes.
+        """
+        with self._lock:
+            bucket = self._prompts.setdefault(stage, {
+                "builds": 0, "build_ms": 0.0, "chars": 0, "max_chars": 0,
+                "table_builds": 0, "table_tokens_before": 0, "table_tokens_after": 0,
+            })
+            bucket["builds"] += 1
+            bucket["build_ms"] += build_ms
+            bucket["chars"] += prompt_chars
+            bucket["max_chars"] = max(bucket["max_chars"], prompt_chars)
+            if table_info_tokens is not None:
+                bucket["table_builds"] += 1
+                bucket["table_tokens_before"] += table_info_tokens[0]
+                bucket["table_tokens_after"] += table_info_tokens[1]
+
+        context = _request_context.get()
+        if context is not None:
+            context["prompt_build_ms"] = context.get("prompt_build_ms", 0.0) + build_ms
+        logger.debug(f"🧩 Prompt {stage}: {prompt_chars} caractères assemblés en {build_ms:.1f} ms")
+
+    def finish_request(self, context: Dict[str, Any]):
+        """Archive le cumul d'une requête terminée"""
+        summary = {
+            "role": context.get("role"),
+            "user": context.get("user_id"),
+            "path": context.get("path"),
+            "duration_ms": round((time.perf_counter() - context["started"]) * 1000, 1),
+            "prompt_build_ms": round(context.get("prompt_build_ms", 0.0), 2),
+            **_public(context["usage"]),
+        }
+        with self._lock:
+            self._recent_requests.append(summary)
+        if summary["calls"]:
+            logger.info(
+                f"💰 Requête: {summary['calls']} appel(s) LLM, {summary['total_tokens']} tokens, "
+                f"${summary['cost_usd']:.5f} (chemin {summary['path']})"
+            )
+        return summary
+
+    def snapshot(self, include_recent: bool = True, include_private: bool = True) -> Dict[str, Any]:
+        """Compteurs agrégés ; sans include_private, pas de répartition par rôle ni par utilisateur"""
+        with self._lock:
+            data = {
+                "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started_at)),
+                "total": _public(self._total),
+                **{f"by_{dimension}": {key: _public(bucket) for key, bucket in buckets.items()}
+                   for dimension, buckets in self._by.items()
+                   if include_private or dimension not in PRIVATE_DIMENSIONS},
+                "prompt_build_by_stage": {
+                    stage: {
+                        "builds": bucket["builds"],
+                        "avg_build_ms": round(bucket["build_ms"] / bucket["builds"], 2),
+                        "avg_chars": round(bucket["chars"] / bucket["builds"]),
+                        "max_chars": bucket["max_chars"],
+                        **({
+                            "avg_table_info_tokens_before": round(bucket["table_tokens_before"] / bucket["table_builds"]),
+                            "avg_table_info_tokens_after": round(bucket["table_tokens_after"] / bucket["table_builds"]),
+                        } if bucket["table_builds"] else {}),
+                    }
+                    for stage, bucket in self._prompts.items()
+                },
+            }
+            if include_recent:
+                data["recent_requests"] = list(self._recent_requests)
+        return data
+
+    def reset(self):
+        with self._lock:
+            self._started_at = time.time()
+            self._total = _empty_bucket()
+            self._by = {dimension: {} for dimension in DIMENSIONS}
+            self._recent_requests.clear()
+            self._prompts = {}
+
+
+usage_tracker = UsageTracker()
+
+
+def get_usage_tracker() -> UsageTracker:
+    return usage_tracker
+
+
+@contextmanager
+def usage_context(role: Optional[str] = None, user_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Ouvre le contexte de comptage d'une requête (rôle, utilisateur, chemin du pipeline)"""
+    context = {"role": role, "user_id": user_id, "path": None,
+               "usage": _empty_bucket(), "started": time.perf_counter()}
+    token = _request_context.set(context)
+    try:
+        yield context
+    finally:
+        try:
+            _request_context.reset(token)
+        except ValueError:
+            # Générateur repris dans un autre contexte (streaming) : on efface simplement
+            _request_context.set(None)
+        context["summary"] = usage_tracker.finish_request(context)
+
+
+def set_path(path: str):
+    """Indique le chemin du pipeline en cours (cache, template, llm, auto_correct...)"""
+    context = _request_context.get()
+    if context is not None:
+        context["path"] = path
+
+
+def current_user_id() -> Optional[int]:
+    """Utilisateur de la requête en cours (None hors contexte, ex: thread d'exécution spéculative)"""
+    context = _request_context.get()
+    return context["user_id"] if context else None
+
+
+def current_request_usage() -> Optional[Dict[str, Any]]:
+    """Consommation cumulée de la requête en cours (None hors contexte)"""
+    context = _request_context.get()
+    return _public(context["usage"]) if context else None
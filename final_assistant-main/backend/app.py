@@ -149,6 +149,7 @@ def create_app():
 
         finally:
             cursor.close()
+            conn.close()
 
 
     #Route de test d'authentification
@@ -0,0 +1,195 @@
+"""
+Compare les jeux de profils LLM de config/llm_profiles.json sur le même corpus :
+latence et coût par étape, et impact sur la qualité par rapport à un jeu de référence
+(SQL identique, résultats identiques, SQL de référence des caches, valeurs reprises au formatage).
+
+Usage (depuis backend/, base et clé OpenAI configurées) :
+    python -m benchmarks.compare_profiles [--sets quality,tiered] [--baseline quality]
+           [--role ROLE_SUPER_ADMIN|ROLE_PARENT] [--user-id ID_PARENT]
+           [--corpus questions.txt] [--limit 20] [--execute] [--format] [--local-domains]
+
+Le cache des complétions LLM est désactivé pendant la mesure (sauf --use-cache) et le
+classifieur local de domaines est contourné (sauf --local-domains) pour mesurer l'étape domain.
+
+Sans clé OpenAI, pointer le client vers le serveur simulé :
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake (voir benchmarks/fake_openai_server.py)
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.replay_domains import load_cached_queries, load_corpus
+from benchmarks.compare_single_call import _normalize_sql, _percentile
+
+
+def _facts_preserved(rows, response: str, limit: int = 5) -> float:
+    """Part des valeurs des premières lignes reprises telles quelles dans la réponse formatée"""
+    values = {
+        str(value) for row in rows[:limit] for value in row.values()
+        if value not in (None, "") and not isinstance(value, bool)
+    }
+    if not values:
+        return 1.0
+    return sum(value in response for value in values) / len(values)
+
+
+def run_profile_set(assistant, questions, generate, args):
+    """Génère (puis exécute et formate) chaque question avec le jeu de profils actif"""
+    from agent.llm_utils import chat_completion
+
+    runs = []
+    for question in questions:
+        run = {"question": question, "sql": "", "error": None, "rows": None}
+        start = time.perf_counter()
+        try:
+            run["sql"] = generate(question)
+        except Exception as e:
+            run["error"] = str(e)
+        run["latency_ms"] = (time.perf_counter() - start) * 1000
+
+        if args.execute and run["sql"]:
+            result = assistant.execute_sql_query(run["sql"])
+            run["rows"] = (result.get("rows") or result.get("data")) if result.get("success") else None
+
+        if args.format and run["rows"]:
+            start = time.perf_counter()
+            try:
+                response = chat_completion(assistant._build_format_messages(run["rows"], question), stage="format")
+                text = response.choices[0].message.content or ""
+                run["format"] = {"ok": True, "length": len(text), "facts": _facts_preserved(run["rows"], text)}
+            except Exception as e:
+                run["format"] = {"ok": False, "error": str(e)}
+            run["format"]["latency_ms"] = (time.perf_counter() - start) * 1000
+
+        runs.append(run)
+    return runs
+
+
+def summarize(runs, usage, baseline=None, references=None):
+    latencies = [r["latency_ms"] for r in runs]
+    succeeded = [r for r in runs if not r["error"] and r["sql"]]
+    report = {
+        "questions": len(runs),
+        "success_rate": round(len(succeeded) / len(runs), 3) if runs else 0.0,
+        "latency_ms_mean": round(statistics.mean(latencies), 1) if latencies else 0.0,
+        "latency_ms_p50": round(_percentile(latencies, 50), 1),
+        "latency_ms_p95": round(_percentile(latencies, 95), 1),
+        "cost_usd": usage["total"]["cost_usd"],
+        "tokens": usage["total"]["total_tokens"],
+        "by_stage": {
+            stage: {k: stats[k] for k in ("calls", "errors", "avg_latency_ms", "cost_usd")}
+            for stage, stats in usage["by_stage"].items()
+        },
+        "models": sorted(usage["by_model"]),
+    }
+
+    if baseline is not None:
+        pairs = [(r, b) for r, b in zip(runs, baseline) if r["sql"] and b["sql"]]
+        report["same_sql_as_baseline"] = round(
+            sum(_normalize_sql(r["sql"]) == _normalize_sql(b["sql"]) for r, b in pairs) / len(pairs), 3
+        ) if pairs else None
+        executed = [(r, b) for r, b in pairs if r["rows"] is not None and b["rows"] is not None]
+        if executed:
+            report["same_rows_as_baseline"] = round(sum(r["rows"] == b["rows"] for r, b in executed) / len(executed), 3)
+
+    if references:
+        checked = [r for r in runs if r["question"] in references and r["sql"]]
+        report["reference_sql_match"] = round(
+            sum(_normalize_sql(r["sql"]) == _normalize_sql(references[r["question"]]) for r in checked) / len(checked), 3
+        ) if checked else None
+
+    formats = [r["format"] for r in runs if "format" in r]
+    if formats:
+        ok = [f for f in formats if f["ok"]]
+        report["format"] = {
+            "calls": len(formats),
+            "success_rate": round(len(ok) / len(formats), 3),
+            "latency_ms_mean": round(statistics.mean(f["latency_ms"] for f in formats), 1),
+            "facts_preserved": round(statistics.mean(f["facts"] for f in ok), 3) if ok else None,
+            "length_mean": round(statistics.mean(f["length"] for f in ok), 1) if ok else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence et qualité de chaque jeu de profils LLM")
+    parser.add_argument('--sets', help="Jeux à comparer, séparés par des virgules (défaut : tous)")
+    parser.add_argument('--baseline', default='quality', help="Jeu de référence pour la qualité")
+    parser.add_argument('--role', default='ROLE_SUPER_ADMIN', choices=['ROLE_SUPER_ADMIN', 'ROLE_PARENT'])
+    parser.add_argument('--user-id', type=int, help="ID personne du parent (obligatoire pour ROLE_PARENT)")
+    parser.add_argument('--corpus', help="Fichier de questions supplémentaires (.txt ou .json)")
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--execute', action='store_true', help="Exécute les requêtes et compare les résultats")
+    parser.add_argument('--format', action='store_true', help="Mesure aussi l'étape format (implique --execute)")
+    parser.add_argument('--local-domains', action='store_true',
+                        help="Garde le classifieur local (l'étape domain n'est appelée qu'en repli)")
+    parser.add_argument('--use-cache', action='store_true', help="Laisse actif le cache des complétions LLM")
+    args = parser.parse_args()
+    args.execute = args.execute or args.format
+
+    load_dotenv()
+    if not args.use_cache:
+        os.environ['LLM_CACHE_ENABLED'] = 'false'
+
+    from agent.assistant import SQLAssistant
+    from agent.llm_utils import apply_profile_set, describe_profiles
+    from agent.usage_tracker import get_usage_tracker
+
+    available = list(describe_profiles()["available"])
+    sets = [s.strip() for s in args.sets.split(',')] if args.sets else available
+    unknown = [s for s in sets if s not in available]
+    if unknown:
+        parser.error(f"Jeux inconnus: {', '.join(unknown)} (disponibles: {', '.join(available)})")
+    if args.baseline in sets:
+        sets.remove(args.baseline)
+        sets.insert(0, args.baseline)
+
+    assistant = SQLAssistant()
+    cached_queries = load_cached_queries()
+    references = {q.strip(): sql for q, sql in cached_queries if q and sql}
+    questions = load_corpus(args.corpus, cached_queries)[:args.limit]
+
+    if args.role == 'ROLE_PARENT':
+        if not args.user_id:
+            parser.error("--user-id est obligatoire pour ROLE_PARENT")
+        children_ids, children_names = assistant.get_user_children_data(args.user_id)
+        generate = lambda q: assistant.generate_sql_parent(
+            q, args.user_id, ", ".join(map(str, children_ids)), ", ".join(children_names)
+        )
+    else:
+        generate = assistant.generate_sql_with_ai
+
+    # Le classifieur local ne doit pas apprendre pendant la mesure
+    assistant.domain_classifier.learn = lambda *a, **k: None
+    if not args.local_domains:
+        assistant.domain_classifier.is_confident = lambda confidence: False
+
+    tracker = get_usage_tracker()
+    results, report = {}, {"role": args.role, "baseline": sets[0] if sets else None, "profiles": {}}
+    try:
+        for name in sets:
+            apply_profile_set(name)
+            tracker.reset()
+            results[name] = run_profile_set(assistant, questions, generate, args)
+            baseline = results[sets[0]] if name != sets[0] else None
+            report["profiles"][name] = {
+                "stages": describe_profiles()["stages"],
+                **summarize(results[name], tracker.snapshot(include_recent=False), baseline, references),
+            }
+    finally:
+        apply_profile_set()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+
+
+if __name__ == '__main__':
+    main()
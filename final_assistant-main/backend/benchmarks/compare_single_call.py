@@ -0,0 +1,129 @@
+"""
+Compare le pipeline en deux étapes (domaines puis SQL) au mode appel unique
+sur le même corpus : latence, taux de succès, repli et concordance du SQL.
+
+Usage (depuis backend/, base et clé OpenAI configurées) :
+    python -m benchmarks.compare_single_call [--role ROLE_SUPER_ADMIN|ROLE_PARENT]
+           [--user-id ID_PARENT] [--corpus questions.txt] [--limit 20] [--execute]
+
+Sans clé OpenAI, pointer le client vers le serveur simulé :
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake (voir benchmarks/fake_openai_server.py)
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.replay_domains import load_cached_queries, load_corpus
+
+MODES = ("two_step", "single_call")
+
+
+def _normalize_sql(sql: str) -> str:
+    return re.sub(r'\s+', ' ', (sql or '').strip().rstrip(';')).lower()
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_mode(assistant, mode, role, questions, generate):
+    """Génère le SQL de chaque question dans un mode donné"""
+    assistant.single_call_roles = {role} if mode == "single_call" else set()
+    runs = []
+    for question in questions:
+        start = time.perf_counter()
+        try:
+            sql = generate(question)
+            error = None
+        except Exception as e:
+            sql, error = "", str(e)
+        runs.append({
+            "question": question,
+            "sql": sql,
+            "error": error,
+            "strategy": assistant.last_sql_strategy,
+            "latency_ms": (time.perf_counter() - start) * 1000
+        })
+    return runs
+
+
+def summarize(runs):
+    latencies = [r["latency_ms"] for r in runs]
+    succeeded = [r for r in runs if not r["error"]]
+    return {
+        "questions": len(runs),
+        "success_rate": round(len(succeeded) / len(runs), 3) if runs else 0.0,
+        "fallback_rate": round(sum(r["strategy"] == "two_step" for r in runs) / len(runs), 3) if runs else 0.0,
+        "latency_ms_mean": round(statistics.mean(latencies), 1) if latencies else 0.0,
+        "latency_ms_p50": round(_percentile(latencies, 50), 1),
+        "latency_ms_p95": round(_percentile(latencies, 95), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deux étapes vs appel unique pour la génération SQL")
+    parser.add_argument('--role', default='ROLE_SUPER_ADMIN', choices=['ROLE_SUPER_ADMIN', 'ROLE_PARENT'])
+    parser.add_argument('--user-id', type=int, help="ID personne du parent (obligatoire pour ROLE_PARENT)")
+    parser.add_argument('--corpus', help="Fichier de questions supplémentaires (.txt ou .json)")
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--execute', action='store_true',
+                        help="Exécute les deux requêtes et compare aussi les résultats")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from agent.assistant import SQLAssistant
+
+    assistant = SQLAssistant()
+    questions = load_corpus(args.corpus, load_cached_queries())[:args.limit]
+
+    if args.role == 'ROLE_PARENT':
+        if not args.user_id:
+            parser.error("--user-id est obligatoire pour ROLE_PARENT")
+        children_ids, children_names = assistant.get_user_children_data(args.user_id)
+        generate = lambda q: assistant.generate_sql_parent(
+            q, args.user_id, ", ".join(map(str, children_ids)), ", ".join(children_names)
+        )
+    else:
+        generate = assistant.generate_sql_with_ai
+
+    # Le classifieur local ne doit pas apprendre pendant la mesure
+    assistant.domain_classifier.learn = lambda *a, **k: None
+
+    results = {mode: run_mode(assistant, mode, args.role, questions, generate) for mode in MODES}
+
+    same_sql = same_rows = compared = 0
+    for two_step, single in zip(results["two_step"], results["single_call"]):
+        if two_step["error"] or single["error"]:
+            continue
+        compared += 1
+        same_sql += _normalize_sql(two_step["sql"]) == _normalize_sql(single["sql"])
+        if args.execute:
+            a = assistant.execute_sql_query(two_step["sql"])
+            b = assistant.execute_sql_query(single["sql"])
+            same_rows += a.get("success") and b.get("success") and a["data"] == b["data"]
+
+    report = {
+        "role": args.role,
+        **{mode: summarize(runs) for mode, runs in results.items()},
+        "compared": compared,
+        "same_sql_rate": round(same_sql / compared, 3) if compared else 0.0,
+    }
+    if args.execute:
+        report["same_rows_rate"] = round(same_rows / compared, 3) if compared else 0.0
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Serveur local compatible OpenAI (chat.completions) pour les tests de charge hors ligne.
+
+Réponses scriptées par motifs de prompt, latences tirées de distributions configurables,
+streaming SSE (avec usage final si stream_options.include_usage) et injection d'erreurs.
+
+Usage (depuis backend/) :
+    python -m benchmarks.fake_openai_server [--scenario benchmarks/fake_openai_scenario.json]
+           [--port 8099] [--latency-scale 1.0] [--seed 42]
+
+Puis lancer l'application ou un benchmark avec :
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake ...
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCENARIO = Path(__file__).resolve().parent / 'fake_openai_scenario.json'
+
+# Marqueurs de la question dans les prompts du pipeline (le dernier trouvé l'emporte)
+QUESTION_MARKERS = [
+    re.compile(r'User Question:\s*(.+)'),
+    re.compile(r'Question\s*:\s*(.+)'),
+]
+
+
+def extract_question(prompt: str) -> str:
+    for marker in QUESTION_MARKERS:
+        matches = marker.findall(prompt)
+        if matches:
+            return matches[-1].strip()
+    return ""
+
+
+def sample_latency_ms(spec: Optional[Dict[str, Any]], rng: random.Random) -> float:
+    """Tire une latence (ms) selon la distribution : fixed, uniform, normal ou lognormal"""
+    if not spec:
+        return 0.0
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "uniform":
+        value = rng.uniform(spec.get("min_ms", 0), spec.get("max_ms", 0))
+    elif distribution == "normal":
+        value = rng.gauss(spec.get("mean_ms", 0), spec.get("stddev_ms", 0))
+    elif distribution == "lognormal":
+        median = max(spec.get("median_ms", 1), 1e-3)
+        value = rng.lognormvariate(0, spec.get("sigma", 0.5)) * median
+    else:
+        value = spec.get("ms", 0)
+    return max(0.0, value)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class Scenario:
+    """Règles de réponse chargées depuis un fichier JSON (la première règle qui correspond l'emporte)"""
+
+    def __init__(self, data: Dict[str, Any], latency_scale: float = 1.0, seed: Optional[int] = None):
+        self.rules = []
+        for rule in data.get("rules", []):
+            compiled = dict(rule)
+            compiled["_when"] = re.compile(rule["when"], re.S) if rule.get("when") else None
+            compiled["_question"] = re.compile(rule["question"], re.I) if rule.get("question") else None
+            self.rules.append(compiled)
+        self.default = data.get("default", {"response": "SELECT 1"})
+        self.latency = data.get("latency")
+        self.stream_token_ms = data.get("stream_token_ms", 20)
+        self.error_rate = data.get("error_rate", 0.0)
+        self.latency_scale = latency_scale
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "by_rule": {}}
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "Scenario":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    def match(self, prompt: str) -> Tuple[Dict[str, Any], str]:
+        question = extract_question(prompt)
+        for rule in self.rules:
+            if rule["_when"] and not rule["_when"].search(prompt):
+                continue
+            if rule["_question"] and not rule["_question"].search(question):
+                continue
+            return rule, question
+        return self.default, question
+
+    def plan(self, prompt: str) -> Dict[str, Any]:
+        """Décide la réponse, la latence et l'éventuelle erreur pour un prompt"""
+        rule, question = self.match(prompt)
+        with self._lock:
+            latency_ms = sample_latency_ms(rule.get("latency", self.latency), self.rng) * self.latency_scale
+            fail = self.rng.random() < rule.get("error_rate", self.error_rate)
+            name = rule.get("name", "default")
+            self.stats["requests"] += 1
+            self.stats["errors"] += int(fail)
+            self.stats["by_rule"][name] = self.stats["by_rule"].get(name, 0) + 1
+
+        if "response_json" in rule:
+            content = json.dumps(rule["response_json"], ensure_ascii=False)
+        else:
+            content = str(rule.get("response", ""))
+        content = content.replace("{question}", question)
+
+        return {
+            "rule": name,
+            "content": content,
+            "latency_ms": latency_ms,
+            "stream_token_ms": rule.get("stream_token_ms", self.stream_token_ms) * self.latency_scale,
+            "error_status": rule.get("error_status", 500) if fail else None,
+        }
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(str(content or ""))
+    return "\n".join(parts)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    scenario: Scenario = None
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "owned_by": "fake"}]})
+        elif self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, self.scenario.stats)
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON", "type": "invalid_request_error"}})
+            return
+
+        prompt = _prompt_text(request.get("messages", []))
+        plan = self.scenario.plan(prompt)
+        time.sleep(plan["latency_ms"] / 1000)
+
+        if plan["error_status"]:
+            self._send_json(plan["error_status"], {
+                "error": {"message": f"Erreur simulée ({plan['rule']})", "type": "server_error"}
+            })
+            return
+
+        model = request.get("model", "gpt-4o")
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": estimate_tokens(plan["content"]),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if request.get("stream"):
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            self._stream(model, plan, usage if include_usage else None)
+        else:
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": plan["content"]},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _stream(self, model: str, plan: Dict[str, Any], usage: Optional[Dict[str, int]]):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        def chunk(delta: Dict[str, Any], finish_reason=None, with_usage=None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if with_usage:
+                payload["usage"] = with_usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            self.wfile.write(chunk({"role": "assistant", "content": ""}))
+            for token in re.findall(r'\S+\s*', plan["content"]):
+                time.sleep(plan["stream_token_ms"] / 1000)
+                self.wfile.write(chunk({"content": token}))
+                self.wfile.flush()
+            self.wfile.write(chunk({}, finish_reason="stop"))
+            if usage:
+                self.wfile.write(chunk({}, with_usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Client déconnecté pendant le streaming")
+
+
+def start_server(scenario: Scenario, host: str = "127.0.0.1", port: int = 8099) -> Tuple[ThreadingHTTPServer, threading.Thread]:
+    """Démarre le serveur dans un thread (pour les benchmarks qui l'embarquent)"""
+    handler = type("ScenarioHandler", (FakeOpenAIHandler,), {"scenario": scenario})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur chat.completions simulé pour tests hors ligne")
+    parser.add_argument('--scenario', default=str(DEFAULT_SCENARIO))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="Multiplicateur des latences (0 = réponses instantanées)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    scenario = Scenario.load(Path(args.scenario), latency_scale=args.latency_scale, seed=args.seed)
+    server, thread = start_server(scenario, args.host, args.port)
+    print(f"✅ Serveur OpenAI simulé sur http://{args.host}:{args.port}/v1 ({len(scenario.rules)} règles)")
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Profil des imports d'un worker : temps d'import, mémoire résidente et sous-systèmes lourds
+chargés, mesurés dans un processus Python neuf par module (python -X importtime).
+
+Usage (depuis backend/) :
+    python -m benchmarks.import_profile [--modules agent.assistant,routes.agent] [--top 15]
+
+routes.agent construit l'assistant à l'import (base configurée nécessaire) ;
+agent.assistant seul mesure le coût des imports sans connexion.
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Sous-systèmes qui ne doivent être chargés qu'au premier usage
+HEAVY_MODULES = ["pandas", "matplotlib", "sklearn", "scipy", "fitz", "fpdf", "PIL", "tabulate", "openai", "langchain"]
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+PROBE = """
+import time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+import json, resource, sys
+heavy = {heavy!r}
+print(json.dumps({{
+    "import_ms": round(elapsed, 1),
+    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "modules": len(sys.modules),
+    "heavy_loaded": [name for name in heavy if name in sys.modules],
+}}))
+"""
+
+
+def profile_module(module: str, top: int):
+    """Importe le module dans un processus neuf et agrège la sortie de -X importtime"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        return {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "échec"}
+
+    cumulative_by_package = {}
+    slowest = []
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative_us, indent, name = match.groups()
+        cumulative_ms = int(cumulative_us) / 1000
+        # Niveau 1 de l'arbre d'import = modules importés directement par le processus
+        if len(indent) <= 2:
+            package = name.split('.')[0]
+            cumulative_by_package[package] = cumulative_by_package.get(package, 0) + cumulative_ms
+        slowest.append((cumulative_ms, name))
+
+    report = json.loads(process.stdout.strip().splitlines()[-1])
+    report["top_packages_ms"] = {
+        package: round(ms, 1)
+        for package, ms in sorted(cumulative_by_package.items(), key=lambda item: -item[1])[:top]
+    }
+    report["slowest_imports_ms"] = [
+        {"module": name, "cumulative_ms": round(ms, 1)} for ms, name in sorted(slowest, reverse=True)[:top]
+    ]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps d'import et mémoire d'un worker")
+    parser.add_argument('--modules', default='agent.assistant', help="Modules à importer, séparés par des virgules")
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    report = {module: profile_module(module, args.top) for module in args.modules.split(',')}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
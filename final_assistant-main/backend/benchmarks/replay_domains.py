@@ -0,0 +1,130 @@
+"""
+Évalue le classifieur local de domaines sur un jeu de questions étiquetées à la main,
+distinct des questions qui l'amorcent (caches SQL) : la précision n'est pas circulaire.
+
+Usage (depuis backend/) :
+    python -m benchmarks.replay_domains [--labels benchmarks/domain_questions.json] [--limit 50] [--llm]
+
+Le jeu étiqueté est une liste JSON de {"question": ..., "domains": [...]} ; les questions
+déjà présentes dans les caches SQL ou les templates sont écartées. --llm mesure aussi le
+LLM (chemin de repli) sur les mêmes étiquettes.
+
+Sans clé OpenAI, pointer le client vers le serveur simulé :
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake (voir benchmarks/fake_openai_server.py)
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from agent.domain_classifier import DomainClassifier, llm_select_domains, question_key
+from agent.llm_utils import ask_llm
+
+PROMPTS_DIR = BACKEND_DIR / 'agent' / 'prompts'
+CACHE_FILES = [BACKEND_DIR / 'sql_query_cache.json', BACKEND_DIR / 'sql_query_cache1.json']
+TEMPLATES_FILE = BACKEND_DIR / 'agent' / 'templates_questions.json'
+LABELS_FILE = BACKEND_DIR / 'benchmarks' / 'domain_questions.json'
+
+
+def _load_json(path: Path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return default
+
+
+def load_cached_queries():
+    """Retourne les couples (question, sql) des caches SQL"""
+    pairs = []
+    for cache_file in CACHE_FILES:
+        for item in _load_json(cache_file, {}).values():
+            pairs.append((item.get('question_template', ''), item.get('sql_template', '')))
+    return pairs
+
+
+def load_corpus(corpus_path, cached_queries):
+    """Construit le corpus de questions à rejouer (sans doublons, ordre conservé)"""
+    questions = [q for q, _ in cached_queries]
+    questions += [t.get('template_question', '') for t in _load_json(TEMPLATES_FILE, {}).get('questions', [])]
+
+    if corpus_path:
+        path = Path(corpus_path)
+        if path.suffix == '.json':
+            questions += _load_json(path, [])
+        else:
+            questions += path.read_text(encoding='utf-8').splitlines()
+
+    return list(dict.fromkeys(q.strip() for q in questions if q and q.strip()))
+
+
+def load_labelled(labels_path, training_questions):
+    """Questions étiquetées hors corpus d'amorçage : ([(question, domaines)], nb écartées)"""
+    seen = {question_key(q) for q in training_questions}
+    cases, overlap = [], 0
+    for item in _load_json(Path(labels_path), []):
+        question = (item.get('question') or '').strip()
+        if not question:
+            continue
+        if question_key(question) in seen:
+            overlap += 1
+            continue
+        cases.append((question, item.get('domains', [])))
+    return cases, overlap
+
+
+def llm_accuracy(cases, domain_descriptions):
+    """Accord exact et Jaccard moyen du LLM avec les étiquettes"""
+    exact, jaccard_sum, total = 0, 0.0, 0
+    for question, expected in cases:
+        try:
+            predicted = set(llm_select_domains(question, domain_descriptions, ask_llm))
+        except Exception as e:
+            print(f"⚠️ LLM indisponible pour '{question}': {e}", file=sys.stderr)
+            continue
+        total += 1
+        expected = set(expected)
+        exact += predicted == expected
+        union = predicted | expected
+        jaccard_sum += (len(predicted & expected) / len(union)) if union else 1.0
+    if not total:
+        return {"questions": 0}
+    return {"questions": total, "exact_match": round(exact / total, 3),
+            "mean_jaccard": round(jaccard_sum / total, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Précision du classifieur de domaines sur un jeu étiqueté")
+    parser.add_argument('--labels', default=str(LABELS_FILE), help="Questions étiquetées (.json)")
+    parser.add_argument('--limit', type=int, default=0, help="Nombre maximum de questions évaluées")
+    parser.add_argument('--llm', action='store_true', help="Évalue aussi le LLM sur les mêmes étiquettes")
+    args = parser.parse_args()
+
+    load_dotenv()
+    domain_descriptions = _load_json(PROMPTS_DIR / 'domain_descriptions.json', {})
+    domain_to_tables = _load_json(PROMPTS_DIR / 'domain_tables_mapping.json', {})
+    cached_queries = load_cached_queries()
+
+    # Pas de fichier d'exemples appris : on mesure le classifieur tel qu'amorcé
+    classifier = DomainClassifier(domain_descriptions, domain_to_tables,
+                                  examples_file=str(BACKEND_DIR / '.replay_domain_examples.json'),
+                                  cached_queries=cached_queries)
+
+    cases, overlap = load_labelled(args.labels, load_corpus(None, cached_queries))
+    if args.limit:
+        cases = cases[:args.limit]
+    labels = dict(cases)
+
+    report = {"classifier": classifier.evaluate(labels, labels.get), "excluded_overlap": overlap}
+    if args.llm:
+        report["llm"] = llm_accuracy(cases, domain_descriptions)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Rejoue des requêtes en cache volontairement cassées et compare l'étape repair avec l'ancien
+contexte (10 premières tables du schéma) et avec le contexte ciblé sur l'erreur MySQL.
+
+Usage (depuis backend/, base configurée) :
+    python -m benchmarks.replay_repairs [--limit 30]
+
+Chaque requête des caches SQL sans paramètre ({placeholder} non lié) est altérée (faute de frappe sur une colonne ou une table,
+préfixe d'alias supprimé), exécutée pour obtenir la vraie erreur MySQL, puis corrigée une
+fois avec chaque contexte ; la correction est réussie si la requête corrigée s'exécute.
+
+Sans clé OpenAI, pointer le client vers le serveur simulé :
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake (voir benchmarks/fake_openai_server.py)
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.replay_domains import load_cached_queries
+from agent.sql_params import PLACEHOLDER
+
+QUALIFIED_COLUMN = re.compile(r'\b(\w+)\.(\w{4,})\b')
+FROM_TABLE = re.compile(r'\bFROM\s+(\w{4,})', re.IGNORECASE)
+
+
+def _typo(name: str) -> str:
+    """Faute de frappe déterministe : deux lettres centrales inversées"""
+    middle = len(name) // 2
+    return name[:middle - 1] + name[middle] + name[middle - 1] + name[middle + 1:]
+
+
+def mutations(sql: str):
+    """Variantes cassées d'une requête : (type de mutation, sql altéré)"""
+    column = QUALIFIED_COLUMN.search(sql)
+    if column:
+        alias, name = column.groups()
+        yield "column_typo", sql[:column.start(2)] + _typo(name) + sql[column.end(2):]
+        yield "dropped_alias", sql[:column.start()] + name + sql[column.end():]
+    table = FROM_TABLE.search(sql)
+    if table:
+        yield "table_typo", sql[:table.start(1)] + _typo(table.group(1)) + sql[table.end(1):]
+
+
+def repair(assistant, bad_sql: str, error_msg: str, schema_context: str):
+    """Une correction par le LLM avec le contexte donné : (sql corrigé, taille du prompt)"""
+    from agent.llm_utils import chat_completion
+
+    prompt = assistant._build_repair_prompt(bad_sql, error_msg, schema_context)
+    response = chat_completion([{"role": "user", "content": prompt}], stage="repair", model=assistant.model)
+    corrected = assistant._clean_sql(response.choices[0].message.content)
+    return (corrected if corrected and assistant._validate_sql(corrected) else None), len(prompt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Taux de correction SQL au premier essai : contexte complet vs ciblé")
+    parser.add_argument('--limit', type=int, default=30, help="Nombre maximum de requêtes cassées rejouées")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from agent.assistant import SQLAssistant
+
+    assistant = SQLAssistant()
+    legacy_context = f"```json\n{json.dumps(assistant.schema[:10], indent=2)}\n```"
+    contexts = {
+        "legacy": lambda bad_sql, error: legacy_context,
+        "targeted": lambda bad_sql, error: assistant.sql_repair.build(bad_sql, error).text,
+    }
+    report = {name: {"attempts": 0, "fixed": 0, "llm_calls": 0, "prompt_chars": 0, "ms": 0.0}
+              for name in contexts}
+    by_mutation = {}
+
+    cases = templated = 0
+    for _, sql in load_cached_queries():
+        # Un template paramétré échoue avant même d'être altéré : l'erreur ne mesurerait pas la correction
+        if PLACEHOLDER.search(sql or ""):
+            templated += 1
+            continue
+        for mutation, bad_sql in mutations(sql or ""):
+            if args.limit and cases >= args.limit:
+                break
+            result = assistant.execute_sql_query(bad_sql)
+            if result["success"]:
+                continue
+            cases += 1
+            for name, build_context in contexts.items():
+                start = time.perf_counter()
+                corrected, prompt_chars = repair(assistant, bad_sql, result["error"],
+                                                 build_context(bad_sql, result["error"]))
+                fixed = bool(corrected) and assistant.execute_sql_query(corrected)["success"]
+                stats = report[name]
+                stats["attempts"] += 1
+                stats["fixed"] += int(fixed)
+                stats["llm_calls"] += 1
+                stats["prompt_chars"] += prompt_chars
+                stats["ms"] += (time.perf_counter() - start) * 1000
+                bucket = by_mutation.setdefault(mutation, {}).setdefault(name, {"attempts": 0, "fixed": 0})
+                bucket["attempts"] += 1
+                bucket["fixed"] += int(fixed)
+
+    for stats in report.values():
+        attempts = stats["attempts"] or 1
+        stats["first_repair_success_rate"] = round(stats["fixed"] / attempts, 3)
+        stats["avg_prompt_chars"] = round(stats.pop("prompt_chars") / attempts)
+        stats["avg_ms"] = round(stats.pop("ms") / attempts, 1)
+    report["by_mutation"] = by_mutation
+    report["skipped_templates"] = templated
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
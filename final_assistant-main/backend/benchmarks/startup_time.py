@@ -0,0 +1,72 @@
+"""
+Mesure le temps de construction de SQLAssistant (démarrage et /api/reinit) sans puis avec
+l'instantané de démarrage (data/assistant_snapshot.pkl).
+
+Usage (depuis backend/, base configurée) :
+    python -m benchmarks.startup_time [--runs 3]
+
+Les imports du processus ne sont pas comptés (voir benchmarks/import_profile.py) : seul
+__init__ est chronométré, après une première construction qui écrit l'instantané.
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _wait_for_refresh():
+    """Attend la fin des rafraîchissements d'instantané lancés par les constructions précédentes"""
+    for thread in threading.enumerate():
+        if thread.name == "snapshot-refresh":
+            thread.join()
+
+
+def measure(build, runs: int):
+    timings, restored = [], []
+    for _ in range(runs):
+        _wait_for_refresh()
+        start = time.perf_counter()
+        assistant = build()
+        timings.append((time.perf_counter() - start) * 1000)
+        restored = assistant.snapshot.stats["restored"]
+    return {
+        "runs": runs,
+        "init_ms_mean": round(statistics.mean(timings), 1),
+        "init_ms_min": round(min(timings), 1),
+        "init_ms_max": round(max(timings), 1),
+        "restored": restored,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps de démarrage de SQLAssistant avec et sans instantané")
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    load_dotenv()
+    import agent.startup_snapshot as startup_snapshot
+    from agent.assistant import SQLAssistant
+
+    startup_snapshot.SNAPSHOT_ENABLED = False
+    report = {"without_snapshot": measure(SQLAssistant, args.runs)}
+
+    startup_snapshot.SNAPSHOT_ENABLED = True
+    if not SQLAssistant().refresh_snapshot():
+        sys.exit("Écriture de l'instantané impossible")
+    report["with_snapshot"] = measure(SQLAssistant, args.runs)
+    report["snapshot"] = str(startup_snapshot.SNAPSHOT_PATH)
+
+    _wait_for_refresh()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,17 @@
 from flask_mysqldb import MySQL
 from langchain_community.utilities import SQLDatabase
 import MySQLdb
-from urllib.parse import quote_plus
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
 import os
 import logging
 from dotenv import load_dotenv
+import threading
 from contextlib import contextmanager
 
+from config.schema_catalog import SchemaCatalog
+from config.db_pool import ConnectionPool
+
 load_dotenv()
 
 mysql = MySQL()
@@ -14,6 +19,8 @@ logger = logging.getLogger(__name__)
 
 class CustomSQLDatabase(SQLDatabase):
     def execute_query(self, sql_query: str) -> dict:
+        connection = None
+        cursor = None
         try:
             connection = get_db()  
             cursor = connection.cursor()
@@ -30,9 +37,10 @@ class CustomSQLDatabase(SQLDatabase):
             return {"success": False, "error": str(e), "sql_query": sql_query}
 
         finally:
-            cursor.close()
-            # Ne ferme la connexion que si elle a été créée en direct
-            if hasattr(connection, '_direct_connection'):
+            if cursor:
+                cursor.close()
+            # Rend la connexion au pool
+            if connection:
                 connection.close()
 
 
@@ -45,20 +53,48 @@ class CustomSQLDatabase(SQLDatabase):
             return None
 
     def get_simplified_relations_text(self):
+        """Relations entre tables (clés étrangères du catalogue du schéma)"""
         try:
-            tables = self.run("SHOW TABLES")
-            relations = []
-            for table in tables:
-                table_name = list(table.values())[0]
-                relations.append(f"- {table_name}")
+            catalog = self.schema_catalog
+            catalog.ensure_fresh()
+            relations = [
+                f"- {fk.table}.{fk.column} = {fk.referenced_table}.{fk.referenced_column}"
+                for fk in catalog.foreign_keys
+            ]
             return "\n".join(["Relations entre tables:"] + relations)
         except Exception as e:
             logger.error(f"Erreur get_simplified_relations_text: {e}")
             return ""
 
+    @property
+    def schema_catalog(self) -> SchemaCatalog:
+        """Catalogue du schéma en mémoire, chargé au premier accès (une requête INFORMATION_SCHEMA)"""
+        if getattr(self, '_schema_catalog', None) is None:
+            self._schema_catalog = SchemaCatalog(lambda sql: self._execute(sql))
+        return self._schema_catalog
+
+    def get_table_signatures(self, table_names=None) -> str:
+        """
+        Signatures condensées des tables pour les prompts compacts : `table(col1*, col2, ...)`
+        (* = clé primaire), rendues depuis le catalogue du schéma.
+
+        Args:
+            table_names (list, optional): Tables à inclure. Si None, toutes les tables.
+
+        Returns:
+            str: Une ligne par table (chaîne vide en cas d'erreur)
+        """
+        try:
+            self.schema_catalog.ensure_fresh()
+            return self.schema_catalog.render_signatures(table_names or None)
+        except Exception as e:
+            logger.error(f"Erreur get_table_signatures: {e}")
+            return ""
+
     def get_table_info(self, table_names=None):
         """
         Récupère les informations des tables de la base de données
+        (rendu en mémoire depuis le catalogue du schéma, sans DESCRIBE par table)
         
         Args:
             table_names (list, optional): Liste des noms de tables spécifiques. 
@@ -68,41 +104,8 @@ class CustomSQLDatabase(SQLDatabase):
             str: Description des tables au format texte
         """
         try:
-            if table_names is None:
-                # Récupérer toutes les tables
-                tables_result = self.run("SHOW TABLES")
-                table_names = [list(table.values())[0] for table in tables_result]
-            
-            table_info = []
-            for table_name in table_names:
-                try:
-                    # Récupérer la structure de la table
-                    columns_result = self.run(f"DESCRIBE {table_name}")
-                    columns_info = []
-                    for column in columns_result:
-                        col_name = column.get('Field', '')
-                        col_type = column.get('Type', '')
-                        col_null = column.get('Null', '')
-                        col_key = column.get('Key', '')
-                        col_default = column.get('Default', '')
-                        
-                        column_desc = f"  - {col_name} ({col_type})"
-                        if col_null == 'NO':
-                            column_desc += " NOT NULL"
-                        if col_key == 'PRI':
-                            column_desc += " PRIMARY KEY"
-                        if col_default:
-                            column_desc += f" DEFAULT {col_default}"
-                        
-                        columns_info.append(column_desc)
-                    
-                    table_info.append(f"Table: {table_name}\n" + "\n".join(columns_info))
-                    
-                except Exception as e:
-                    logger.warning(f"Impossible de récupérer les infos pour la table {table_name}: {e}")
-                    continue
-            
-            return "\n\n".join(table_info) if table_info else "Aucune table trouvée"
+            self.schema_catalog.ensure_fresh()
+            return self.schema_catalog.render_table_info(table_names)
             
         except Exception as e:
             logger.error(f"Erreur get_table_info: {e}")
@@ -128,10 +131,8 @@ def init_db(app):
         if missing_vars:
             logger.warning(f"⚠️ Variables manquantes: {missing_vars} - Utilisation des valeurs par défaut")
 
-        # Test de connexion directe uniquement
-        test_connection = create_direct_connection()
-        if test_connection:
-            test_connection.close()
+        # Ouverture des connexions initiales du pool (échoue si MySQL est injoignable)
+        if get_pool().prefill():
             logger.info("✅ Configuration MySQL initialisée et testée")
             # Retourner un objet mock pour Flask-MySQLdb
             return type('MockMySQL', (), {'connection': None})()
@@ -142,20 +143,58 @@ def init_db(app):
         logger.error(f"❌ Erreur init MySQL: {e}")
         raise
 
-# ✅ Connexion directe via MySQLdb
+def _connect():
+    """Connexion MySQLdb physique (encodage latin1 compatible)"""
+    return MySQLdb.connect(
+        host=os.getenv('MYSQL_HOST', 'localhost'),
+        user=os.getenv('MYSQL_USER', 'root'),
+        passwd=os.getenv('MYSQL_PASSWORD', 'infosef'),
+        db=os.getenv('MYSQL_DATABASE', 'bd_eduise'),
+        cursorclass=MySQLdb.cursors.DictCursor,
+        autocommit=True,
+        connect_timeout=10,
+        charset='latin1'
+    )
+
+def _reset(connection):
+    """Rétablit l'autocommit (SQLAlchemy peut le désactiver) avant le retour au pool"""
+    if not connection.get_autocommit():
+        connection.rollback()
+        connection.autocommit(True)
+
+# ✅ Pool de connexions partagé par get_db et par le moteur SQLAlchemy (LangChain)
+_pool = None
+_engine = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(_connect, reset=_reset)
+    return _pool
+
+def get_engine():
+    """
+    Moteur SQLAlchemy (driver MySQLdb) adossé au pool : NullPool sans pool propre,
+    chaque connexion SQLAlchemy est empruntée au pool partagé et lui est rendue
+    """
+    global _engine
+    if _engine is None:
+        with _pool_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    "mysql+mysqldb://",
+                    creator=lambda: get_pool().acquire(cursorclass=MySQLdb.cursors.Cursor, client="sqlalchemy"),
+                    poolclass=NullPool,
+                )
+    return _engine
+
+# ✅ Connexion directe via MySQLdb (hors pool)
 def create_direct_connection():
     try:
-        # Configuration de base avec encodage latin1 compatible
-        connection = MySQLdb.connect(
-            host=os.getenv('MYSQL_HOST', 'localhost'),
-            user=os.getenv('MYSQL_USER', 'root'),
-            passwd=os.getenv('MYSQL_PASSWORD', 'infosef'),
-            db=os.getenv('MYSQL_DATABASE', 'bd_eduise'),
-            cursorclass=MySQLdb.cursors.DictCursor,
-            autocommit=True,
-            connect_timeout=10,
-            charset='latin1'
-        )
+        connection = _connect()
         connection._direct_connection = True  # Marqueur pour fermeture plus tard
         logger.debug("✅ Connexion MySQL directe créée")
         return connection
@@ -163,26 +202,13 @@ def create_direct_connection():
         logger.error(f"❌ Erreur connexion MySQL directe: {e}")
         return None
 
-# ✅ Utilisation dans contexte Flask ou fallback direct
+# ✅ Connexion empruntée au pool : close() la rend au pool
 def get_db():
     try:
-        from flask import current_app
-        if current_app and hasattr(current_app, 'extensions') and 'mysql' in current_app.extensions:
-            mysql_connection = current_app.extensions['mysql'].connection
-            if mysql_connection:
-                try:
-                    cursor = mysql_connection.cursor()
-                    cursor.execute("SELECT 1")
-                    cursor.close()
-                    logger.debug("✅ Connexion Flask MySQL OK")
-                    return mysql_connection
-                except Exception as test_error:
-                    logger.warning(f"⚠️ Connexion Flask MySQL échouée: {test_error}")
+        return get_pool().acquire()
     except Exception as e:
-        logger.warning(f"⚠️ Contexte Flask indisponible: {e}")
-
-    logger.info("🔄 Utilisation de la connexion directe")
-    return create_direct_connection()
+        logger.error(f"❌ Connexion MySQL indisponible: {e}")
+        return None
 
 # ✅ Context manager pour les requêtes SQL
 @contextmanager
@@ -202,15 +228,15 @@ def get_db_cursor():
     finally:
         if cursor:
             cursor.close()
-        if connection and hasattr(connection, '_direct_connection'):
+        if connection:
             connection.close()
-            logger.debug("✅ Connexion directe fermée")
+            logger.debug("✅ Connexion rendue au pool")
 
 # ✅ Intégration LangChain
 def get_db_connection():
     try:
         db_user = os.getenv('MYSQL_USER')
-        db_password = quote_plus(os.getenv('MYSQL_PASSWORD'))
+        db_password = os.getenv('MYSQL_PASSWORD')
         db_host = os.getenv('MYSQL_HOST')
         db_name = os.getenv('MYSQL_DATABASE')
 
@@ -218,8 +244,10 @@ def get_db_connection():
             logger.error("❌ Variables de connexion DB manquantes")
             raise ValueError("Variables de connexion DB manquantes")
 
-        db_uri = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}?charset=latin1"
-        db = CustomSQLDatabase.from_uri(db_uri)
+        # Même driver, même configuration et même pool que get_db.
+        # Réflexion paresseuse : les descriptions de tables viennent du catalogue du schéma,
+        # inutile de refléter toutes les tables SQLAlchemy au démarrage
+        db = CustomSQLDatabase(get_engine(), lazy_table_reflection=True)
         
         # Test de connexion
         test_result = db.run("SELECT 1 as test")
@@ -0,0 +1,254 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Attente maximale d'une connexion libre quand le pool est plein (secondes)
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Durée de vie maximale d'une connexion (reste sous wait_timeout MySQL)
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+# Ping de validation seulement pour une connexion inactive depuis plus longtemps
+POOL_PING_AFTER_IDLE = float(os.getenv("DB_POOL_PING_AFTER_IDLE", "30"))
+
+
+class PoolTimeoutError(Exception):
+    """Aucune connexion libre dans le délai imparti"""
+
+
+class _Entry:
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = self.last_used = time.monotonic()
+
+
+class PooledConnection:
+    """
+    Connexion empruntée au pool : délègue tout à la connexion MySQLdb, et close() la rend
+    au pool au lieu de la fermer. Le marqueur _direct_connection est conservé pour que le
+    code existant (« fermer si connexion directe ») rende bien la connexion.
+    `cursorclass` remplace la classe de curseur par défaut (SQLAlchemy attend des tuples).
+    """
+
+    _direct_connection = True
+
+    def __init__(self, pool: "ConnectionPool", entry: _Entry, cursorclass=None):
+        self._pool = pool
+        self._entry = entry
+        self._cursorclass = cursorclass
+
+    def __getattr__(self, attribute: str):
+        entry = self.__dict__.get("_entry")
+        if entry is None:
+            raise AttributeError(f"Connexion déjà rendue au pool ({attribute})")
+        return getattr(entry.raw, attribute)
+
+    @property
+    def raw(self):
+        return self._entry.raw if self._entry else None
+
+    def cursor(self, *args, **kwargs):
+        if not args and not kwargs and self._cursorclass is not None:
+            return self.raw.cursor(self._cursorclass)
+        return self.raw.cursor(*args, **kwargs)
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Filet de sécurité : une connexion oubliée revient au pool au ramasse-miettes
+        if self.__dict__.get("_entry") is not None:
+            logger.warning("⚠️ Connexion MySQL non rendue explicitement, retour au pool")
+            self.close()
+
+
+class ConnectionPool:
+    """
+    Pool de connexions MySQL borné et thread-safe : min_size connexions ouvertes à l'avance,
+    au plus max_size, attente limitée quand tout est emprunté, connexions renouvelées
+    après max_lifetime et validées par ping seulement après une inactivité prolongée.
+    """
+
+    def __init__(self, factory: Callable[[], Any], min_size: int = POOL_MIN_SIZE,
+                 max_size: int = POOL_MAX_SIZE, checkout_timeout: float = POOL_CHECKOUT_TIMEOUT,
+                 max_lifetime: float = POOL_MAX_LIFETIME, ping_after_idle: float = POOL_PING_AFTER_IDLE,
+                 reset: Optional[Callable[[Any], None]] = None):
+        self.factory = factory
+        self.reset = reset
+        self.max_size = max(1, max_size)
+        self.min_size = max(0, min(min_size, self.max_size))
+        self.checkout_timeout = checkout_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after_idle = ping_after_idle
+        self._idle: Deque[_Entry] = deque()
+        self._size = 0
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self.stats = {
+            "checkouts": 0, "created": 0, "closed": 0, "expired": 0, "pings": 0, "ping_failures": 0,
+            "timeouts": 0, "connect_errors": 0, "waits": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+            "peak_in_use": 0,
+        }
+        # Emprunts par client (MySQLdb direct, SQLAlchemy/LangChain)
+        self.checkouts_by_client: Dict[str, int] = {}
+
+    # ---- Ouverture / fermeture des connexions physiques ----
+
+    def _open(self) -> _Entry:
+        try:
+            raw = self.factory()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self.stats["connect_errors"] += 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.stats["created"] += 1
+        return _Entry(raw)
+
+    def _discard(self, entry: _Entry, reason: str):
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._size -= 1
+            self.stats["closed"] += 1
+            self.stats[reason] = self.stats.get(reason, 0) + 1
+            self._condition.notify()
+
+    def _usable(self, entry: _Entry) -> bool:
+        """Durée de vie puis ping (uniquement après inactivité) ; la connexion est fermée sinon"""
+        now = time.monotonic()
+        if self.max_lifetime and now - entry.created_at > self.max_lifetime:
+            self._discard(entry, "expired")
+            return False
+        if now - entry.last_used > self.ping_after_idle:
+            with self._condition:
+                self.stats["pings"] += 1
+            try:
+                entry.raw.ping()
+            except Exception as e:
+                logger.info(f"🔌 Connexion MySQL inactive invalide, remplacée: {e}")
+                self._discard(entry, "ping_failures")
+                return False
+        return True
+
+    def prefill(self) -> "ConnectionPool":
+        """Ouvre les min_size connexions initiales"""
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    break
+                self._size += 1
+            entry = self._open()
+            with self._condition:
+                self._idle.append(entry)
+                self._condition.notify()
+        logger.info(f"✅ Pool MySQL prêt: {self._size} connexion(s) (max {self.max_size})")
+        return self
+
+    # ---- Emprunt / restitution ----
+
+    def acquire(self, timeout: Optional[float] = None, cursorclass=None,
+                client: str = "mysqldb") -> PooledConnection:
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        while True:
+            entry, create = None, False
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Aucune connexion MySQL libre après {timeout:.1f}s "
+                            f"({self._in_use}/{self.max_size} empruntées)"
+                        )
+                    waited = True
+                    self._condition.wait(remaining)
+                if self._idle:
+                    # LIFO : la connexion la plus récemment utilisée évite le ping
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                entry = self._open()
+            elif not self._usable(entry):
+                continue
+
+            with self._condition:
+                self._in_use += 1
+                self.stats["checkouts"] += 1
+                self.checkouts_by_client[client] = self.checkouts_by_client.get(client, 0) + 1
+                self.stats["peak_in_use"] = max(self.stats["peak_in_use"], self._in_use)
+                if waited:
+                    wait_ms = (time.monotonic() - start) * 1000
+                    self.stats["waits"] += 1
+                    self.stats["wait_ms_total"] += wait_ms
+                    self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+            return PooledConnection(self, entry, cursorclass)
+
+    def _release(self, entry: _Entry):
+        with self._condition:
+            self._in_use -= 1
+        if not getattr(entry.raw, "open", True):
+            self._discard(entry, "closed_by_server")
+            return
+        if self.reset is not None:
+            # État de session rétabli (transaction ouverte, autocommit) avant réutilisation
+            try:
+                self.reset(entry.raw)
+            except Exception as e:
+                logger.info(f"🔌 Connexion MySQL non réinitialisable, fermée: {e}")
+                self._discard(entry, "reset_failures")
+                return
+        entry.last_used = time.monotonic()
+        with self._condition:
+            self._idle.append(entry)
+            self._condition.notify()
+
+    def close_all(self):
+        """Ferme les connexions inactives (les connexions empruntées le seront à leur retour)"""
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for entry in idle:
+            self._discard(entry, "closed_on_shutdown")
+
+    def describe(self) -> Dict[str, Any]:
+        with self._condition:
+            waits = self.stats["waits"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "checkout_timeout_s": self.checkout_timeout,
+                "max_lifetime_s": self.max_lifetime,
+                "ping_after_idle_s": self.ping_after_idle,
+                **{key: value for key, value in self.stats.items() if key not in ("wait_ms_total", "wait_ms_max")},
+                "checkouts_by_client": dict(self.checkouts_by_client),
+                "avg_wait_ms": round(self.stats["wait_ms_total"] / waits, 1) if waits else 0.0,
+                "max_wait_ms": round(self.stats["wait_ms_max"], 1),
+            }
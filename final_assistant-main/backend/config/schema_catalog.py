@@ -0,0 +1,258 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Any, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Délai minimal entre deux vérifications de l'empreinte du schéma
+CHECK_INTERVAL_SECONDS = float(os.getenv("SCHEMA_CATALOG_CHECK_INTERVAL", "300"))
+
+COLUMNS_QUERY = """
+    SELECT c.TABLE_NAME AS table_name, c.COLUMN_NAME AS column_name, c.ORDINAL_POSITION AS position,
+           c.DATA_TYPE AS data_type, c.COLUMN_TYPE AS column_type, c.IS_NULLABLE AS is_nullable,
+           c.COLUMN_KEY AS column_key, c.COLUMN_DEFAULT AS column_default, c.EXTRA AS extra,
+           c.COLUMN_COMMENT AS column_comment, t.TABLE_TYPE AS table_type
+    FROM INFORMATION_SCHEMA.COLUMNS c
+    LEFT JOIN INFORMATION_SCHEMA.TABLES t
+           ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    WHERE c.TABLE_SCHEMA = DATABASE()
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+FOREIGN_KEYS_QUERY = """
+    SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name,
+           REFERENCED_TABLE_NAME AS referenced_table, REFERENCED_COLUMN_NAME AS referenced_column
+    FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY TABLE_NAME, COLUMN_NAME
+"""
+
+# Empreinte calculée côté serveur : une seule ligne, sans rapatrier les colonnes
+FINGERPRINT_QUERY = """
+    SELECT COUNT(*) AS column_count,
+           SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE,
+                               IS_NULLABLE, COLUMN_KEY, IFNULL(COLUMN_DEFAULT, '')))) AS checksum
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    name: str
+    data_type: str
+    column_type: str
+    nullable: bool
+    key: str = ""
+    default: Optional[str] = None
+    extra: str = ""
+    comment: str = ""
+
+    @property
+    def is_primary(self) -> bool:
+        return self.key == "PRI"
+
+    def describe(self) -> str:
+        """Ligne de description au format historique de get_table_info (DESCRIBE)"""
+        text = f"  - {self.name} ({self.column_type})"
+        if not self.nullable:
+            text += " NOT NULL"
+        if self.is_primary:
+            text += " PRIMARY KEY"
+        if self.default:
+            text += f" DEFAULT {self.default}"
+        return text
+
+
+@dataclass(frozen=True)
+class ForeignKeyInfo:
+    table: str
+    column: str
+    referenced_table: str
+    referenced_column: str
+
+
+@dataclass
+class TableInfo:
+    name: str
+    columns: List[ColumnInfo] = field(default_factory=list)
+    is_view: bool = False
+
+    @property
+    def primary_key(self) -> List[str]:
+        return [column.name for column in self.columns if column.is_primary]
+
+    def column(self, name: str) -> Optional[ColumnInfo]:
+        name = name.lower()
+        return next((column for column in self.columns if column.name.lower() == name), None)
+
+    def render(self, columns: Optional[List[ColumnInfo]] = None) -> str:
+        """Description de la table (toutes les colonnes, ou le sous-ensemble donné)"""
+        columns = self.columns if columns is None else columns
+        return f"Table: {self.name}\n" + "\n".join(column.describe() for column in columns)
+
+    def signature(self) -> str:
+        """Forme condensée `table(col1*, col2)` (* = clé primaire)"""
+        return f"{self.name}({', '.join(c.name + ('*' if c.is_primary else '') for c in self.columns)})"
+
+
+class SchemaCatalog:
+    """
+    Catalogue du schéma en mémoire : une requête INFORMATION_SCHEMA.COLUMNS charge toutes
+    les tables, puis les rendus (table_info, signatures) se font sans accès à la base.
+    Le catalogue est rechargé quand l'empreinte du schéma (checksum des définitions de
+    colonnes) change ; la vérification est limitée à une fois par intervalle.
+    """
+
+    def __init__(self, fetch: Callable[[str], List[Dict[str, Any]]],
+                 check_interval: float = CHECK_INTERVAL_SECONDS):
+        self._fetch = fetch
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._tables: Dict[str, TableInfo] = {}
+        self.foreign_keys: List[ForeignKeyInfo] = []
+        self.fingerprint: Optional[str] = None
+        self.version = 0
+        self.loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def _remote_fingerprint(self) -> str:
+        row = (self._fetch(FINGERPRINT_QUERY) or [{}])[0]
+        return f"{row.get('column_count', 0)}:{row.get('checksum') or 0}"
+
+    def load(self) -> "SchemaCatalog":
+        """Charge (ou recharge) toutes les tables en une requête"""
+        with self._lock:
+            start = time.perf_counter()
+            fingerprint = self._remote_fingerprint()
+            rows = self._fetch(COLUMNS_QUERY)
+
+            tables: Dict[str, TableInfo] = {}
+            for row in rows:
+                table_name = row['table_name']
+                table = tables.setdefault(
+                    table_name.lower(), TableInfo(table_name, is_view=row.get('table_type') == 'VIEW')
+                )
+                table.columns.append(ColumnInfo(
+                    name=row['column_name'],
+                    data_type=(row.get('data_type') or '').lower(),
+                    column_type=row.get('column_type') or '',
+                    nullable=row.get('is_nullable') == 'YES',
+                    key=row.get('column_key') or '',
+                    default=None if row.get('column_default') is None else str(row['column_default']),
+                    extra=row.get('extra') or '',
+                    comment=row.get('column_comment') or '',
+                ))
+
+            self._tables = tables
+            self.foreign_keys = self._load_foreign_keys()
+            self.fingerprint = fingerprint
+            self.version += 1
+            self.loaded_at = self._checked_at = time.time()
+            logger.info(
+                f"✅ Catalogue du schéma chargé: {len(tables)} tables, {len(rows)} colonnes "
+                f"({(time.perf_counter() - start) * 1000:.0f} ms, v{self.version})"
+            )
+            return self
+
+    def _load_foreign_keys(self) -> List[ForeignKeyInfo]:
+        """Clés étrangères déclarées (une requête KEY_COLUMN_USAGE) ; liste vide en cas d'erreur"""
+        try:
+            return [
+                ForeignKeyInfo(row['table_name'], row['column_name'], row['referenced_table'], row['referenced_column'])
+                for row in self._fetch(FOREIGN_KEYS_QUERY)
+            ]
+        except Exception as e:
+            logger.warning(f"⚠️ Clés étrangères indisponibles: {e}")
+            return []
+
+    def export_state(self) -> Dict[str, Any]:
+        """État sérialisable du catalogue (instantané de démarrage)"""
+        with self._lock:
+            return {
+                "tables": self._tables,
+                "foreign_keys": self.foreign_keys,
+                "fingerprint": self.fingerprint,
+                "loaded_at": self.loaded_at,
+            }
+
+    def restore(self, state: Dict[str, Any]) -> bool:
+        """
+        Restaure le catalogue depuis un instantané, sans accès à la base.
+        L'empreinte est revérifiée au prochain ensure_fresh(force=True) (rafraîchissement en arrière-plan).
+        """
+        if not state or not state.get("tables"):
+            return False
+        with self._lock:
+            self._tables = state["tables"]
+            self.foreign_keys = state.get("foreign_keys", [])
+            self.fingerprint = state.get("fingerprint")
+            self.version += 1
+            self.loaded_at = state.get("loaded_at", 0.0)
+            self._checked_at = time.time()
+        logger.info(f"⚡ Catalogue du schéma restauré depuis l'instantané: {len(self._tables)} tables (v{self.version})")
+        return True
+
+    def ensure_fresh(self, force: bool = False) -> bool:
+        """Recharge si le schéma a changé ; True si un rechargement a eu lieu"""
+        with self._lock:
+            if not self._tables:
+                self.load()
+                return True
+            if not force and time.time() - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = time.time()
+            try:
+                fingerprint = self._remote_fingerprint()
+            except Exception as e:
+                logger.warning(f"⚠️ Vérification de l'empreinte du schéma impossible: {e}")
+                return False
+            if fingerprint == self.fingerprint:
+                return False
+            logger.info(f"🔄 Schéma modifié ({self.fingerprint} → {fingerprint}), rechargement du catalogue")
+            self.load()
+            return True
+
+    @property
+    def tables(self) -> Dict[str, TableInfo]:
+        return self._tables
+
+    def get(self, table_name: str) -> Optional[TableInfo]:
+        return self._tables.get(table_name.lower())
+
+    def table_names(self) -> List[str]:
+        return [table.name for _, table in sorted(self._tables.items())]
+
+    def _select(self, table_names: Optional[Iterable[str]], warn_missing: bool = False) -> List[TableInfo]:
+        keys = [t.lower() for t in table_names] if table_names is not None else sorted(self._tables)
+        selected = []
+        for key in dict.fromkeys(keys):
+            table = self._tables.get(key)
+            if table is None:
+                if warn_missing:
+                    logger.warning(f"Table inconnue du catalogue: {key}")
+                continue
+            selected.append(table)
+        return selected
+
+    def render_table_info(self, table_names: Optional[Iterable[str]] = None) -> str:
+        """Description des tables (toutes si None), au format historique de get_table_info"""
+        rendered = [table.render() for table in self._select(table_names, warn_missing=True)]
+        return "\n\n".join(rendered) if rendered else "Aucune table trouvée"
+
+    def render_signatures(self, table_names: Optional[Iterable[str]] = None) -> str:
+        return "\n".join(table.signature() for table in self._select(table_names))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "tables": len(self._tables),
+            "columns": sum(len(table.columns) for table in self._tables.values()),
+            "views": sum(table.is_view for table in self._tables.values()),
+            "foreign_keys": len(self.foreign_keys),
+            "fingerprint": self.fingerprint,
+            "version": self.version,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)) if self.loaded_at else None,
+        }
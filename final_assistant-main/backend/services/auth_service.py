@@ -81,3 +81,9 @@ class AuthService:
         except Exception as e:
             current_app.logger.error(f"❌ Erreur authentification: {str(e)}")
             return None
+        finally:
+            # Rend la connexion au pool
+            if cursor:
+                cursor.close()
+            if connection:
+                connection.close()
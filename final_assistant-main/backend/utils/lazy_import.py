@@ -0,0 +1,58 @@
+import time
+import logging
+import importlib
+import threading
+from types import ModuleType
+from typing import Callable, Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+# Modules lourds réellement chargés : nom → durée d'import (ms) et date
+_loaded: Dict[str, Dict[str, Any]] = {}
+_lock = threading.RLock()
+
+
+class LazyModule:
+    """
+    Module importé au premier accès à l'un de ses attributs (pandas, matplotlib...).
+    Les sous-systèmes lourds ne coûtent rien au démarrage des workers qui ne s'en servent pas.
+    """
+
+    def __init__(self, name: str, before_import: Optional[Callable[[], None]] = None):
+        self._name = name
+        self._before_import = before_import
+        self._module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    if self._before_import is not None:
+                        self._before_import()
+                    module = importlib.import_module(self._name)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    _loaded[self._name] = {
+                        "import_ms": round(elapsed, 1),
+                        "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    }
+                    logger.info(f"📦 Import différé de {self._name} ({elapsed:.0f} ms)")
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self) -> str:
+        state = "chargé" if self._module is not None else "non chargé"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_import(name: str, before_import: Optional[Callable[[], None]] = None) -> LazyModule:
+    return LazyModule(name, before_import)
+
+
+def loaded_lazy_modules() -> Dict[str, Dict[str, Any]]:
+    """Modules différés déjà importés par ce processus (pour /api/status et les benchmarks)"""
+    with _lock:
+        return dict(_loaded)
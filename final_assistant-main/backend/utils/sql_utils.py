@@ -0,0 +1,36 @@
+import re
+import hashlib
+
+# Littéraux chaîne ('...' ou "...", avec échappements) conservés tels quels
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+PUNCTUATION_SPACES = re.compile(r'\s*([(),=<>!+\-*/])\s*')
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Forme canonique d'une requête pour la comparaison : commentaires, backticks,
+    point-virgule final et espaces superflus retirés, mots-clés et identifiants
+    en minuscules (les littéraux chaîne gardent leur casse).
+    """
+    if not sql:
+        return ""
+
+    def code(segment: str) -> str:
+        segment = re.sub(r'--[^\n]*|#[^\n]*|/\*.*?\*/', ' ', segment, flags=re.S)
+        segment = re.sub(r'\s+', ' ', segment.replace('`', '').lower())
+        return PUNCTUATION_SPACES.sub(r'\1', segment)
+
+    parts, last = [], 0
+    for match in STRING_LITERAL.finditer(sql):
+        literal = match.group(0)
+        parts.append(code(sql[last:match.start()]))
+        parts.append("'" + literal[1:-1] + "'" if literal.startswith('"') else literal)
+        last = match.end()
+    parts.append(code(sql[last:]))
+
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def sql_fingerprint(sql: str) -> str:
+    """Empreinte d'une requête : deux requêtes de même forme canonique ont la même empreinte"""
+    return hashlib.sha1(normalize_sql(sql).encode('utf-8')).hexdigest()